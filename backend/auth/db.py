@@ -0,0 +1,228 @@
+'''
+Shared database access: a lazily created, process-wide connection pool.
+The pool lives at module level, so warm invocations of the function reuse
+already authenticated connections instead of reconnecting on every request.
+With DATABASE_REPLICA_URLS set, reads can be served by read-only pools on
+the replicas (round robin, falling back to the primary when a replica is
+unreachable or saturated); runtime.Request decides which requests may use
+them. A replica that fails to connect is skipped for
+REPLICA_COOLDOWN_SECONDS, so an outage costs one short connect timeout
+rather than one per read.
+Identical copies live in every function directory (functions are deployed
+in isolation and cannot import each other).
+'''
+
+import itertools
+import os
+import threading
+import time
+from typing import List, Optional, Set
+import psycopg2
+import psycopg2.extensions
+from telemetry import TracedCursor
+
+POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+POOL_MAX_AGE = float(os.environ.get('DB_POOL_MAX_AGE', '600'))
+POOL_MAX_IDLE = float(os.environ.get('DB_POOL_MAX_IDLE', '30'))
+POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '10'))
+REPLICA_URLS = [dsn.strip() for dsn in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if dsn.strip()]
+REPLICA_PIN_SECONDS = float(os.environ.get('REPLICA_PIN_SECONDS', '10'))
+REPLICA_CONNECT_TIMEOUT = int(os.environ.get('DB_REPLICA_CONNECT_TIMEOUT', '2'))
+REPLICA_POOL_TIMEOUT = float(os.environ.get('DB_REPLICA_POOL_TIMEOUT', '0.1'))
+REPLICA_COOLDOWN = float(os.environ.get('REPLICA_COOLDOWN_SECONDS', '30'))
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class PooledConnection(psycopg2.extensions.connection):
+    '''
+    Connection that remembers its pool and when it was opened and last
+    handed back. Its cursors report statements to the current request trace.
+    `prepared` names the statements PREPAREd in this session (statements.py).
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cursor_factory = TracedCursor
+        self.pool: Optional['ConnectionPool'] = None
+        self.prepared: Set[str] = set()
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+
+class ConnectionPool:
+    '''
+    Bounded LIFO pool. Connections older than max_age are recycled, and
+    connections idle for longer than max_idle are health-checked with a
+    cheap round trip before being handed out again. A read_only pool
+    opens its sessions with default_transaction_read_only, so a write routed
+    to a replica fails loudly instead of diverging. `connect_timeout` bounds
+    how long opening a connection may block (libpq, whole seconds).
+    '''
+
+    def __init__(self, dsn: str, max_size: int = POOL_MAX_SIZE, max_age: float = POOL_MAX_AGE,
+                 max_idle: float = POOL_MAX_IDLE, timeout: float = POOL_TIMEOUT, read_only: bool = False,
+                 connect_timeout: Optional[int] = None):
+        self.dsn = dsn
+        self.read_only = read_only
+        self.connect_timeout = connect_timeout
+        # Monotonic time until which the pool is treated as unreachable.
+        self.down_until = 0.0
+        self.max_size = max(1, max_size)
+        self.max_age = max_age
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self._idle: List[PooledConnection] = []
+        self._size = 0
+        self._cond = threading.Condition()
+
+    def _connect(self) -> PooledConnection:
+        if self.connect_timeout is not None:
+            return psycopg2.connect(self.dsn, connection_factory=PooledConnection,
+                                    connect_timeout=self.connect_timeout)
+        return psycopg2.connect(self.dsn, connection_factory=PooledConnection)
+
+    def _open(self) -> PooledConnection:
+        conn = self._connect()
+        conn.pool = self
+        # Timestamps are always read back as UTC, so responses do not depend
+        # on the server's zone.
+        with conn.cursor() as cur:
+            cur.execute("SET TIME ZONE 'UTC'")
+            if self.read_only:
+                cur.execute('SET default_transaction_read_only = on')
+        conn.commit()
+        return conn
+
+    def _expired(self, conn: PooledConnection, now: float) -> bool:
+        return bool(conn.closed) or now - conn.created_at > self.max_age
+
+    def _healthy(self, conn: PooledConnection, now: float) -> bool:
+        if now - conn.last_used <= self.max_idle:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn: PooledConnection) -> None:
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    def acquire(self) -> PooledConnection:
+        deadline = time.monotonic() + self.timeout
+        while True:
+            conn: Optional[PooledConnection] = None
+            with self._cond:
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeout('Нет свободных соединений с базой данных')
+                    self._cond.wait(remaining)
+                if self._idle:
+                    conn = self._idle.pop()
+                else:
+                    self._size += 1
+
+            if conn is None:
+                try:
+                    return self._open()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+
+            now = time.monotonic()
+            if not self._expired(conn, now) and self._healthy(conn, now):
+                return conn
+            self._discard(conn)
+
+    def release(self, conn: PooledConnection, discard: bool = False) -> None:
+        if not discard and not conn.closed:
+            status = conn.get_transaction_status()
+            if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                discard = True
+            elif status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    discard = True
+
+        if discard or self._expired(conn, time.monotonic()):
+            self._discard(conn)
+            return
+
+        conn.last_used = time.monotonic()
+        with self._cond:
+            self._idle.append(conn)
+            self._cond.notify()
+
+    def close(self) -> None:
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+        for conn in idle:
+            try:
+                conn.close()
+            except psycopg2.Error:
+                pass
+
+
+_pool: Optional[ConnectionPool] = None
+_replica_pools: Optional[List[ConnectionPool]] = None
+_replica_turn = itertools.count()
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(os.environ['DATABASE_URL'])
+    return _pool
+
+
+def get_replica_pools() -> List[ConnectionPool]:
+    global _replica_pools
+    if _replica_pools is None:
+        with _pool_lock:
+            if _replica_pools is None:
+                _replica_pools = [
+                    ConnectionPool(dsn, timeout=REPLICA_POOL_TIMEOUT, read_only=True,
+                                   connect_timeout=REPLICA_CONNECT_TIMEOUT)
+                    for dsn in REPLICA_URLS
+                ]
+    return _replica_pools
+
+
+def get_db_connection(replica: bool = False) -> PooledConnection:
+    now = time.monotonic()
+    pools = [pool for pool in get_replica_pools() if pool.down_until <= now] if replica else []
+    if pools:
+        pool = pools[next(_replica_turn) % len(pools)]
+        try:
+            return pool.acquire()
+        except psycopg2.OperationalError:
+            # An unreachable replica must not fail reads, nor slow down the
+            # next ones: skip it until the cooldown has passed.
+            pool.down_until = time.monotonic() + REPLICA_COOLDOWN
+        except PoolTimeout:
+            # Saturated: this read goes to the primary, the replica stays in.
+            pass
+    return get_pool().acquire()
+
+
+def release_db_connection(conn: PooledConnection, discard: bool = False) -> None:
+    (conn.pool or get_pool()).release(conn, discard)
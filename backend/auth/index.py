@@ -4,252 +4,167 @@ Args: event with httpMethod, body; context with request_id
 Returns: HTTP response with user data or error
 '''
 
-import json
-import os
-import hashlib
-import secrets
-from typing import Dict, Any, Optional
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from typing import Dict, Any
+from runtime import Request, Router, error, response
+from passwords import KdfBusy, hash_password, needs_rehash, run_kdf, verify_password
+from versions import bump_versions
+from sessions import issue_token, revoke
 
-def hash_password(password: str) -> str:
-    salt = secrets.token_hex(16)
-    pwd_hash = hashlib.sha256((password + salt).encode()).hexdigest()
-    return f"{salt}:{pwd_hash}"
+USER_COLUMNS = '''u.id, u.username, u.avatar_url, u.bio,
+    COALESCE(st.subscribers_count, 0) AS subscribers_count, COALESCE(st.likes_count, 0) AS likes_count,
+    COALESCE(st.publications_count, 0) AS publications_count, u.dark_theme, u.sound_enabled'''
 
-def verify_password(password: str, stored_hash: str) -> bool:
-    salt, pwd_hash = stored_hash.split(':')
-    check_hash = hashlib.sha256((password + salt).encode()).hexdigest()
-    return check_hash == pwd_hash
+router = Router('GET, POST, PUT, OPTIONS')
 
-def get_db_connection():
-    return psycopg2.connect(os.environ['DATABASE_URL'])
+@router.error_handler(KdfBusy)
+def kdf_busy(e: KdfBusy) -> Dict[str, Any]:
+    return error(503, str(e), {'Retry-After': '1'})
 
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
-    method: str = event.get('httpMethod', 'GET')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, PUT, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
-    
-    headers = {
-        'Content-Type': 'application/json',
-        'Access-Control-Allow-Origin': '*'
-    }
-    
-    try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        
-        if method == 'POST':
-            body = json.loads(event.get('body', '{}'))
-            action = body.get('action')
-            
-            if action == 'register':
-                username = body.get('username', '').strip()
-                password = body.get('password', '')
-                
-                if not username or not password:
-                    return {
-                        'statusCode': 400,
-                        'headers': headers,
-                        'body': json.dumps({'error': 'Имя пользователя и пароль обязательны'}),
-                        'isBase64Encoded': False
-                    }
-                
-                if len(username) < 3 or len(username) > 50:
-                    return {
-                        'statusCode': 400,
-                        'headers': headers,
-                        'body': json.dumps({'error': 'Имя пользователя должно быть от 3 до 50 символов'}),
-                        'isBase64Encoded': False
-                    }
-                
-                if len(password) < 6:
-                    return {
-                        'statusCode': 400,
-                        'headers': headers,
-                        'body': json.dumps({'error': 'Пароль должен быть минимум 6 символов'}),
-                        'isBase64Encoded': False
-                    }
-                
-                cur.execute("SELECT id FROM users WHERE username = %s", (username,))
-                if cur.fetchone():
-                    return {
-                        'statusCode': 409,
-                        'headers': headers,
-                        'body': json.dumps({'error': 'Пользователь уже существует'}),
-                        'isBase64Encoded': False
-                    }
-                
-                password_hash = hash_password(password)
-                cur.execute(
-                    "INSERT INTO users (username, password_hash) VALUES (%s, %s) RETURNING id, username, avatar_url, bio, subscribers_count, likes_count, publications_count, dark_theme, sound_enabled",
-                    (username, password_hash)
-                )
-                user = dict(cur.fetchone())
-                conn.commit()
-                
-                return {
-                    'statusCode': 201,
-                    'headers': headers,
-                    'body': json.dumps({'user': user}),
-                    'isBase64Encoded': False
-                }
-            
-            elif action == 'login':
-                username = body.get('username', '').strip()
-                password = body.get('password', '')
-                
-                if not username or not password:
-                    return {
-                        'statusCode': 400,
-                        'headers': headers,
-                        'body': json.dumps({'error': 'Имя пользователя и пароль обязательны'}),
-                        'isBase64Encoded': False
-                    }
-                
-                cur.execute(
-                    "SELECT id, username, password_hash, avatar_url, bio, subscribers_count, likes_count, publications_count, dark_theme, sound_enabled FROM users WHERE username = %s",
-                    (username,)
+def session_payload(user: Dict[str, Any]) -> Dict[str, Any]:
+    token, expires_at = issue_token(user['id'])
+    return {'user': user, 'token': token, 'expires_at': expires_at}
+
+@router.route('POST', 'register', limit='register')
+def register(request: Request) -> Dict[str, Any]:
+    username = request.body.get('username', '').strip()
+    password = request.body.get('password', '')
+    
+    if not username or not password:
+        return error(400, 'Имя пользователя и пароль обязательны')
+    
+    if len(username) < 3 or len(username) > 50:
+        return error(400, 'Имя пользователя должно быть от 3 до 50 символов')
+    
+    if len(password) < 6:
+        return error(400, 'Пароль должен быть минимум 6 символов')
+    
+    cur = request.cur
+    cur.execute("SELECT id FROM users WHERE username = %s", (username,))
+    if cur.fetchone():
+        return error(409, 'Пользователь уже существует')
+    
+    password_hash = run_kdf(hash_password, password)
+    # The stats row is created with the user, so author cards and the
+    # directory can join it without an outer join.
+    cur.execute(
+        f'''WITH u AS (
+                INSERT INTO users (username, password_hash) VALUES (%s, %s) RETURNING *
+            ), st AS (
+                INSERT INTO author_stats (author_id) SELECT id FROM u RETURNING *
+            )
+            SELECT {USER_COLUMNS} FROM u JOIN st ON st.author_id = u.id''',
+        (username, password_hash)
+    )
+    user = dict(cur.fetchone())
+    bump_versions(cur, ['users'])
+    payload = session_payload(user)
+    request.conn.commit()
+    
+    return response(201, payload)
+
+@router.route('POST', 'login', limit='login')
+def login(request: Request) -> Dict[str, Any]:
+    username = request.body.get('username', '').strip()
+    password = request.body.get('password', '')
+    
+    if not username or not password:
+        return error(400, 'Имя пользователя и пароль обязательны')
+    
+    cur = request.cur
+    cur.execute(
+        f'''SELECT {USER_COLUMNS}, u.password_hash
+            FROM users u LEFT JOIN author_stats st ON st.author_id = u.id
+            WHERE u.username = %s''',
+        (username,)
+    )
+    result = cur.fetchone()
+    
+    if not result or not run_kdf(verify_password, password, result['password_hash']):
+        return error(401, 'Неверное имя пользователя или пароль')
+    
+    if needs_rehash(result['password_hash']):
+        new_hash = run_kdf(hash_password, password)
+        cur.execute("UPDATE users SET password_hash = %s WHERE id = %s", (new_hash, result['id']))
+        request.conn.commit()
+    
+    user = dict(result)
+    del user['password_hash']
+    
+    return response(200, session_payload(user))
+
+@router.route('POST', 'change_password', limit='change_password')
+def change_password(request: Request) -> Dict[str, Any]:
+    user_id = request.require_user()
+    old_password = request.body.get('old_password', '')
+    new_password = request.body.get('new_password', '')
+    
+    if not old_password or not new_password:
+        return error(400, 'Все поля обязательны')
+    
+    if len(new_password) < 6:
+        return error(400, 'Новый пароль должен быть минимум 6 символов')
+    
+    cur = request.cur
+    cur.execute("SELECT password_hash FROM users WHERE id = %s", (user_id,))
+    result = cur.fetchone()
+    
+    if not result or not run_kdf(verify_password, old_password, result['password_hash']):
+        return error(401, 'Неверный текущий пароль')
+    
+    new_hash = run_kdf(hash_password, new_password)
+    cur.execute("UPDATE users SET password_hash = %s WHERE id = %s", (new_hash, user_id))
+    # Every other session ends with the old password; the caller gets a fresh token.
+    revoke(cur, request.session, everywhere=True)
+    request.conn.commit()
+    
+    token, expires_at = issue_token(user_id)
+    return response(200, {'message': 'Пароль успешно изменен', 'token': token, 'expires_at': expires_at})
+
+@router.route('POST', 'logout')
+def logout(request: Request) -> Dict[str, Any]:
+    request.require_user()
+    revoke(request.cur, request.session, everywhere=bool(request.body.get('everywhere')))
+    request.conn.commit()
+    
+    return response(200, {'message': 'Сессия завершена'})
+
+@router.route('PUT')
+def update_settings(request: Request) -> Dict[str, Any]:
+    body = request.body
+    user_id = request.require_user()
+    
+    updates = []
+    params = []
+    
+    if 'dark_theme' in body:
+        updates.append('dark_theme = %s')
+        params.append(body['dark_theme'])
+    
+    if 'sound_enabled' in body:
+        updates.append('sound_enabled = %s')
+        params.append(body['sound_enabled'])
+    
+    if 'bio' in body:
+        updates.append('bio = %s')
+        params.append(body['bio'])
+    
+    if not updates:
+        return error(400, 'Нет данных для обновления')
+    
+    params.append(user_id)
+    query = f'''WITH u AS (
+                    UPDATE users SET {', '.join(updates)} WHERE id = %s RETURNING *
                 )
-                result = cur.fetchone()
-                
-                if not result or not verify_password(password, result['password_hash']):
-                    return {
-                        'statusCode': 401,
-                        'headers': headers,
-                        'body': json.dumps({'error': 'Неверное имя пользователя или пароль'}),
-                        'isBase64Encoded': False
-                    }
-                
-                user = dict(result)
-                del user['password_hash']
-                
-                return {
-                    'statusCode': 200,
-                    'headers': headers,
-                    'body': json.dumps({'user': user}),
-                    'isBase64Encoded': False
-                }
-            
-            elif action == 'change_password':
-                user_id = body.get('user_id')
-                old_password = body.get('old_password', '')
-                new_password = body.get('new_password', '')
-                
-                if not user_id or not old_password or not new_password:
-                    return {
-                        'statusCode': 400,
-                        'headers': headers,
-                        'body': json.dumps({'error': 'Все поля обязательны'}),
-                        'isBase64Encoded': False
-                    }
-                
-                if len(new_password) < 6:
-                    return {
-                        'statusCode': 400,
-                        'headers': headers,
-                        'body': json.dumps({'error': 'Новый пароль должен быть минимум 6 символов'}),
-                        'isBase64Encoded': False
-                    }
-                
-                cur.execute("SELECT password_hash FROM users WHERE id = %s", (user_id,))
-                result = cur.fetchone()
-                
-                if not result or not verify_password(old_password, result['password_hash']):
-                    return {
-                        'statusCode': 401,
-                        'headers': headers,
-                        'body': json.dumps({'error': 'Неверный текущий пароль'}),
-                        'isBase64Encoded': False
-                    }
-                
-                new_hash = hash_password(new_password)
-                cur.execute("UPDATE users SET password_hash = %s WHERE id = %s", (new_hash, user_id))
-                conn.commit()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': headers,
-                    'body': json.dumps({'message': 'Пароль успешно изменен'}),
-                    'isBase64Encoded': False
-                }
-        
-        elif method == 'PUT':
-            body = json.loads(event.get('body', '{}'))
-            user_id = body.get('user_id')
-            
-            if not user_id:
-                return {
-                    'statusCode': 400,
-                    'headers': headers,
-                    'body': json.dumps({'error': 'ID пользователя обязателен'}),
-                    'isBase64Encoded': False
-                }
-            
-            updates = []
-            params = []
-            
-            if 'dark_theme' in body:
-                updates.append('dark_theme = %s')
-                params.append(body['dark_theme'])
-            
-            if 'sound_enabled' in body:
-                updates.append('sound_enabled = %s')
-                params.append(body['sound_enabled'])
-            
-            if 'bio' in body:
-                updates.append('bio = %s')
-                params.append(body['bio'])
-            
-            if not updates:
-                return {
-                    'statusCode': 400,
-                    'headers': headers,
-                    'body': json.dumps({'error': 'Нет данных для обновления'}),
-                    'isBase64Encoded': False
-                }
-            
-            params.append(user_id)
-            query = f"UPDATE users SET {', '.join(updates)} WHERE id = %s RETURNING id, username, avatar_url, bio, subscribers_count, likes_count, publications_count, dark_theme, sound_enabled"
-            
-            cur.execute(query, params)
-            user = dict(cur.fetchone())
-            conn.commit()
-            
-            return {
-                'statusCode': 200,
-                'headers': headers,
-                'body': json.dumps({'user': user}),
-                'isBase64Encoded': False
-            }
-        
-        return {
-            'statusCode': 405,
-            'headers': headers,
-            'body': json.dumps({'error': 'Метод не поддерживается'}),
-            'isBase64Encoded': False
-        }
-        
-    except Exception as e:
-        return {
-            'statusCode': 500,
-            'headers': headers,
-            'body': json.dumps({'error': str(e)}),
-            'isBase64Encoded': False
-        }
-    finally:
-        if 'cur' in locals():
-            cur.close()
-        if 'conn' in locals():
-            conn.close()
+                SELECT {USER_COLUMNS} FROM u LEFT JOIN author_stats st ON st.author_id = u.id'''
+    
+    cur = request.cur
+    cur.execute(query, params)
+    user = dict(cur.fetchone())
+    if 'bio' in body:
+        bump_versions(cur, ['users', f'author:{user_id}'])
+    request.conn.commit()
+    
+    return response(200, {'user': user})
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    return router.dispatch(event, context)
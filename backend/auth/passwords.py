@@ -0,0 +1,135 @@
+'''
+Password hashing with a versioned, self-describing hash format:
+
+    scrypt$<n>$<r>$<p>$<salt>$<hash>
+    pbkdf2_sha256$<iterations>$<salt>$<hash>
+
+Salt and hash are base64 without padding. Records in the legacy
+"<salt hex>:<sha256 hex>" format still verify, and needs_rehash() tells the
+caller to upgrade them. KDF work runs on a small bounded thread pool, so a
+login storm queues (and is eventually rejected with KdfBusy) instead of
+starving the instance.
+'''
+
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+PASSWORD_SCHEME = os.environ.get('PASSWORD_SCHEME', 'scrypt')
+SCRYPT_N = int(os.environ.get('SCRYPT_N', str(2 ** 14)))
+SCRYPT_R = int(os.environ.get('SCRYPT_R', '8'))
+SCRYPT_P = int(os.environ.get('SCRYPT_P', '1'))
+PBKDF2_ITERATIONS = int(os.environ.get('PBKDF2_ITERATIONS', '600000'))
+
+KDF_WORKERS = int(os.environ.get('KDF_WORKERS', '2'))
+KDF_QUEUE_SIZE = int(os.environ.get('KDF_QUEUE_SIZE', '8'))
+KDF_QUEUE_TIMEOUT = float(os.environ.get('KDF_QUEUE_TIMEOUT', '2'))
+
+SALT_BYTES = 16
+HASH_BYTES = 32
+
+
+class KdfBusy(Exception):
+    pass
+
+
+def _b64(data: bytes) -> str:
+    return base64.b64encode(data).decode().rstrip('=')
+
+
+def _unb64(text: str) -> bytes:
+    return base64.b64decode(text + '=' * (-len(text) % 4))
+
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    return hashlib.scrypt(
+        password.encode(), salt=salt, n=n, r=r, p=p,
+        maxmem=256 * r * (n + p + 2), dklen=HASH_BYTES
+    )
+
+
+def _pbkdf2(password: str, salt: bytes, iterations: int) -> bytes:
+    return hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations, dklen=HASH_BYTES)
+
+
+def current_params(scheme: Optional[str] = None) -> Dict[str, Any]:
+    scheme = scheme or PASSWORD_SCHEME
+    if scheme == 'scrypt':
+        return {'scheme': 'scrypt', 'n': SCRYPT_N, 'r': SCRYPT_R, 'p': SCRYPT_P}
+    if scheme == 'pbkdf2_sha256':
+        return {'scheme': 'pbkdf2_sha256', 'iterations': PBKDF2_ITERATIONS}
+    raise ValueError(f'Unknown password scheme: {scheme}')
+
+
+def hash_password(password: str, params: Optional[Dict[str, Any]] = None) -> str:
+    params = params or current_params()
+    salt = secrets.token_bytes(SALT_BYTES)
+    if params['scheme'] == 'scrypt':
+        digest = _scrypt(password, salt, params['n'], params['r'], params['p'])
+        return f"scrypt${params['n']}${params['r']}${params['p']}${_b64(salt)}${_b64(digest)}"
+    digest = _pbkdf2(password, salt, params['iterations'])
+    return f"pbkdf2_sha256${params['iterations']}${_b64(salt)}${_b64(digest)}"
+
+
+def parse_hash(stored_hash: str) -> Dict[str, Any]:
+    if '$' not in stored_hash:
+        salt, digest = stored_hash.split(':')
+        return {'scheme': 'legacy_sha256', 'salt': salt, 'hash': digest}
+    parts = stored_hash.split('$')
+    if parts[0] == 'scrypt':
+        n, r, p, salt, digest = parts[1:]
+        return {'scheme': 'scrypt', 'n': int(n), 'r': int(r), 'p': int(p),
+                'salt': _unb64(salt), 'hash': _unb64(digest)}
+    if parts[0] == 'pbkdf2_sha256':
+        iterations, salt, digest = parts[1:]
+        return {'scheme': 'pbkdf2_sha256', 'iterations': int(iterations),
+                'salt': _unb64(salt), 'hash': _unb64(digest)}
+    raise ValueError(f'Unknown password hash format: {parts[0]}')
+
+
+def verify_password(password: str, stored_hash: str) -> bool:
+    parsed = parse_hash(stored_hash)
+    if parsed['scheme'] == 'legacy_sha256':
+        check_hash = hashlib.sha256((password + parsed['salt']).encode()).hexdigest()
+        return hmac.compare_digest(check_hash, parsed['hash'])
+    if parsed['scheme'] == 'scrypt':
+        digest = _scrypt(password, parsed['salt'], parsed['n'], parsed['r'], parsed['p'])
+    else:
+        digest = _pbkdf2(password, parsed['salt'], parsed['iterations'])
+    return hmac.compare_digest(digest, parsed['hash'])
+
+
+def needs_rehash(stored_hash: str) -> bool:
+    '''True for legacy records and for hashes made with outdated parameters.'''
+    parsed = parse_hash(stored_hash)
+    wanted = current_params()
+    return any(parsed.get(name) != value for name, value in wanted.items())
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(KDF_WORKERS + KDF_QUEUE_SIZE)
+
+
+def run_kdf(fn: Callable[..., Any], *args: Any) -> Any:
+    '''
+    Run fn on the bounded KDF pool. At most KDF_WORKERS hashes run at once
+    and KDF_QUEUE_SIZE more may wait; beyond that callers wait up to
+    KDF_QUEUE_TIMEOUT seconds for a slot and then get KdfBusy.
+    '''
+    global _executor
+    if not _slots.acquire(timeout=KDF_QUEUE_TIMEOUT):
+        raise KdfBusy('Сервер перегружен, попробуйте позже')
+    try:
+        if _executor is None:
+            with _executor_lock:
+                if _executor is None:
+                    _executor = ThreadPoolExecutor(max_workers=KDF_WORKERS, thread_name_prefix='kdf')
+        return _executor.submit(fn, *args).result()
+    finally:
+        _slots.release()
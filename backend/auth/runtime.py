@@ -0,0 +1,332 @@
+'''
+Shared handler runtime: declarative action routing, precomputed CORS
+responses, per-request tracing (see telemetry.py), per-route rate limits
+(see ratelimit.py), read-replica routing with read-your-writes pinning and a
+pluggable JSON encoder (orjson when installed, stdlib otherwise) that serialises
+datetimes natively.
+Identical copies live in every function directory.
+'''
+
+import json
+import time
+from datetime import date, datetime
+from decimal import Decimal
+from types import MappingProxyType
+from typing import Any, Callable, Dict, Mapping, Optional, Tuple, Type
+from db import REPLICA_PIN_SECONDS, get_db_connection, release_db_connection
+from telemetry import Trace, TracedRealDictCursor, begin_trace, end_trace, record_connect, record_serialize
+from sessions import Session, SessionError, authenticate, issue_write_token, verify_token, verify_write_token
+from ratelimit import get_rate_limiter, retry_after_header
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+if orjson is not None:
+    JSON_BACKEND = 'orjson'
+
+    def dumps(value: Any) -> str:
+        return orjson.dumps(value, default=_default, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(text: Any) -> Any:
+        return orjson.loads(text)
+else:
+    JSON_BACKEND = 'json'
+
+    def dumps(value: Any) -> str:
+        return json.dumps(value, default=_default)
+
+    def loads(text: Any) -> Any:
+        return json.loads(text)
+
+
+JSON_HEADERS: Mapping[str, str] = MappingProxyType({
+    'Content-Type': 'application/json',
+    'Access-Control-Allow-Origin': '*'
+})
+
+
+def freeze_response(status: int, body: str, headers: Mapping[str, str]) -> Mapping[str, Any]:
+    return MappingProxyType({
+        'statusCode': status,
+        'headers': MappingProxyType(dict(headers)),
+        'body': body,
+        'isBase64Encoded': False
+    })
+
+
+def thaw_response(frozen: Mapping[str, Any]) -> Dict[str, Any]:
+    return {**frozen, 'headers': dict(frozen['headers'])}
+
+
+def response(status: int, payload: Any, headers: Optional[Mapping[str, str]] = None) -> Dict[str, Any]:
+    started = time.perf_counter()
+    body = dumps(payload)
+    record_serialize(time.perf_counter() - started)
+    return {
+        'statusCode': status,
+        'headers': {**JSON_HEADERS, **headers} if headers else dict(JSON_HEADERS),
+        'body': body,
+        'isBase64Encoded': False
+    }
+
+
+# Successful writes return the time they committed, signed with the session
+# keys; the client echoes it on reads so that, for REPLICA_PIN_SECONDS, it
+# reads from the primary and sees its own writes even while the replicas lag.
+WRITE_TOKEN_HEADER = 'X-Write-Token'
+
+
+def write_token_headers() -> Dict[str, str]:
+    token = issue_write_token()
+    if token is None:
+        return {}
+    return {WRITE_TOKEN_HEADER: token, 'Access-Control-Expose-Headers': WRITE_TOKEN_HEADER}
+
+
+def error(status: int, message: str, headers: Optional[Mapping[str, str]] = None) -> Dict[str, Any]:
+    return response(status, {'error': message}, headers)
+
+
+class HttpError(Exception):
+    '''Raised from a route to answer with an error response.'''
+
+    def __init__(self, status: int, message: str, headers: Optional[Mapping[str, str]] = None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = headers
+
+
+class Request:
+    '''Parsed event plus a lazily acquired pooled connection and cursor.'''
+
+    def __init__(self, event: Dict[str, Any], context: Any):
+        self.event = event
+        self.context = context
+        self.method: str = event.get('httpMethod', 'GET')
+        self.params: Dict[str, Any] = event.get('queryStringParameters') or {}
+        self.headers: Dict[str, Any] = event.get('headers') or {}
+        self.body: Dict[str, Any] = {}
+        if self.method != 'GET':
+            try:
+                self.body = loads(event.get('body') or '{}')
+            except ValueError:
+                raise HttpError(400, 'Некорректный JSON в теле запроса')
+            if not isinstance(self.body, dict):
+                raise HttpError(400, 'Некорректный JSON в теле запроса')
+        self._conn = None
+        self._cur = None
+        self._session: Optional[Session] = None
+        self._authenticated = False
+
+    def header(self, name: str) -> Optional[str]:
+        '''Case-insensitive header lookup (gateways differ in how they case names).'''
+        value = self.headers.get(name)
+        if value is None:
+            lowered = name.lower()
+            for key, candidate in self.headers.items():
+                if key.lower() == lowered:
+                    return candidate
+        return value
+
+    @property
+    def bearer_token(self) -> Optional[str]:
+        authorization = self.header('Authorization') or ''
+        scheme, _, token = authorization.partition(' ')
+        return token.strip() if scheme.lower() == 'bearer' and token.strip() else None
+
+    @property
+    def session(self) -> Optional[Session]:
+        '''Session from `Authorization: Bearer <token>`; None for anonymous requests.'''
+        if not self._authenticated:
+            self._authenticated = True
+            token = self.bearer_token
+            if token:
+                try:
+                    self._session = authenticate(token, lambda: self.conn)
+                except SessionError as e:
+                    raise HttpError(401, str(e))
+        return self._session
+
+    @property
+    def client_ip(self) -> Optional[str]:
+        '''
+        Address the gateway saw. X-Forwarded-For is only a fallback, and only
+        its last hop (appended by the gateway): earlier entries are whatever
+        the client sent.
+        '''
+        identity = (self.event.get('requestContext') or {}).get('identity') or {}
+        if identity.get('sourceIp'):
+            return identity['sourceIp']
+        forwarded = self.header('X-Forwarded-For')
+        if forwarded:
+            return forwarded.rsplit(',', 1)[-1].strip() or None
+        return None
+
+    def rate_limit_keys(self) -> Dict[str, Optional[str]]:
+        '''
+        Bucket keys for ratelimit.py. The user key only checks the token
+        signature (no revocation reload), so throttling never needs the
+        database; the route still authenticates properly.
+        '''
+        user = None
+        token = self.bearer_token
+        if token:
+            try:
+                user = str(verify_token(token).user_id)
+            except SessionError:
+                pass
+        ip = self.client_ip
+        account = self.body.get('username')
+        if isinstance(account, str) and account.strip() and ip:
+            # Per username *and* address: a username alone would let anyone
+            # keep its owner locked out by spending the budget for them.
+            account = f'{account.strip().lower()}@{ip}'
+        else:
+            account = None
+        return {
+            'user': user,
+            'ip': ip,
+            'account': account
+        }
+
+    @property
+    def user_id(self) -> Optional[int]:
+        return self.session.user_id if self.session else None
+
+    def require_user(self) -> int:
+        if self.session is None:
+            raise HttpError(401, 'Требуется авторизация')
+        return self.session.user_id
+
+    @property
+    def action(self) -> Optional[str]:
+        source = self.params if self.method == 'GET' else self.body
+        return source.get('action')
+
+    @property
+    def pinned_to_primary(self) -> bool:
+        '''True while the client's last write (X-Write-Token) is recent enough that a replica may miss it.'''
+        token = self.header(WRITE_TOKEN_HEADER)
+        written_at = verify_write_token(token) if token else None
+        if written_at is None:
+            return False
+        now = time.time()
+        # Only tokens the functions signed count, and those from the future
+        # only within clock skew, so a client cannot pin itself to the
+        # primary indefinitely.
+        return now - REPLICA_PIN_SECONDS <= written_at <= now + REPLICA_PIN_SECONDS
+
+    @property
+    def conn(self) -> Any:
+        '''Pooled connection: GETs go to a replica (if configured) unless pinned, everything else to the primary.'''
+        if self._conn is None:
+            started = time.perf_counter()
+            self._conn = get_db_connection(replica=self.method == 'GET' and not self.pinned_to_primary)
+            record_connect(time.perf_counter() - started, bool(self._conn.pool and self._conn.pool.read_only))
+        return self._conn
+
+    @property
+    def cur(self) -> Any:
+        if self._cur is None:
+            self._cur = self.conn.cursor(cursor_factory=TracedRealDictCursor)
+        return self._cur
+
+    def close(self) -> None:
+        if self._cur is not None:
+            self._cur.close()
+        if self._conn is not None:
+            release_db_connection(self._conn)
+
+
+Route = Callable[[Request], Dict[str, Any]]
+
+
+class Router:
+    '''
+    Dispatch table keyed by (HTTP method, action). A route registered with
+    action=None is the fallback for its method; unknown combinations get 405.
+    A route registered with `limit` is checked against that rate-limit budget
+    before it runs and answers 429 with Retry-After when exhausted.
+    '''
+
+    def __init__(self, methods: str):
+        self.routes: Dict[Tuple[str, Optional[str]], Route] = {}
+        self.limits: Dict[Route, str] = {}
+        self.error_handlers: Dict[Type[BaseException], Callable[[Any], Dict[str, Any]]] = {}
+        self.options = freeze_response(200, '', {
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Methods': methods,
+            'Access-Control-Allow-Headers': 'Content-Type, Authorization, If-None-Match, If-Modified-Since, X-Write-Token',
+            'Access-Control-Max-Age': '86400'
+        })
+        self.not_allowed = freeze_response(405, dumps({'error': 'Метод не поддерживается'}), JSON_HEADERS)
+
+    def route(self, method: str, action: Optional[str] = None, limit: Optional[str] = None) -> Callable[[Route], Route]:
+        def register(fn: Route) -> Route:
+            self.routes[(method, action)] = fn
+            if limit is not None:
+                self.limits[fn] = limit
+            return fn
+        return register
+
+    def error_handler(self, exc_type: Type[BaseException]) -> Callable:
+        def register(fn: Callable[[Any], Dict[str, Any]]) -> Callable[[Any], Dict[str, Any]]:
+            self.error_handlers[exc_type] = fn
+            return fn
+        return register
+
+    def dispatch(self, event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        method = event.get('httpMethod', 'GET')
+        if method == 'OPTIONS':
+            return thaw_response(self.options)
+
+        trace, token = begin_trace(context, method)
+        result = None
+        try:
+            result = self._dispatch(event, context, method, trace)
+            return result
+        finally:
+            end_trace(trace, token, result)
+
+    def _dispatch(self, event: Dict[str, Any], context: Any, method: str, trace: Trace) -> Dict[str, Any]:
+        request = None
+        try:
+            request = Request(event, context)
+            trace.action = request.action
+            route = self.routes.get((method, request.action)) or self.routes.get((method, None))
+            if route is None:
+                return thaw_response(self.not_allowed)
+            limit = self.limits.get(route)
+            if limit is not None:
+                retry_after = get_rate_limiter().check(limit, request.rate_limit_keys())
+                if retry_after:
+                    raise HttpError(429, 'Слишком много запросов, попробуйте позже', retry_after_header(retry_after))
+            result = route(request)
+            if method != 'GET' and result['statusCode'] < 400:
+                result['headers'].update(write_token_headers())
+            return result
+        except HttpError as e:
+            return error(e.status, e.message, e.headers)
+        except Exception as e:
+            trace.fail(e)
+            for exc_type, build in self.error_handlers.items():
+                if isinstance(e, exc_type):
+                    return build(e)
+            return error(500, str(e))
+        finally:
+            if request is not None:
+                request.close()
@@ -0,0 +1,206 @@
+'''
+Stateless session tokens.
+
+A token is `kid.user_id.issued_at.expires_at.nonce.signature`, signed with
+HMAC-SHA256 under the key `kid` from SESSION_KEYS. Verification is pure CPU
+(with an LRU of already verified tokens), so authenticating a request costs
+no database round trip. The first key in SESSION_KEYS signs new tokens and
+every listed key verifies, which allows rotation: add the new key first,
+keep the old one until its tokens expire, then drop it.
+
+Revocations (logout, password change) go to the session_revocations table:
+either a single token nonce, or "every token of this user issued before T".
+Each instance keeps the unexpired entries in memory and reloads them at
+most every SESSION_REVOCATION_REFRESH seconds.
+Identical copies live in every function directory.
+'''
+
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+SESSION_TTL = int(os.environ.get('SESSION_TTL', str(30 * 86400)))
+SESSION_CACHE_SIZE = int(os.environ.get('SESSION_CACHE_SIZE', '1024'))
+SESSION_REVOCATION_REFRESH = float(os.environ.get('SESSION_REVOCATION_REFRESH', '30'))
+
+
+class SessionError(Exception):
+    pass
+
+
+def parse_keys(spec: str) -> Tuple[Optional[str], Dict[str, bytes]]:
+    '''`kid:secret,kid:secret` -> (signing kid, {kid: secret}).'''
+    keys: Dict[str, bytes] = {}
+    signing_kid = None
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        kid, _, secret = item.partition(':')
+        if not kid or not secret or '.' in kid:
+            raise ValueError(f'Invalid SESSION_KEYS entry for key id {kid!r}')
+        keys[kid] = secret.encode()
+        signing_kid = signing_kid or kid
+    return signing_kid, keys
+
+
+SIGNING_KID, KEYS = parse_keys(os.environ.get('SESSION_KEYS', ''))
+
+
+class Session:
+    __slots__ = ('user_id', 'issued_at', 'expires_at', 'nonce')
+
+    def __init__(self, user_id: int, issued_at: int, expires_at: int, nonce: str):
+        self.user_id = user_id
+        self.issued_at = issued_at
+        self.expires_at = expires_at
+        self.nonce = nonce
+
+
+def _sign(key: bytes, message: str) -> str:
+    digest = hmac.new(key, message.encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).decode().rstrip('=')
+
+
+def issue_token(user_id: int, now: Optional[float] = None) -> Tuple[str, int]:
+    '''Returns (token, expires_at as a Unix timestamp).'''
+    if SIGNING_KID is None:
+        raise SessionError('Сессии не настроены: задайте SESSION_KEYS')
+    issued_at = int(now if now is not None else time.time())
+    expires_at = issued_at + SESSION_TTL
+    message = f'{SIGNING_KID}.{int(user_id)}.{issued_at}.{expires_at}.{secrets.token_urlsafe(9)}'
+    return f'{message}.{_sign(KEYS[SIGNING_KID], message)}', expires_at
+
+
+_verified: 'OrderedDict[str, Session]' = OrderedDict()
+_verified_lock = threading.Lock()
+
+
+def verify_token(token: str, now: Optional[float] = None) -> Session:
+    now = now if now is not None else time.time()
+    with _verified_lock:
+        session = _verified.get(token)
+        if session is not None:
+            _verified.move_to_end(token)
+    if session is None:
+        message, _, signature = token.rpartition('.')
+        parts = message.split('.')
+        if len(parts) != 5 or parts[0] not in KEYS:
+            raise SessionError('Сессия недействительна')
+        if not hmac.compare_digest(signature, _sign(KEYS[parts[0]], message)):
+            raise SessionError('Сессия недействительна')
+        try:
+            session = Session(int(parts[1]), int(parts[2]), int(parts[3]), parts[4])
+        except ValueError:
+            raise SessionError('Сессия недействительна')
+        with _verified_lock:
+            _verified[token] = session
+            while len(_verified) > SESSION_CACHE_SIZE:
+                _verified.popitem(last=False)
+    if session.expires_at <= now:
+        raise SessionError('Сессия истекла')
+    return session
+
+
+def issue_write_token(now: Optional[float] = None) -> Optional[str]:
+    '''
+    `kid.written_at.signature` for the X-Write-Token header (see runtime.py),
+    signed like session tokens so a client cannot mint one. None when
+    SESSION_KEYS is not configured.
+    '''
+    if SIGNING_KID is None:
+        return None
+    message = f'{SIGNING_KID}.{now if now is not None else time.time():.3f}'
+    return f'{message}.{_sign(KEYS[SIGNING_KID], "write." + message)}'
+
+
+def verify_write_token(token: str) -> Optional[float]:
+    '''The write time carried by a genuine write token, otherwise None.'''
+    message, _, signature = token.rpartition('.')
+    kid, _, written_at = message.partition('.')
+    if kid not in KEYS or not hmac.compare_digest(signature, _sign(KEYS[kid], 'write.' + message)):
+        return None
+    try:
+        return float(written_at)
+    except ValueError:
+        return None
+
+
+class RevocationList:
+    '''In-memory copy of the unexpired rows of session_revocations.'''
+
+    def __init__(self):
+        self.nonces: Dict[str, float] = {}
+        self.not_before: Dict[int, float] = {}
+        self.loaded_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def stale(self) -> bool:
+        return self.loaded_at is None or time.monotonic() - self.loaded_at > SESSION_REVOCATION_REFRESH
+
+    def load(self, conn: Any) -> None:
+        with conn.cursor() as cur:
+            cur.execute(
+                '''SELECT user_id, nonce, extract(epoch FROM not_before)::float8,
+                          extract(epoch FROM expires_at)::float8
+                   FROM session_revocations
+                   WHERE expires_at > CURRENT_TIMESTAMP'''
+            )
+            rows = cur.fetchall()
+        nonces, not_before = {}, {}
+        for user_id, nonce, cutoff, expires_at in rows:
+            if nonce:
+                nonces[nonce] = expires_at
+            else:
+                not_before[user_id] = max(not_before.get(user_id, 0.0), cutoff)
+        with self._lock:
+            self.nonces, self.not_before = nonces, not_before
+            self.loaded_at = time.monotonic()
+
+    def add(self, session: Session, everywhere: bool, at: float) -> None:
+        with self._lock:
+            if everywhere:
+                self.not_before[session.user_id] = max(self.not_before.get(session.user_id, 0.0), at)
+            else:
+                self.nonces[session.nonce] = session.expires_at
+
+    def revoked(self, session: Session) -> bool:
+        return session.nonce in self.nonces or session.issued_at < self.not_before.get(session.user_id, 0.0)
+
+
+revocations = RevocationList()
+
+
+def authenticate(token: str, conn: Callable[[], Any]) -> Session:
+    '''Verify `token`; `conn` supplies a connection when revocations need a reload.'''
+    session = verify_token(token)
+    if revocations.stale():
+        revocations.load(conn())
+    if revocations.revoked(session):
+        raise SessionError('Сессия отозвана')
+    return session
+
+
+def revoke(cur: Any, session: Session, everywhere: bool = False) -> None:
+    '''
+    Revoke one token, or with `everywhere` every token of its user issued
+    up to now. Runs in the caller's transaction.
+    '''
+    now = int(time.time())
+    if everywhere:
+        cur.execute(
+            '''INSERT INTO session_revocations (user_id, not_before, expires_at)
+               VALUES (%s, to_timestamp(%s), to_timestamp(%s))''',
+            (session.user_id, now, now + SESSION_TTL)
+        )
+    else:
+        cur.execute(
+            '''INSERT INTO session_revocations (user_id, nonce, expires_at)
+               VALUES (%s, %s, to_timestamp(%s))''',
+            (session.user_id, session.nonce, session.expires_at)
+        )
+    cur.execute('DELETE FROM session_revocations WHERE expires_at <= CURRENT_TIMESTAMP')
+    revocations.add(session, everywhere, now)
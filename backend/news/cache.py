@@ -0,0 +1,188 @@
+'''
+Read-through cache for anonymous feed pages.
+
+Entries are keyed by the feed filters and tagged with a generation number;
+write actions bump the generation, which orphans every cached page at once
+instead of hunting down individual keys. Two backends are provided:
+
+* MemoryBackend - per-instance LRU dict with TTL (the default).
+* KeyValueBackend - serialises entries into a shared key-value store. Any
+  client with the redis-py style get/set(ex=)/incr interface works;
+  LocalKeyValueStore is an in-process stand-in for development and tests.
+'''
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+from runtime import dumps, loads
+
+FEED_CACHE_BACKEND = os.environ.get('FEED_CACHE_BACKEND', 'memory')
+FEED_CACHE_TTL = float(os.environ.get('FEED_CACHE_TTL', '30'))
+FEED_CACHE_MAX_ENTRIES = int(os.environ.get('FEED_CACHE_MAX_ENTRIES', '256'))
+
+GENERATION_KEY = 'feed:generation'
+
+
+class MemoryBackend:
+    def __init__(self, max_entries: int = FEED_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[str, Tuple[float, Any]]' = OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def generation(self) -> int:
+        return self._generation
+
+    def bump_generation(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+
+class LocalKeyValueStore:
+    '''In-process stand-in for a shared store (redis-py compatible subset).'''
+
+    def __init__(self, max_entries: int = FEED_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._data: 'OrderedDict[str, Tuple[Optional[float], bytes]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._data.get(name)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._data[name]
+                return None
+            self._data.move_to_end(name)
+            return value
+
+    def set(self, name: str, value: Any, ex: Optional[float] = None) -> bool:
+        if isinstance(value, str):
+            value = value.encode()
+        elif isinstance(value, int):
+            value = str(value).encode()
+        with self._lock:
+            self._data[name] = (time.monotonic() + ex if ex else None, value)
+            self._data.move_to_end(name)
+            self._evict()
+        return True
+
+    def _evict(self) -> None:
+        # Like an LRU store with volatile-lru policy: only keys that carry
+        # an expiry are evicted, so the generation counter is never lost.
+        excess = len(self._data) - self.max_entries
+        if excess <= 0:
+            return
+        for name in [name for name, (expires_at, _) in self._data.items() if expires_at is not None][:excess]:
+            del self._data[name]
+
+    def incr(self, name: str, amount: int = 1) -> int:
+        with self._lock:
+            entry = self._data.get(name)
+            value = int(entry[1]) + amount if entry else amount
+            self._data[name] = (None, str(value).encode())
+            self._data.move_to_end(name)
+            return value
+
+
+class KeyValueBackend:
+    def __init__(self, store: Any):
+        self.store = store
+
+    def get(self, key: str) -> Optional[Any]:
+        raw = self.store.get(key)
+        return loads(raw) if raw is not None else None
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        self.store.set(key, dumps(value), ex=max(1, int(ttl)))
+
+    def generation(self) -> int:
+        raw = self.store.get(GENERATION_KEY)
+        return int(raw) if raw is not None else 0
+
+    def bump_generation(self) -> None:
+        self.store.incr(GENERATION_KEY)
+
+
+class FeedCache:
+    def __init__(self, backend: Any, ttl: float = FEED_CACHE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, filters: Dict[str, Any]) -> str:
+        parts = '&'.join(f'{name}={dumps(filters[name])}' for name in sorted(filters))
+        return f'feed:{self.backend.generation()}:{parts}'
+
+    def get(self, filters: Dict[str, Any]) -> Optional[Any]:
+        value = self.backend.get(self.key(filters))
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, filters: Dict[str, Any], value: Any) -> None:
+        self.backend.set(self.key(filters), value, self.ttl)
+
+    def invalidate(self) -> None:
+        self.backend.bump_generation()
+
+
+class NullCache:
+    hits = 0
+    misses = 0
+
+    def get(self, filters: Dict[str, Any]) -> None:
+        return None
+
+    def set(self, filters: Dict[str, Any], value: Any) -> None:
+        pass
+
+    def invalidate(self) -> None:
+        pass
+
+
+_feed_cache: Optional[Any] = None
+
+
+def configure_feed_cache(backend: Optional[Any], ttl: float = FEED_CACHE_TTL) -> None:
+    '''Install a cache backend explicitly (None disables caching).'''
+    global _feed_cache
+    _feed_cache = FeedCache(backend, ttl) if backend is not None else NullCache()
+
+
+def get_feed_cache() -> Any:
+    if _feed_cache is None:
+        if FEED_CACHE_BACKEND == 'off':
+            configure_feed_cache(None)
+        elif FEED_CACHE_BACKEND == 'shared':
+            configure_feed_cache(KeyValueBackend(LocalKeyValueStore()))
+        else:
+            configure_feed_cache(MemoryBackend())
+    return _feed_cache
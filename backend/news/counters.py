@@ -0,0 +1,221 @@
+'''
+Write-behind counters: news_articles.likes_count and the author_stats
+table (likes, subscribers, publications).
+
+Writers append a row to counter_deltas instead of updating the hot article
+or author row, so concurrent likes never serialise on the same tuple.
+Deltas are folded into the columns in batches (at most once per
+COUNTER_FOLD_INTERVAL per instance, guarded by an advisory lock so only one
+instance folds at a time), and reconcile_counters() recomputes every
+counter, and the hot ranking score, exactly from the source tables.
+Folded likes also raise the article's hot_score. A fold bumps the content
+versions of the listings whose counts it changed (see versions.py).
+Identical copies live in the news and users function directories.
+'''
+
+import os
+import time
+from typing import Any, Dict
+import psycopg2
+
+COUNTER_FOLD_INTERVAL = float(os.environ.get('COUNTER_FOLD_INTERVAL', '5'))
+COUNTER_FOLD_BATCH = int(os.environ.get('COUNTER_FOLD_BATCH', '10000'))
+COUNTER_FOLD_LOCK = 730_001
+
+# Engagement weights of the hot ranking (see db_migrations/V0009__hot_score.sql,
+# whose column default uses HOT_POST_WEIGHT).
+HOT_POST_WEIGHT = 3
+HOT_LIKE_WEIGHT = 1
+HOT_COMMENT_WEIGHT = 2
+
+FOLD_SQL = '''
+    WITH batch AS (
+        DELETE FROM counter_deltas
+        WHERE id IN (
+            SELECT id FROM counter_deltas ORDER BY id LIMIT %(batch_size)s FOR UPDATE SKIP LOCKED
+        )
+        RETURNING entity, entity_id, field, delta, created_at
+    ), article_sums AS (
+        SELECT entity_id, SUM(delta) AS likes, MAX(created_at) AS last_at
+        FROM batch
+        WHERE entity = 'article' AND field = 'likes_count'
+        GROUP BY entity_id
+    ), user_sums AS (
+        SELECT entity_id,
+               COALESCE(SUM(delta) FILTER (WHERE field = 'likes_count'), 0) AS likes,
+               COALESCE(SUM(delta) FILTER (WHERE field = 'subscribers_count'), 0) AS subscribers,
+               COALESCE(SUM(delta) FILTER (WHERE field = 'publications_count'), 0) AS publications,
+               MAX(created_at) FILTER (WHERE field = 'publications_count' AND delta > 0) AS published_at
+        FROM batch
+        WHERE entity = 'user'
+        GROUP BY entity_id
+    ), article_rows AS (
+        -- (id, created_at) through article_keys, so the executor only
+        -- visits the partitions that hold the batch's articles.
+        SELECT s.*, k.created_at
+        FROM article_sums s
+        JOIN article_keys k ON k.id = s.entity_id
+        WHERE s.likes <> 0
+    ), articles AS (
+        UPDATE news_articles n SET likes_count = n.likes_count + s.likes,
+                                   hot_score = hot_add(n.hot_score, %(like_weight)s * s.likes, s.last_at)
+        FROM article_rows s
+        WHERE n.id = s.entity_id AND n.created_at = s.created_at
+    ), changed_users AS (
+        SELECT * FROM user_sums WHERE likes <> 0 OR subscribers <> 0 OR publications <> 0
+    ), authors AS (
+        INSERT INTO author_stats AS a (author_id, likes_count, subscribers_count, publications_count, last_published_at)
+        SELECT s.entity_id, s.likes, s.subscribers, s.publications, s.published_at
+        FROM changed_users s
+        JOIN users u ON u.id = s.entity_id
+        ORDER BY s.entity_id
+        ON CONFLICT (author_id) DO UPDATE
+        SET likes_count = a.likes_count + EXCLUDED.likes_count,
+            subscribers_count = a.subscribers_count + EXCLUDED.subscribers_count,
+            publications_count = a.publications_count + EXCLUDED.publications_count,
+            last_published_at = GREATEST(a.last_published_at, EXCLUDED.last_published_at),
+            updated_at = CURRENT_TIMESTAMP
+    ), touched AS (
+        SELECT unnest(ARRAY['feed', 'category:' || n.category, 'author:' || n.author_id]) AS scope
+        FROM article_rows s
+        JOIN news_articles n ON n.id = s.entity_id AND n.created_at = s.created_at
+        UNION
+        SELECT 'users' FROM changed_users
+        UNION
+        SELECT 'author:' || entity_id FROM changed_users
+    ), versioned AS (
+        INSERT INTO content_versions (scope)
+        SELECT scope FROM touched ORDER BY scope
+        ON CONFLICT (scope) DO UPDATE
+        SET version = content_versions.version + 1, updated_at = CURRENT_TIMESTAMP
+    )
+    SELECT COUNT(*) AS folded FROM batch
+'''
+
+# Counting the source tables and draining every pending delta in the same
+# statement keeps the result exact: a write committed after the statement
+# snapshot is invisible to both halves and leaves its delta for the next fold.
+RECONCILE_SQL = '''
+    WITH drained AS (
+        DELETE FROM counter_deltas RETURNING 1
+    ), article_totals AS (
+        SELECT n.id, COUNT(l.id) AS likes
+        FROM news_articles n
+        LEFT JOIN likes l ON l.article_id = n.id
+        GROUP BY n.id
+    ), author_likes AS (
+        SELECT n.author_id, COUNT(l.id) AS likes
+        FROM likes l
+        JOIN news_articles n ON n.id = l.article_id
+        GROUP BY n.author_id
+    ), author_subscribers AS (
+        SELECT author_id, COUNT(*) AS subscribers
+        FROM subscriptions
+        GROUP BY author_id
+    ), author_publications AS (
+        SELECT author_id, COUNT(*) AS publications, MAX(created_at) AS last_at
+        FROM news_articles
+        GROUP BY author_id
+    ), user_totals AS (
+        SELECT u.id, COALESCE(al.likes, 0) AS likes, COALESCE(s.subscribers, 0) AS subscribers,
+               COALESCE(p.publications, 0) AS publications, p.last_at
+        FROM users u
+        LEFT JOIN author_likes al ON al.author_id = u.id
+        LEFT JOIN author_subscribers s ON s.author_id = u.id
+        LEFT JOIN author_publications p ON p.author_id = u.id
+    ), articles AS (
+        UPDATE news_articles n SET likes_count = t.likes
+        FROM article_totals t
+        WHERE n.id = t.id AND n.likes_count IS DISTINCT FROM t.likes
+        RETURNING 1
+    ), authors AS (
+        INSERT INTO author_stats AS a (author_id, likes_count, subscribers_count, publications_count, last_published_at)
+        SELECT id, likes, subscribers, publications, last_at FROM user_totals
+        ON CONFLICT (author_id) DO UPDATE
+        SET likes_count = EXCLUDED.likes_count,
+            subscribers_count = EXCLUDED.subscribers_count,
+            publications_count = EXCLUDED.publications_count,
+            last_published_at = EXCLUDED.last_published_at,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE (a.likes_count, a.subscribers_count, a.publications_count, a.last_published_at)
+              IS DISTINCT FROM (EXCLUDED.likes_count, EXCLUDED.subscribers_count,
+                                EXCLUDED.publications_count, EXCLUDED.last_published_at)
+        RETURNING 1
+    )
+    SELECT (SELECT COUNT(*) FROM drained) AS drained,
+           (SELECT COUNT(*) FROM articles) AS articles_fixed,
+           (SELECT COUNT(*) FROM authors) AS users_fixed
+'''
+
+# Exact hot scores from the source tables, updating only rows that drifted
+# (unlikes are not subtracted incrementally, and imported rows start from
+# the column default).
+HOT_SCORE_SQL = '''
+    WITH scores AS (
+        SELECT article_id, MAX(m) + ln(SUM(exp(GREATEST(c - m, -700)))) AS score
+        FROM (
+            SELECT article_id, c, MAX(c) OVER (PARTITION BY article_id) AS m
+            FROM (
+                SELECT id AS article_id, hot_contribution(%(post_weight)s, created_at) AS c FROM news_articles
+                UNION ALL
+                SELECT article_id, hot_contribution(%(like_weight)s, created_at) FROM likes
+                UNION ALL
+                SELECT article_id, hot_contribution(%(comment_weight)s, created_at) FROM comments
+            ) events
+        ) contributions
+        GROUP BY article_id
+    ), updated AS (
+        UPDATE news_articles n SET hot_score = s.score
+        FROM scores s
+        WHERE n.id = s.article_id AND abs(n.hot_score - s.score) > 1e-9
+        RETURNING 1
+    )
+    SELECT COUNT(*) FROM updated
+'''
+
+_last_fold = 0.0
+
+
+def fold_deltas(conn: Any, batch_size: int = COUNTER_FOLD_BATCH) -> int:
+    '''Fold one batch of pending deltas; returns 0 if another folder holds the lock.'''
+    with conn.cursor() as cur:
+        cur.execute('SELECT pg_try_advisory_xact_lock(%s)', (COUNTER_FOLD_LOCK,))
+        if not cur.fetchone()[0]:
+            conn.rollback()
+            return 0
+        cur.execute(FOLD_SQL, {'batch_size': batch_size, 'like_weight': HOT_LIKE_WEIGHT})
+        folded = cur.fetchone()[0]
+    conn.commit()
+    return folded
+
+
+def maybe_fold_deltas(conn: Any) -> None:
+    '''Fold pending deltas if this instance has not done so recently.'''
+    global _last_fold
+    now = time.monotonic()
+    if now - _last_fold < COUNTER_FOLD_INTERVAL:
+        return
+    _last_fold = now
+    try:
+        fold_deltas(conn)
+    except psycopg2.Error:
+        # Folding is best effort; the deltas stay queued for the next attempt.
+        conn.rollback()
+
+
+def reconcile_counters(conn: Any) -> Dict[str, int]:
+    with conn.cursor() as cur:
+        cur.execute('SELECT pg_advisory_xact_lock(%s)', (COUNTER_FOLD_LOCK,))
+        cur.execute(RECONCILE_SQL)
+        drained, articles_fixed, users_fixed = cur.fetchone()
+        cur.execute(HOT_SCORE_SQL, {
+            'post_weight': HOT_POST_WEIGHT,
+            'like_weight': HOT_LIKE_WEIGHT,
+            'comment_weight': HOT_COMMENT_WEIGHT
+        })
+        hot_fixed = cur.fetchone()[0]
+        if articles_fixed or users_fixed or hot_fixed:
+            # Corrections can land in any listing: invalidate every scope.
+            cur.execute('UPDATE content_versions SET version = version + 1, updated_at = CURRENT_TIMESTAMP')
+    conn.commit()
+    return {'drained': drained, 'articles_fixed': articles_fixed, 'users_fixed': users_fixed, 'hot_fixed': hot_fixed}
@@ -0,0 +1,83 @@
+'''
+Fan-out on write for the "following" feed.
+
+A new article is copied into the `timelines` row set of every subscriber of
+its author, in batches of FANOUT_BATCH subscribers per statement (each batch
+is its own short transaction), so a following feed is a single keyset range
+scan on the timelines primary key. Authors with at least
+FANOUT_MAX_SUBSCRIBERS subscribers are not fanned out: readers pull their
+latest articles at read time instead (hybrid fan-out on read).
+
+Fan-out runs after the article is committed and is best effort
+(maybe_fan_out): a failure leaves some timelines without the article, and
+`tools/bulk_content.py recount` seeds the missing rows again.
+'''
+
+import os
+import sys
+from typing import Any, Dict
+import psycopg2
+
+FANOUT_MAX_SUBSCRIBERS = int(os.environ.get('FANOUT_MAX_SUBSCRIBERS', '10000'))
+FANOUT_BATCH = int(os.environ.get('FANOUT_BATCH', '1000'))
+
+# Readers pull authors from half the write threshold up, so an author whose
+# subscriber count dips just below it keeps their non-fanned-out articles
+# visible. Articles present in both paths are deduplicated by the read query.
+FANOUT_PULL_SUBSCRIBERS = FANOUT_MAX_SUBSCRIBERS // 2
+
+FANOUT_SQL = '''
+    WITH batch AS (
+        SELECT subscriber_id
+        FROM subscriptions
+        WHERE author_id = %(author_id)s AND subscriber_id > %(after)s
+        ORDER BY subscriber_id
+        LIMIT %(batch_size)s
+    ), inserted AS (
+        INSERT INTO timelines (user_id, article_id, author_id, created_at)
+        SELECT subscriber_id, %(article_id)s, %(author_id)s, %(created_at)s
+        FROM batch
+        ON CONFLICT DO NOTHING
+    )
+    SELECT COUNT(*) AS size, MAX(subscriber_id) AS last_id FROM batch
+'''
+
+
+def fan_out(conn: Any, article: Dict[str, Any], batch_size: int = FANOUT_BATCH) -> int:
+    '''
+    Push `article` (id, author_id, created_at) into its author's subscriber
+    timelines. Returns the number of subscribers visited, 0 for authors
+    served by fan-out on read.
+    '''
+    with conn.cursor() as cur:
+        cur.execute('SELECT subscribers_count FROM author_stats WHERE author_id = %s', (article['author_id'],))
+        row = cur.fetchone()
+        if row is None or (row[0] or 0) >= FANOUT_MAX_SUBSCRIBERS:
+            conn.rollback()
+            return 0
+
+        params = {
+            'article_id': article['id'],
+            'author_id': article['author_id'],
+            'created_at': article['created_at'],
+            'batch_size': batch_size,
+            'after': 0
+        }
+        visited = 0
+        while True:
+            cur.execute(FANOUT_SQL, params)
+            size, last_id = cur.fetchone()
+            conn.commit()
+            visited += size
+            if size < batch_size:
+                return visited
+            params['after'] = last_id
+
+
+def maybe_fan_out(conn: Any, article: Dict[str, Any]) -> None:
+    '''fan_out() that never fails the request: the article is already committed.'''
+    try:
+        fan_out(conn, article)
+    except psycopg2.Error as e:
+        conn.rollback()
+        sys.stderr.write(f"fan-out of article {article['id']} failed: {type(e).__name__}: {e}\n")
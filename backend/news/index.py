@@ -4,295 +4,579 @@ Args: event with httpMethod, body, queryStringParameters; context with request_i
 Returns: HTTP response with articles data
 '''
 
-import json
-import os
-from typing import Dict, Any
-import psycopg2
-from psycopg2.extras import RealDictCursor
+import base64
+import binascii
+from typing import Dict, Any, Callable, List, Optional, Tuple, Union
+from runtime import HttpError, Request, Router, error, response
+from cache import get_feed_cache
+from counters import HOT_COMMENT_WEIGHT, maybe_fold_deltas
+from fanout import FANOUT_PULL_SUBSCRIBERS, maybe_fan_out
+from ingest import ENQUEUE_COMMENT_SQL, ENQUEUE_LIKE_SQL, async_enabled, maybe_drain_events
+from statements import execute
+from timeago import humanize
+from versions import article_scopes, bump_versions, conditional, feed_scopes
 from datetime import datetime
 
-def get_db_connection():
-    return psycopg2.connect(os.environ['DATABASE_URL'])
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 100
+DEFAULT_COMMENTS_PREVIEW = 3
+MAX_COMMENTS_PREVIEW = 20
+SORT_MODES = ('new', 'hot')
 
-def get_time_ago(timestamp):
-    now = datetime.now()
-    diff = now - timestamp
-    
-    seconds = diff.total_seconds()
-    if seconds < 60:
-        return 'только что'
-    elif seconds < 3600:
-        minutes = int(seconds / 60)
-        return f'{minutes} мин назад'
-    elif seconds < 86400:
-        hours = int(seconds / 3600)
-        return f'{hours} ч назад'
-    else:
-        days = int(seconds / 86400)
-        return f'{days} д назад'
+SEARCH_CONFIG = 'russian'
+TITLE_HEADLINE_OPTIONS = 'StartSel=<mark>, StopSel=</mark>, HighlightAll=true'
+SNIPPET_HEADLINE_OPTIONS = 'StartSel=<mark>, StopSel=</mark>, MaxWords=35, MinWords=15, MaxFragments=2'
 
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
-    method: str = event.get('httpMethod', 'GET')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
+ARTICLE_COLUMNS = '''
+    n.id, n.title, n.content, n.excerpt, n.category,
+    n.author_id, n.likes_count, n.comments_count, n.created_at'''
+
+COMMENTS_PREVIEW_COLUMN = '''
+    COALESCE(
+        (SELECT json_agg(json_build_object(
+            'id', c.id,
+            'content', c.content,
+            'author_name', c.username,
+            'author_avatar', c.avatar_url,
+            'created_at', to_char(c.created_at AT TIME ZONE 'UTC', 'YYYY-MM-DD"T"HH24:MI:SS.US"+00:00"')
+        ) ORDER BY c.created_at DESC, c.id DESC)
+        FROM (
+            SELECT c.id, c.content, c.created_at, cu.username, cu.avatar_url
+            FROM comments c
+            JOIN users cu ON c.author_id = cu.id
+            WHERE c.article_id = n.id AND c.created_at >= n.created_at
+            ORDER BY c.created_at DESC, c.id DESC
+            LIMIT %(preview)s
+        ) c), '[]'::json
+    )'''
+
+def comments_column(preview: int) -> str:
+    return COMMENTS_PREVIEW_COLUMN if preview else "'[]'::json"
+
+def encode_cursor(key: Union[datetime, float], row_id: int) -> str:
+    key_text = key.isoformat() if isinstance(key, datetime) else repr(key)
+    raw = f'{key_text}|{row_id}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor: str, key_type: Callable[[str], Any] = datetime.fromisoformat) -> Optional[Tuple[Any, int]]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        key, row_id = raw.split('|')
+        return key_type(key), int(row_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+def parse_limit(value: Optional[str], default: int = DEFAULT_PAGE_SIZE,
+                maximum: int = MAX_PAGE_SIZE, minimum: int = 1) -> Optional[int]:
+    if value is None or value == '':
+        return default
+    try:
+        limit = int(value)
+    except ValueError:
+        return None
+    if limit < minimum:
+        return None
+    return min(limit, maximum)
+
+def wants_humanized(value: Any) -> bool:
+    return str(value).lower() in ('1', 'true', 'yes')
+
+def humanize_articles(articles: List[Dict[str, Any]]) -> None:
+    '''Add `date` / comment `timestamp` strings, all against one `now`.'''
+    comments = [comment for article in articles for comment in article['comments']]
+    labels = humanize([article['created_at'] for article in articles] + [comment['created_at'] for comment in comments])
+    for article, label in zip(articles, labels):
+        article['date'] = label
+    for comment, label in zip(comments, labels[len(articles):]):
+        comment['timestamp'] = label
+
+def page_params(request: Request, key_type: Callable[[str], Any] = datetime.fromisoformat) -> Tuple[int, Optional[Tuple[Any, int]]]:
+    limit = parse_limit(request.params.get('limit'))
+    if limit is None:
+        raise HttpError(400, 'Некорректный параметр limit')
+    
+    position = None
+    cursor = request.params.get('cursor')
+    if cursor:
+        position = decode_cursor(cursor, key_type)
+        if position is None:
+            raise HttpError(400, 'Некорректный курсор')
+    
+    return limit, position
+
+def mark_liked(request: Request, user_id: Optional[int], articles: List[Dict[str, Any]]) -> None:
+    liked_ids = set()
+    if user_id and articles:
+        cur = request.cur
+        cur.execute(
+            'SELECT article_id FROM likes WHERE user_id = %s AND article_id = ANY(%s)',
+            (user_id, [article['id'] for article in articles])
+        )
+        liked_ids = {row['article_id'] for row in cur.fetchall()}
+    
+    for article in articles:
+        article['is_liked'] = article['id'] in liked_ids
+
+def apply_pending_writes(conn: Any) -> None:
+    '''Opportunistically drain queued likes/comments and fold counter deltas.'''
+    if async_enabled() and maybe_drain_events(conn):
+        get_feed_cache().invalidate()
+    maybe_fold_deltas(conn)
+
+router = Router('GET, POST, PUT, DELETE, OPTIONS')
+
+@router.route('GET')
+def list_articles(request: Request) -> Dict[str, Any]:
+    params = request.params
+    cursor = params.get('cursor')
+    search = (params.get('search') or '').strip()
+    user_id = request.user_id
+    category = params.get('category')
+    author_id = params.get('author_id')
+    sort = params.get('sort') or 'new'
+    
+    if sort not in SORT_MODES:
+        return error(400, 'Некорректный параметр sort')
+    
+    # Search results are always ordered by relevance.
+    hot = sort == 'hot' and not search
+    limit, position = page_params(request, float if search or hot else datetime.fromisoformat)
+    preview = parse_limit(params.get('comments_preview'), DEFAULT_COMMENTS_PREVIEW, MAX_COMMENTS_PREVIEW, 0)
+    
+    if preview is None:
+        return error(400, 'Некорректный параметр comments_preview')
+    
+    humanized = wants_humanized(params.get('humanize'))
+    scopes = feed_scopes(category, author_id, user_id)
+    not_modified, validator = conditional(request, scopes, humanized)
+    if not_modified:
+        return not_modified
     
-    headers = {
-        'Content-Type': 'application/json',
-        'Access-Control-Allow-Origin': '*'
+    feed_cache = get_feed_cache()
+    # The listing's content version is part of the key: any bump (a write
+    # on another instance, a counter fold) makes older pages unreachable,
+    # so a cached body never goes out under a newer ETag.
+    cache_filters = {
+        'version': validator.versions.get(scopes[0], 0),
+        'category': category,
+        'author_id': author_id,
+        'search': search,
+        'hot': hot,
+        'cursor': cursor,
+        'limit': limit,
+        'preview': preview
     }
+    # A client pinned to the primary after its own write skips the cache,
+    # which may hold a page read from a lagging replica.
+    page = None if request.pinned_to_primary else feed_cache.get(cache_filters)
     
-    try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
+    if page is None:
+        query_params = {
+            'preview': preview,
+            'category': category,
+            'author_id': author_id,
+            'search': search,
+            'username_pattern': f'%{search}%',
+            'limit': limit + 1
+        }
+        
+        filters = ''
         
-        if method == 'GET':
-            params = event.get('queryStringParameters') or {}
-            user_id = params.get('user_id')
-            category = params.get('category')
-            search = params.get('search')
-            author_id = params.get('author_id')
+        if category:
+            filters += ' AND n.category = %(category)s'
+        
+        if author_id:
+            filters += ' AND n.author_id = %(author_id)s'
+        
+        if search:
+            # Articles match on their full-text vector or on the author's
+            # username (trigram index); both branches are index scans.
+            filters += f'''
+                AND (n.search_vector @@ websearch_to_tsquery('{SEARCH_CONFIG}', %(search)s)
+                     OR n.author_id = ANY(ARRAY(
+                         SELECT id FROM users WHERE username ILIKE %(username_pattern)s)))'''
+            rank = f"ts_rank_cd(n.search_vector, websearch_to_tsquery('{SEARCH_CONFIG}', %(search)s))"
+            
+            if position:
+                filters += f' AND ({rank}::float8, n.id) < (%(cursor_key)s, %(cursor_id)s)'
             
-            query = '''
+            # Headlines are costly, so they are built only for the page of
+            # rows that survives ranking and LIMIT. They are HTML: the text is
+            # escaped so that <mark> is the only markup in them.
+            query = f'''
+                SELECT f.*,
+                    ts_headline('{SEARCH_CONFIG}', html_escape(f.title), websearch_to_tsquery('{SEARCH_CONFIG}', %(search)s),
+                                '{TITLE_HEADLINE_OPTIONS}') as title_highlight,
+                    ts_headline('{SEARCH_CONFIG}', html_escape(f.content), websearch_to_tsquery('{SEARCH_CONFIG}', %(search)s),
+                                '{SNIPPET_HEADLINE_OPTIONS}') as snippet
+                FROM (
+                    SELECT 
+                        {ARTICLE_COLUMNS},
+                        {comments_column(preview)} as comments,
+                        {rank}::float8 as rank
+                    FROM news_articles n
+                    WHERE 1=1 {filters}
+                    ORDER BY rank DESC, n.id DESC
+                    LIMIT %(limit)s
+                ) f
+                ORDER BY f.rank DESC, f.id DESC
+            '''
+        else:
+            # sort=hot walks the stored hot_score index; the score is kept
+            # up to date by comments and counter folds, never aggregated here.
+            sort_key = 'n.hot_score' if hot else 'n.created_at'
+            if position:
+                filters += f' AND ({sort_key}, n.id) < (%(cursor_key)s, %(cursor_id)s)'
+                if not hot:
+                    # Row comparisons don't prune partitions; the plain
+                    # bound on created_at does.
+                    filters += ' AND n.created_at <= %(cursor_key)s'
+            
+            query = f'''
                 SELECT 
-                    n.id, n.title, n.content, n.excerpt, n.category, 
-                    n.author_id, n.likes_count, n.created_at,
-                    u.username as author_name, u.avatar_url as author_avatar,
-                    u.subscribers_count, u.likes_count as author_total_likes,
-                    u.publications_count,
-                    COALESCE(
-                        (SELECT json_agg(json_build_object(
-                            'id', c.id,
-                            'content', c.content,
-                            'author_name', cu.username,
-                            'author_avatar', cu.avatar_url,
-                            'created_at', c.created_at
-                        ) ORDER BY c.created_at DESC)
-                        FROM comments c
-                        JOIN users cu ON c.author_id = cu.id
-                        WHERE c.article_id = n.id), '[]'::json
-                    ) as comments
+                    {ARTICLE_COLUMNS},
+                    {comments_column(preview)} as comments{', n.hot_score as rank' if hot else ''}
                 FROM news_articles n
-                JOIN users u ON n.author_id = u.id
-                WHERE 1=1
+                WHERE 1=1 {filters}
+                ORDER BY {sort_key} DESC, n.id DESC
+                LIMIT %(limit)s
             '''
-            
-            query_params = []
-            
-            if category:
-                query += ' AND n.category = %s'
-                query_params.append(category)
-            
-            if search:
-                query += ' AND (n.title ILIKE %s OR n.content ILIKE %s OR u.username ILIKE %s)'
-                search_param = f'%{search}%'
-                query_params.extend([search_param, search_param, search_param])
-            
-            if author_id:
-                query += ' AND n.author_id = %s'
-                query_params.append(author_id)
-            
-            query += ' ORDER BY n.created_at DESC LIMIT 50'
-            
-            cur.execute(query, query_params)
-            articles = [dict(row) for row in cur.fetchall()]
-            
-            for article in articles:
-                article['date'] = get_time_ago(article['created_at'])
-                article['created_at'] = article['created_at'].isoformat()
-                
-                article['is_liked'] = False
-                if user_id:
-                    cur.execute(
-                        'SELECT 1 FROM likes WHERE article_id = %s AND user_id = %s',
-                        (article['id'], user_id)
-                    )
-                    article['is_liked'] = cur.fetchone() is not None
-                
-                if article['comments']:
-                    for comment in article['comments']:
-                        comment['timestamp'] = get_time_ago(comment['created_at'])
-                        comment['created_at'] = comment['created_at'].isoformat()
-            
-            return {
-                'statusCode': 200,
-                'headers': headers,
-                'body': json.dumps({'articles': articles}),
-                'isBase64Encoded': False
-            }
         
-        elif method == 'POST':
-            body = json.loads(event.get('body', '{}'))
-            action = body.get('action')
-            
-            if action == 'create':
-                title = body.get('title', '').strip()
-                content = body.get('content', '').strip()
-                category = body.get('category', '').strip()
-                author_id = body.get('author_id')
-                
-                if not all([title, content, category, author_id]):
-                    return {
-                        'statusCode': 400,
-                        'headers': headers,
-                        'body': json.dumps({'error': 'Все поля обязательны'}),
-                        'isBase64Encoded': False
-                    }
-                
-                excerpt = content[:200] + '...' if len(content) > 200 else content
-                
-                cur.execute(
-                    '''INSERT INTO news_articles (title, content, excerpt, category, author_id)
-                       VALUES (%s, %s, %s, %s, %s)
-                       RETURNING id, title, content, excerpt, category, author_id, likes_count, created_at''',
-                    (title, content, excerpt, category, author_id)
-                )
-                article = dict(cur.fetchone())
-                
-                cur.execute(
-                    'UPDATE users SET publications_count = publications_count + 1 WHERE id = %s',
-                    (author_id,)
-                )
-                
-                conn.commit()
-                
-                article['created_at'] = article['created_at'].isoformat()
-                
-                return {
-                    'statusCode': 201,
-                    'headers': headers,
-                    'body': json.dumps({'article': article}),
-                    'isBase64Encoded': False
-                }
-            
-            elif action == 'like':
-                article_id = body.get('article_id')
-                user_id = body.get('user_id')
-                
-                if not article_id or not user_id:
-                    return {
-                        'statusCode': 400,
-                        'headers': headers,
-                        'body': json.dumps({'error': 'ID статьи и пользователя обязательны'}),
-                        'isBase64Encoded': False
-                    }
-                
-                cur.execute(
-                    'SELECT 1 FROM likes WHERE article_id = %s AND user_id = %s',
-                    (article_id, user_id)
-                )
-                
-                if cur.fetchone():
-                    cur.execute(
-                        'DELETE FROM likes WHERE article_id = %s AND user_id = %s',
-                        (article_id, user_id)
-                    )
-                    cur.execute(
-                        'UPDATE news_articles SET likes_count = likes_count - 1 WHERE id = %s',
-                        (article_id,)
-                    )
-                    cur.execute(
-                        '''UPDATE users SET likes_count = likes_count - 1 
-                           WHERE id = (SELECT author_id FROM news_articles WHERE id = %s)''',
-                        (article_id,)
-                    )
-                    is_liked = False
-                else:
-                    cur.execute(
-                        'INSERT INTO likes (article_id, user_id) VALUES (%s, %s)',
-                        (article_id, user_id)
-                    )
-                    cur.execute(
-                        'UPDATE news_articles SET likes_count = likes_count + 1 WHERE id = %s',
-                        (article_id,)
-                    )
-                    cur.execute(
-                        '''UPDATE users SET likes_count = likes_count + 1 
-                           WHERE id = (SELECT author_id FROM news_articles WHERE id = %s)''',
-                        (article_id,)
-                    )
-                    is_liked = True
-                
-                conn.commit()
-                
-                cur.execute('SELECT likes_count FROM news_articles WHERE id = %s', (article_id,))
-                result = cur.fetchone()
-                likes_count = result['likes_count'] if result else 0
-                
-                return {
-                    'statusCode': 200,
-                    'headers': headers,
-                    'body': json.dumps({'is_liked': is_liked, 'likes_count': likes_count}),
-                    'isBase64Encoded': False
-                }
-            
-            elif action == 'comment':
-                article_id = body.get('article_id')
-                author_id = body.get('author_id')
-                content = body.get('content', '').strip()
-                
-                if not all([article_id, author_id, content]):
-                    return {
-                        'statusCode': 400,
-                        'headers': headers,
-                        'body': json.dumps({'error': 'Все поля обязательны'}),
-                        'isBase64Encoded': False
-                    }
-                
-                cur.execute(
-                    '''INSERT INTO comments (article_id, author_id, content)
-                       VALUES (%s, %s, %s)
-                       RETURNING id, content, created_at''',
-                    (article_id, author_id, content)
-                )
-                comment = dict(cur.fetchone())
-                
-                cur.execute(
-                    'SELECT username, avatar_url FROM users WHERE id = %s',
-                    (author_id,)
-                )
-                user = dict(cur.fetchone())
-                
-                conn.commit()
-                
-                comment['author_name'] = user['username']
-                comment['author_avatar'] = user['avatar_url']
-                comment['timestamp'] = get_time_ago(comment['created_at'])
-                comment['created_at'] = comment['created_at'].isoformat()
-                
-                return {
-                    'statusCode': 201,
-                    'headers': headers,
-                    'body': json.dumps({'comment': comment}),
-                    'isBase64Encoded': False
-                }
+        if position:
+            query_params['cursor_key'], query_params['cursor_id'] = position
         
-        return {
-            'statusCode': 405,
-            'headers': headers,
-            'body': json.dumps({'error': 'Метод не поддерживается'}),
-            'isBase64Encoded': False
-        }
+        # Each filter combination is a distinct prepared statement, planned
+        # once per pooled connection.
+        cur = request.cur
+        execute(cur, query, query_params)
+        articles = [dict(row) for row in cur.fetchall()]
         
-    except Exception as e:
-        return {
-            'statusCode': 500,
-            'headers': headers,
-            'body': json.dumps({'error': str(e)}),
-            'isBase64Encoded': False
-        }
-    finally:
-        if 'cur' in locals():
-            cur.close()
-        if 'conn' in locals():
-            conn.close()
+        next_cursor = None
+        if len(articles) > limit:
+            articles = articles[:limit]
+            last = articles[-1]
+            next_cursor = encode_cursor(last['rank'] if search or hot else last['created_at'], last['id'])
+        
+        page = {'articles': articles, 'next_cursor': next_cursor}
+        feed_cache.set(cache_filters, page)
+    
+    # Cached pages are shared between users: copy before overlaying
+    # the per-user like state.
+    articles = [dict(article) for article in page['articles']]
+    
+    if humanized:
+        for article in articles:
+            article['comments'] = [dict(comment) for comment in article['comments']]
+        humanize_articles(articles)
+    
+    mark_liked(request, user_id, articles)
+    
+    return response(200, {'articles': articles, 'next_cursor': page['next_cursor']}, validator.headers)
+
+@router.route('GET', 'following')
+def list_following(request: Request) -> Dict[str, Any]:
+    params = request.params
+    user_id = request.require_user()
+    limit, position = page_params(request)
+    preview = parse_limit(params.get('comments_preview'), DEFAULT_COMMENTS_PREVIEW, MAX_COMMENTS_PREVIEW, 0)
+    
+    if preview is None:
+        return error(400, 'Некорректный параметр comments_preview')
+    
+    query_params = {
+        'user_id': user_id,
+        'preview': preview,
+        'pull_subscribers': FANOUT_PULL_SUBSCRIBERS,
+        'limit': limit + 1
+    }
+    timeline_filter = ''
+    pulled_filter = ''
+    if position:
+        query_params['cursor_key'], query_params['cursor_id'] = position
+        timeline_filter = 'AND (t.created_at, t.article_id) < (%(cursor_key)s, %(cursor_id)s)'
+        pulled_filter = 'AND (n.created_at, n.id) < (%(cursor_key)s, %(cursor_id)s) AND n.created_at <= %(cursor_key)s'
+    
+    # Pushed entries are one range scan on the timelines primary key;
+    # followed authors above the fan-out threshold are pulled with one
+    # index range scan each. UNION drops articles present in both.
+    query = f'''
+        WITH pulled_authors AS (
+            SELECT author_id FROM subscriptions
+            WHERE subscriber_id = %(user_id)s
+              AND author_id = ANY(ARRAY(
+                  SELECT author_id FROM author_stats WHERE subscribers_count >= %(pull_subscribers)s))
+        ), entries AS (
+            (SELECT t.article_id, t.created_at
+             FROM timelines t
+             WHERE t.user_id = %(user_id)s {timeline_filter}
+             ORDER BY t.created_at DESC, t.article_id DESC
+             LIMIT %(limit)s)
+            UNION
+            (SELECT p.id, p.created_at
+             FROM pulled_authors a
+             CROSS JOIN LATERAL (
+                 SELECT n.id, n.created_at
+                 FROM news_articles n
+                 WHERE n.author_id = a.author_id {pulled_filter}
+                 ORDER BY n.created_at DESC, n.id DESC
+                 LIMIT %(limit)s
+             ) p)
+        ), page AS (
+            SELECT article_id, created_at FROM entries
+            ORDER BY created_at DESC, article_id DESC
+            LIMIT %(limit)s
+        )
+        SELECT
+            {ARTICLE_COLUMNS},
+            {comments_column(preview)} as comments
+        FROM page
+        JOIN news_articles n ON n.id = page.article_id AND n.created_at = page.created_at
+        ORDER BY n.created_at DESC, n.id DESC
+    '''
+    
+    cur = request.cur
+    execute(cur, query, query_params)
+    articles = [dict(row) for row in cur.fetchall()]
+    
+    next_cursor = None
+    if len(articles) > limit:
+        articles = articles[:limit]
+        next_cursor = encode_cursor(articles[-1]['created_at'], articles[-1]['id'])
+    
+    if wants_humanized(params.get('humanize')):
+        humanize_articles(articles)
+    
+    mark_liked(request, user_id, articles)
+    
+    return response(200, {'articles': articles, 'next_cursor': next_cursor})
+
+@router.route('GET', 'comments')
+def list_comments(request: Request) -> Dict[str, Any]:
+    article_id = request.params.get('article_id') or ''
+    limit, position = page_params(request)
+    
+    if not article_id.isdigit():
+        return error(400, 'ID статьи обязателен')
+    
+    query = '''
+        SELECT c.id, c.content, c.created_at,
+               cu.username as author_name, cu.avatar_url as author_avatar
+        FROM comments c
+        JOIN users cu ON c.author_id = cu.id
+        WHERE c.article_id = %s
+          AND c.created_at >= (SELECT created_at FROM article_keys WHERE id = %s)
+    '''
+    query_params = [article_id, article_id]
+    
+    if position:
+        query += ' AND (c.created_at, c.id) < (%s, %s) AND c.created_at <= %s'
+        query_params.extend(position)
+        query_params.append(position[0])
+    
+    query += ' ORDER BY c.created_at DESC, c.id DESC LIMIT %s'
+    query_params.append(limit + 1)
+    
+    cur = request.cur
+    cur.execute(query, query_params)
+    comments = [dict(row) for row in cur.fetchall()]
+    
+    next_cursor = None
+    if len(comments) > limit:
+        comments = comments[:limit]
+        next_cursor = encode_cursor(comments[-1]['created_at'], comments[-1]['id'])
+    
+    if wants_humanized(request.params.get('humanize')):
+        for comment, label in zip(comments, humanize(comment['created_at'] for comment in comments)):
+            comment['timestamp'] = label
+    
+    return response(200, {'comments': comments, 'next_cursor': next_cursor})
+
+@router.route('POST', 'create', limit='create')
+def create_article(request: Request) -> Dict[str, Any]:
+    body = request.body
+    title = body.get('title', '').strip()
+    content = body.get('content', '').strip()
+    category = body.get('category', '').strip()
+    author_id = request.require_user()
+    
+    if not all([title, content, category]):
+        return error(400, 'Все поля обязательны')
+    
+    excerpt = content[:200] + '...' if len(content) > 200 else content
+    
+    cur = request.cur
+    cur.execute(
+        '''INSERT INTO news_articles (title, content, excerpt, category, author_id)
+           VALUES (%s, %s, %s, %s, %s)
+           RETURNING id, title, content, excerpt, category, author_id, likes_count, created_at''',
+        (title, content, excerpt, category, author_id)
+    )
+    article = dict(cur.fetchone())
+    
+    # The author's publications_count and last_published_at are folded
+    # into author_stats with the other counter deltas.
+    cur.execute(
+        '''INSERT INTO counter_deltas (entity, entity_id, field, delta)
+           VALUES ('user', %s, 'publications_count', 1)''',
+        (author_id,)
+    )
+    bump_versions(cur, article_scopes(category, author_id))
+    
+    request.conn.commit()
+    get_feed_cache().invalidate()
+    maybe_fan_out(request.conn, article)
+    maybe_fold_deltas(request.conn)
+    
+    return response(201, {'article': article})
+
+@router.route('POST', 'like', limit='like')
+def toggle_like(request: Request) -> Dict[str, Any]:
+    user_id = request.require_user()
+    article_id = request.body.get('article_id')
+    
+    if not article_id:
+        return error(400, 'ID статьи обязателен')
+    
+    if async_enabled():
+        cur = request.cur
+        cur.execute(ENQUEUE_LIKE_SQL, {'article_id': article_id, 'user_id': user_id})
+        result = cur.fetchone()
+        request.conn.commit()
+        if result is None:
+            return error(404, 'Статья не найдена')
+        apply_pending_writes(request.conn)
+        return response(202, {'is_liked': result['is_liked'], 'likes_count': result['likes_count'] or 0, 'pending': True})
+    
+    # Single-statement toggle: the like row changes together with the
+    # queued counter deltas, so concurrent clicks can neither violate
+    # the unique constraint nor skew likes_count. The hot article and
+    # author rows are only touched when deltas are folded. likes has no
+    # foreign key to the partitioned news_articles, so the insert selects
+    # the article and a missing one yields no row (404). The article is
+    # found through article_keys, which prunes it to one partition.
+    cur = request.cur
+    execute(
+        cur,
+        '''WITH article AS (
+               SELECT n.id, n.author_id, n.likes_count
+               FROM news_articles n
+               WHERE n.id = %(article_id)s
+                 AND n.created_at = (SELECT created_at FROM article_keys WHERE id = %(article_id)s)
+           ), removed AS (
+               DELETE FROM likes WHERE article_id = %(article_id)s AND user_id = %(user_id)s
+               RETURNING 1
+           ), added AS (
+               INSERT INTO likes (article_id, user_id)
+               SELECT a.id, %(user_id)s::int
+               FROM article a
+               WHERE NOT EXISTS (SELECT 1 FROM removed)
+               ON CONFLICT (article_id, user_id) DO NOTHING
+               RETURNING 1
+           ), delta AS (
+               SELECT (SELECT COUNT(*) FROM added) - (SELECT COUNT(*) FROM removed) AS value
+           ), queued AS (
+               INSERT INTO counter_deltas (entity, entity_id, field, delta)
+               SELECT 'article', a.id, 'likes_count', d.value
+               FROM delta d, article a
+               WHERE d.value <> 0
+               UNION ALL
+               SELECT 'user', a.author_id, 'likes_count', d.value
+               FROM delta d, article a
+               WHERE d.value <> 0
+           ), versioned AS (
+               INSERT INTO content_versions (scope)
+               SELECT 'likes:' || %(user_id)s::text FROM delta WHERE value <> 0
+               ON CONFLICT (scope) DO UPDATE
+               SET version = content_versions.version + 1, updated_at = CURRENT_TIMESTAMP
+           )
+           SELECT EXISTS (SELECT 1 FROM added) AS is_liked,
+                  (a.likes_count
+                  + (SELECT COALESCE(SUM(delta), 0) FROM counter_deltas
+                     WHERE entity = 'article' AND entity_id = %(article_id)s AND field = 'likes_count')
+                  + (SELECT value FROM delta))::int AS likes_count
+           FROM article a''',
+        {'article_id': article_id, 'user_id': user_id}
+    )
+    result = cur.fetchone()
+    if result is None:
+        request.conn.rollback()
+        return error(404, 'Статья не найдена')
+    request.conn.commit()
+    get_feed_cache().invalidate()
+    apply_pending_writes(request.conn)
+    
+    return response(200, {'is_liked': result['is_liked'], 'likes_count': result['likes_count'] or 0})
+
+@router.route('POST', 'comment', limit='comment')
+def add_comment(request: Request) -> Dict[str, Any]:
+    body = request.body
+    author_id = request.require_user()
+    article_id = body.get('article_id')
+    content = body.get('content', '').strip()
+    
+    if not all([article_id, content]):
+        return error(400, 'Все поля обязательны')
+    
+    cur = request.cur
+    if async_enabled():
+        cur.execute(ENQUEUE_COMMENT_SQL, {'article_id': article_id, 'user_id': author_id, 'content': content})
+        queued = cur.fetchone()
+        request.conn.commit()
+        if queued is None:
+            return error(404, 'Статья не найдена')
+        apply_pending_writes(request.conn)
+        
+        # The comment id is assigned when the event is applied.
+        comment = {'id': None, **queued, 'pending': True}
+        if wants_humanized(body.get('humanize')):
+            comment['timestamp'] = humanize([comment['created_at']])[0]
+        return response(202, {'comment': comment})
+    
+    # As with likes, the article is selected rather than trusted: comments
+    # has no foreign key to the partitioned news_articles. Both statements
+    # reach it through article_keys, so they read a single partition.
+    cur.execute(
+        '''INSERT INTO comments (article_id, author_id, content)
+           SELECT n.id, %(author_id)s, %(content)s
+           FROM news_articles n
+           WHERE n.id = %(article_id)s
+             AND n.created_at = (SELECT created_at FROM article_keys WHERE id = %(article_id)s)
+           RETURNING id, content, created_at''',
+        {'author_id': author_id, 'content': content, 'article_id': article_id}
+    )
+    row = cur.fetchone()
+    if row is None:
+        request.conn.rollback()
+        return error(404, 'Статья не найдена')
+    comment = dict(row)
+    
+    cur.execute(
+        '''UPDATE news_articles
+           SET comments_count = comments_count + 1,
+               hot_score = hot_add(hot_score, %(weight)s, CURRENT_TIMESTAMP)
+           WHERE id = %(article_id)s
+             AND created_at = (SELECT created_at FROM article_keys WHERE id = %(article_id)s)
+           RETURNING category, author_id''',
+        {'weight': HOT_COMMENT_WEIGHT, 'article_id': article_id}
+    )
+    article = cur.fetchone()
+    bump_versions(cur, article_scopes(article['category'], article['author_id']))
+    
+    cur.execute(
+        'SELECT username, avatar_url FROM users WHERE id = %s',
+        (author_id,)
+    )
+    user = dict(cur.fetchone())
+    
+    request.conn.commit()
+    get_feed_cache().invalidate()
+    
+    comment['author_name'] = user['username']
+    comment['author_avatar'] = user['avatar_url']
+    if wants_humanized(body.get('humanize')):
+        comment['timestamp'] = humanize([comment['created_at']])[0]
+    
+    return response(201, {'comment': comment})
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    return router.dispatch(event, context)
@@ -0,0 +1,182 @@
+'''
+Asynchronous ingestion of likes and comments (INGEST_MODE=async).
+
+In async mode the `like` and `comment` actions only validate the request and
+append a row to write_events, answering with the optimistic result in the
+same round trip. Events are applied in batches by drain_events(): toggles
+are collapsed to their parity per (user, article) and applied with one
+multi-row INSERT and one DELETE on likes, comments are inserted with one
+multi-row INSERT keeping their original timestamps, and the counters are
+updated once per article (likes via counter_deltas, comments directly).
+A drain runs at most once per INGEST_DRAIN_INTERVAL per instance after a
+write, under an advisory lock so only one instance drains at a time;
+tools/drain_events.py drains from a scheduled job.
+'''
+
+import os
+import time
+from typing import Any, Dict
+import psycopg2
+from counters import HOT_COMMENT_WEIGHT
+
+INGEST_MODE = os.environ.get('INGEST_MODE', 'sync')
+INGEST_DRAIN_INTERVAL = float(os.environ.get('INGEST_DRAIN_INTERVAL', '1'))
+INGEST_BATCH = int(os.environ.get('INGEST_BATCH', '5000'))
+INGEST_LOCK = 730_002
+
+# The like state the user sees: the stored row, flipped by every toggle
+# still queued, flipped once more by this toggle.
+ENQUEUE_LIKE_SQL = '''
+    WITH state AS (
+        SELECT EXISTS (SELECT 1 FROM likes WHERE article_id = %(article_id)s AND user_id = %(user_id)s) AS stored,
+               (SELECT COUNT(*) FROM write_events
+                WHERE kind = 'like' AND article_id = %(article_id)s AND user_id = %(user_id)s) AS pending
+    ), queued AS (
+        INSERT INTO write_events (kind, user_id, article_id)
+        SELECT 'like', %(user_id)s, k.id FROM article_keys k WHERE k.id = %(article_id)s
+        RETURNING id
+    )
+    SELECT s.stored <> (mod(s.pending, 2) = 0) AS is_liked,
+           ((SELECT n.likes_count FROM news_articles n
+             WHERE n.id = %(article_id)s
+               AND n.created_at = (SELECT created_at FROM article_keys WHERE id = %(article_id)s))
+           + (SELECT COALESCE(SUM(delta), 0) FROM counter_deltas
+              WHERE entity = 'article' AND entity_id = %(article_id)s AND field = 'likes_count')
+           + CASE WHEN mod(s.pending, 2) = 1 THEN 0
+                  WHEN s.stored THEN -1 ELSE 1 END)::int AS likes_count
+    FROM state s, queued q
+'''
+
+ENQUEUE_COMMENT_SQL = '''
+    WITH queued AS (
+        INSERT INTO write_events (kind, user_id, article_id, content)
+        SELECT 'comment', %(user_id)s, k.id, %(content)s FROM article_keys k WHERE k.id = %(article_id)s
+        RETURNING id, user_id, content, created_at
+    )
+    SELECT q.id AS event_id, q.content, q.created_at,
+           u.username AS author_name, u.avatar_url AS author_avatar
+    FROM queued q JOIN users u ON u.id = q.user_id
+'''
+
+# Within one statement every CTE sees the likes table as of the statement
+# start, so `removed` and `added` split the toggled pairs by their stored
+# state without interfering. Articles are addressed by (id, created_at)
+# from article_keys, so only the partitions holding them are visited.
+DRAIN_SQL = '''
+    WITH batch AS (
+        DELETE FROM write_events
+        WHERE id IN (
+            SELECT id FROM write_events ORDER BY id LIMIT %(batch_size)s FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id, kind, user_id, article_id, content, created_at
+    ), toggles AS (
+        SELECT b.article_id, b.user_id, MAX(b.created_at) AS last_at
+        FROM batch b
+        JOIN article_keys k ON k.id = b.article_id
+        WHERE b.kind = 'like'
+        GROUP BY b.article_id, b.user_id
+        HAVING mod(COUNT(*), 2) = 1
+    ), removed AS (
+        DELETE FROM likes l USING toggles t
+        WHERE l.article_id = t.article_id AND l.user_id = t.user_id
+        RETURNING l.article_id, l.user_id
+    ), added AS (
+        INSERT INTO likes (article_id, user_id, created_at)
+        SELECT t.article_id, t.user_id, t.last_at
+        FROM toggles t
+        WHERE NOT EXISTS (SELECT 1 FROM likes l WHERE l.article_id = t.article_id AND l.user_id = t.user_id)
+        ON CONFLICT (article_id, user_id) DO NOTHING
+        RETURNING article_id, user_id
+    ), like_sums AS (
+        SELECT d.article_id, n.author_id, SUM(d.delta) AS delta
+        FROM (
+            SELECT article_id, 1 AS delta FROM added
+            UNION ALL
+            SELECT article_id, -1 FROM removed
+        ) d
+        JOIN article_keys k ON k.id = d.article_id
+        JOIN news_articles n ON n.id = k.id AND n.created_at = k.created_at
+        GROUP BY d.article_id, n.author_id
+        HAVING SUM(d.delta) <> 0
+    ), queued AS (
+        INSERT INTO counter_deltas (entity, entity_id, field, delta)
+        SELECT 'article', article_id, 'likes_count', delta FROM like_sums
+        UNION ALL
+        SELECT 'user', author_id, 'likes_count', SUM(delta) FROM like_sums GROUP BY author_id
+    ), new_comments AS (
+        INSERT INTO comments (article_id, author_id, content, created_at)
+        SELECT b.article_id, b.user_id, b.content, b.created_at
+        FROM batch b
+        JOIN article_keys k ON k.id = b.article_id
+        WHERE b.kind = 'comment'
+        ORDER BY b.id
+        RETURNING article_id, created_at
+    ), comment_sums AS (
+        SELECT c.article_id, k.created_at AS article_created_at,
+               COUNT(*) AS comments, MAX(c.created_at) AS last_at
+        FROM new_comments c
+        JOIN article_keys k ON k.id = c.article_id
+        GROUP BY c.article_id, k.created_at
+    ), commented AS (
+        UPDATE news_articles n
+        SET comments_count = n.comments_count + s.comments,
+            hot_score = hot_add(n.hot_score, %(comment_weight)s * s.comments, s.last_at)
+        FROM comment_sums s
+        WHERE n.id = s.article_id AND n.created_at = s.article_created_at
+        RETURNING n.category, n.author_id
+    ), touched AS (
+        SELECT unnest(ARRAY['feed', 'category:' || category, 'author:' || author_id]) AS scope FROM commented
+        UNION
+        SELECT 'likes:' || user_id FROM added
+        UNION
+        SELECT 'likes:' || user_id FROM removed
+    ), versioned AS (
+        INSERT INTO content_versions (scope)
+        SELECT scope FROM touched ORDER BY scope
+        ON CONFLICT (scope) DO UPDATE
+        SET version = content_versions.version + 1, updated_at = CURRENT_TIMESTAMP
+    )
+    SELECT (SELECT COUNT(*) FROM batch) AS drained,
+           (SELECT COUNT(*) FROM added) AS likes_added,
+           (SELECT COUNT(*) FROM removed) AS likes_removed,
+           (SELECT COUNT(*) FROM new_comments) AS comments_added
+'''
+
+_last_drain = 0.0
+
+
+def async_enabled() -> bool:
+    return INGEST_MODE == 'async'
+
+
+def drain_events(conn: Any, batch_size: int = INGEST_BATCH) -> Dict[str, int]:
+    '''Apply one batch of queued events; drains nothing if another instance holds the lock.'''
+    with conn.cursor() as cur:
+        cur.execute('SELECT pg_try_advisory_xact_lock(%s)', (INGEST_LOCK,))
+        if not cur.fetchone()[0]:
+            conn.rollback()
+            return {'drained': 0, 'likes_added': 0, 'likes_removed': 0, 'comments_added': 0}
+        cur.execute(DRAIN_SQL, {'batch_size': batch_size, 'comment_weight': HOT_COMMENT_WEIGHT})
+        drained, likes_added, likes_removed, comments_added = cur.fetchone()
+    conn.commit()
+    return {
+        'drained': drained,
+        'likes_added': likes_added,
+        'likes_removed': likes_removed,
+        'comments_added': comments_added
+    }
+
+
+def maybe_drain_events(conn: Any) -> int:
+    '''Drain queued events if this instance has not done so recently; returns the events applied.'''
+    global _last_drain
+    now = time.monotonic()
+    if now - _last_drain < INGEST_DRAIN_INTERVAL:
+        return 0
+    _last_drain = now
+    try:
+        return drain_events(conn)['drained']
+    except psycopg2.Error:
+        # Draining is best effort; the events stay queued for the next attempt.
+        conn.rollback()
+        return 0
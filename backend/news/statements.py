@@ -0,0 +1,95 @@
+'''
+Server-side prepared statements for the hot queries. execute() turns a
+statement's psycopg2 placeholders into $n parameters, PREPAREs it once per
+pooled connection under a name derived from its text, and from then on
+sends only EXECUTE name (params), so Postgres reuses the parsed statement
+and, once it settles on a generic plan, skips planning altogether. Every
+variant of a dynamically assembled query (one per filter combination) is
+its own statement. Request traces file the PREPARE and EXECUTE round
+trips under the source statement's fingerprint, not the statement name.
+PREPARED_STATEMENTS=0 falls back to ad-hoc execution, e.g. behind a
+transaction-pooling proxy where sessions are shared.
+Identical copies live in the news and users function directories.
+'''
+
+import hashlib
+import os
+import re
+import threading
+from functools import lru_cache
+from typing import Any, Dict, Optional, Sequence, Tuple, Union
+from telemetry import record_prepare, statement_source
+
+PREPARED_STATEMENTS = os.environ.get('PREPARED_STATEMENTS', '1') == '1'
+
+_PLACEHOLDERS = re.compile(r'%\((\w+)\)s|%s|%%')
+
+_stats = {'hits': 0, 'misses': 0}
+_stats_lock = threading.Lock()
+
+
+@lru_cache(maxsize=256)
+def compile_statement(sql: str) -> Tuple[str, str, Optional[Tuple[str, ...]], int]:
+    '''
+    (name, server-side text, parameter names or None for positional, number
+    of parameters). Named placeholders map to one $n each, however often
+    they occur; positional ones are numbered in order.
+    '''
+    names: Dict[str, int] = {}
+    positional = 0
+
+    def substitute(match: 're.Match[str]') -> str:
+        nonlocal positional
+        if match.group(0) == '%%':
+            return '%'
+        key = match.group(1)
+        if key is None:
+            positional += 1
+            return f'${positional}'
+        if key not in names:
+            names[key] = len(names) + 1
+        return f'${names[key]}'
+
+    text = _PLACEHOLDERS.sub(substitute, sql)
+    if names and positional:
+        raise ValueError('statement mixes named and positional parameters')
+    name = 'stmt_' + hashlib.blake2b(sql.encode(), digest_size=8).hexdigest()
+    if names:
+        return name, text, tuple(names), len(names)
+    return name, text, None, positional
+
+
+def execute(cur: Any, sql: str, params: Union[Dict[str, Any], Sequence[Any], None] = None) -> None:
+    '''cur.execute(sql, params), through a statement prepared on cur's connection.'''
+    prepared = getattr(cur.connection, 'prepared', None)
+    if not PREPARED_STATEMENTS or prepared is None:
+        cur.execute(sql, params)
+        return
+
+    name, text, keys, count = compile_statement(sql)
+    hit = name in prepared
+    with statement_source(sql):
+        if not hit:
+            # Prepared statements belong to the session, not the transaction:
+            # a later rollback leaves this one in place.
+            cur.execute(f'PREPARE {name} AS {text}')
+            prepared.add(name)
+        with _stats_lock:
+            _stats['hits' if hit else 'misses'] += 1
+        record_prepare(hit)
+
+        if not count:
+            cur.execute(f'EXECUTE {name}')
+        elif keys is None:
+            cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * count)})", params)
+        else:
+            cur.execute(f"EXECUTE {name} ({', '.join(f'%({key})s' for key in keys)})", params)
+
+
+def statement_stats() -> Dict[str, Any]:
+    '''Process-wide registry hits and misses (a miss is one PREPARE).'''
+    with _stats_lock:
+        stats = dict(_stats)
+    calls = stats['hits'] + stats['misses']
+    stats['hit_ratio'] = round(stats['hits'] / calls, 4) if calls else None
+    return stats
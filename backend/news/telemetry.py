@@ -0,0 +1,206 @@
+'''
+Per-request instrumentation. Router.dispatch opens a trace keyed by
+context.request_id; every cursor from the pool reports its statements into
+it (round trips, latency per normalised SQL fingerprint), statements.py
+reports prepared-statement hits and misses and files its PREPARE/EXECUTE
+round trips under the source statement, runtime.response reports JSON
+encoding time, and the finished trace is written as one JSON
+log line and, when enabled, as a Server-Timing header.
+Identical copies live in every function directory.
+'''
+
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+import traceback
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import psycopg2.extensions
+from psycopg2.extras import RealDictCursor
+
+REQUEST_LOG = os.environ.get('REQUEST_LOG', '1') == '1'
+SERVER_TIMING = os.environ.get('SERVER_TIMING', '0') == '1'
+TRACE_MAX_STATEMENTS = int(os.environ.get('TRACE_MAX_STATEMENTS', '10'))
+TRACE_SQL_CHARS = 160
+FUNCTION_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_COMMENTS = re.compile(r'--[^\n]*|/\*.*?\*/', re.S)
+_STRINGS = re.compile(r"'(?:[^']|'')*'")
+_PARAMS = re.compile(r'%\(\w+\)s|%s')
+_NUMBERS = re.compile(r'\b\d+(?:\.\d+)?\b')
+_LISTS = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_SPACE = re.compile(r'\s+')
+
+
+@lru_cache(maxsize=512)
+def fingerprint(sql: str) -> Tuple[str, str]:
+    '''Normalised statement text (literals and parameters as ?) and its short id.'''
+    text = _COMMENTS.sub(' ', sql)
+    text = _STRINGS.sub('?', text)
+    text = _PARAMS.sub('?', text)
+    text = _NUMBERS.sub('?', text)
+    text = _LISTS.sub('(?)', text)
+    text = _SPACE.sub(' ', text).strip()
+    return text, hashlib.blake2b(text.encode(), digest_size=6).hexdigest()
+
+
+class Trace:
+    def __init__(self, request_id: str, function: Optional[str], method: str):
+        self.request_id = request_id
+        self.function = function
+        self.method = method
+        self.action: Optional[str] = None
+        self.started = time.perf_counter()
+        self.round_trips = 0
+        self.db_seconds = 0.0
+        self.connect_seconds = 0.0
+        self.replica = False
+        self.prepared_hits = 0
+        self.prepared_misses = 0
+        self.serialize_seconds = 0.0
+        self.statements: Dict[str, List[Any]] = {}
+        self.error: Optional[Dict[str, Any]] = None
+
+    def record_statement(self, sql: Any, seconds: float) -> None:
+        self.round_trips += 1
+        self.db_seconds += seconds
+        text, key = fingerprint(sql if isinstance(sql, str) else str(sql))
+        entry = self.statements.get(key)
+        if entry is None:
+            self.statements[key] = [text, 1, seconds, seconds]
+        else:
+            entry[1] += 1
+            entry[2] += seconds
+            entry[3] = max(entry[3], seconds)
+
+    def fail(self, exc: BaseException) -> None:
+        # Point at the innermost frame of the function's own code rather
+        # than at the library call that raised.
+        frames = traceback.extract_tb(exc.__traceback__)
+        own = [frame for frame in frames if os.path.dirname(frame.filename) == FUNCTION_DIR]
+        frame = (own or frames or [None])[-1]
+        self.error = {
+            'type': type(exc).__name__,
+            'message': str(exc),
+            'where': f'{os.path.basename(frame.filename)}:{frame.lineno} in {frame.name}' if frame else None
+        }
+
+    def server_timing(self, total: float) -> str:
+        return ', '.join([
+            f'connect;dur={self.connect_seconds * 1000:.2f}',
+            f'db;dur={self.db_seconds * 1000:.2f};desc="{self.round_trips} queries"',
+            f'serialize;dur={self.serialize_seconds * 1000:.2f}',
+            f'total;dur={total * 1000:.2f}'
+        ])
+
+    def summary(self, status: Optional[int], total: float) -> Dict[str, Any]:
+        statements = sorted(self.statements.items(), key=lambda item: item[1][2], reverse=True)
+        return {
+            'request_id': self.request_id,
+            'function': self.function,
+            'method': self.method,
+            'action': self.action,
+            'status': status,
+            'total_ms': round(total * 1000, 2),
+            'connect_ms': round(self.connect_seconds * 1000, 2),
+            'db_ms': round(self.db_seconds * 1000, 2),
+            'serialize_ms': round(self.serialize_seconds * 1000, 2),
+            'round_trips': self.round_trips,
+            'replica': self.replica,
+            'prepared': {'hits': self.prepared_hits, 'misses': self.prepared_misses},
+            'statements': [
+                {
+                    'id': key,
+                    'sql': text[:TRACE_SQL_CHARS],
+                    'calls': calls,
+                    'total_ms': round(seconds * 1000, 2),
+                    'max_ms': round(slowest * 1000, 2)
+                }
+                for key, (text, calls, seconds, slowest) in statements[:TRACE_MAX_STATEMENTS]
+            ],
+            'error': self.error
+        }
+
+
+_current: ContextVar[Optional[Trace]] = ContextVar('trace', default=None)
+_source: ContextVar[Optional[str]] = ContextVar('statement_source', default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+
+def begin_trace(context: Any, method: str) -> Tuple[Trace, Any]:
+    request_id = getattr(context, 'request_id', None) or str(uuid.uuid4())
+    trace = Trace(request_id, getattr(context, 'function_name', None), method)
+    return trace, _current.set(trace)
+
+
+def end_trace(trace: Trace, token: Any, result: Optional[Dict[str, Any]]) -> None:
+    _current.reset(token)
+    total = time.perf_counter() - trace.started
+    if SERVER_TIMING and result is not None:
+        result['headers']['Server-Timing'] = trace.server_timing(total)
+        result['headers']['Timing-Allow-Origin'] = '*'
+    if REQUEST_LOG:
+        status = result['statusCode'] if result is not None else None
+        sys.stdout.write(json.dumps(trace.summary(status, total), ensure_ascii=False) + '\n')
+        sys.stdout.flush()
+
+
+def record_connect(seconds: float, replica: bool = False) -> None:
+    trace = _current.get()
+    if trace is not None:
+        trace.connect_seconds += seconds
+        trace.replica = trace.replica or replica
+
+
+def record_prepare(hit: bool) -> None:
+    trace = _current.get()
+    if trace is not None:
+        if hit:
+            trace.prepared_hits += 1
+        else:
+            trace.prepared_misses += 1
+
+
+@contextmanager
+def statement_source(sql: str) -> Iterator[None]:
+    '''Record the statements executed inside the block as `sql`.'''
+    token = _source.set(sql)
+    try:
+        yield
+    finally:
+        _source.reset(token)
+
+
+def record_serialize(seconds: float) -> None:
+    trace = _current.get()
+    if trace is not None:
+        trace.serialize_seconds += seconds
+
+
+class _TracedExecute:
+    def execute(self, query, vars=None):
+        trace = _current.get()
+        if trace is None:
+            return super().execute(query, vars)
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            trace.record_statement(_source.get() or query, time.perf_counter() - started)
+
+
+class TracedCursor(_TracedExecute, psycopg2.extensions.cursor):
+    pass
+
+
+class TracedRealDictCursor(_TracedExecute, RealDictCursor):
+    pass
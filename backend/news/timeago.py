@@ -0,0 +1,35 @@
+'''
+Humanised relative times ("5 мин назад") for clients that still want
+server-rendered strings. Responses carry UTC ISO timestamps; when a client
+asks for the strings, the whole batch is formatted against a single `now`
+taken once per response.
+'''
+
+from datetime import datetime, timezone
+from typing import Iterable, List, Optional, Union
+
+Timestamp = Union[datetime, str]
+
+
+def format_elapsed(seconds: float) -> str:
+    if seconds < 60:
+        return 'только что'
+    elif seconds < 3600:
+        return f'{int(seconds // 60)} мин назад'
+    elif seconds < 86400:
+        return f'{int(seconds // 3600)} ч назад'
+    else:
+        return f'{int(seconds // 86400)} д назад'
+
+
+def _epoch(timestamp: Timestamp) -> float:
+    if isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.timestamp()
+
+
+def humanize(timestamps: Iterable[Timestamp], now: Optional[datetime] = None) -> List[str]:
+    now_epoch = (now or datetime.now(timezone.utc)).timestamp()
+    return [format_elapsed(now_epoch - _epoch(timestamp)) for timestamp in timestamps]
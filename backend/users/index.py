@@ -4,162 +4,238 @@ Args: event with httpMethod, body, queryStringParameters; context with request_i
 Returns: HTTP response with user data
 '''
 
-import json
-import os
-from typing import Dict, Any
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from typing import Dict, Any, Tuple
+from runtime import Request, Router, error, response
+from counters import maybe_fold_deltas
+from statements import execute
+from versions import conditional
 
-def get_db_connection():
-    return psycopg2.connect(os.environ['DATABASE_URL'])
+SEARCH_CONFIG = 'russian'
+HEADLINE_OPTIONS = 'StartSel=<mark>, StopSel=</mark>, MaxWords=25, MinWords=10'
+TIMELINE_BACKFILL = 20
+PROFILE_ARTICLES = 10
+MAX_CARDS = 100
+STATS_COLUMNS = 'st.subscribers_count, st.likes_count, st.publications_count, st.last_published_at'
 
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
-    method: str = event.get('httpMethod', 'GET')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
-    
-    headers = {
-        'Content-Type': 'application/json',
-        'Access-Control-Allow-Origin': '*'
+router = Router('GET, POST, OPTIONS')
+
+def subscription_column(current_user_id: Any) -> Tuple[str, str]:
+    if current_user_id:
+        return ('s.id IS NOT NULL AS is_subscribed',
+                'LEFT JOIN subscriptions s ON s.author_id = u.id AND s.subscriber_id = %(current_user_id)s')
+    return 'FALSE AS is_subscribed', ''
+
+@router.route('GET')
+def list_users(request: Request) -> Dict[str, Any]:
+    current_user_id = request.user_id
+    search = (request.params.get('search') or '').strip()
+    
+    scopes = ['users']
+    if current_user_id:
+        scopes.append(f'subscriber:{current_user_id}')
+    not_modified, validator = conditional(request, scopes)
+    if not_modified:
+        return not_modified
+    
+    query_params = {
+        'current_user_id': current_user_id,
+        'search': search,
+        'username_pattern': f'%{search}%'
     }
     
-    try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        
-        if method == 'GET':
-            params = event.get('queryStringParameters') or {}
-            current_user_id = params.get('current_user_id')
-            search = params.get('search')
-            
-            query = '''
-                SELECT 
-                    id, username, avatar_url, bio,
-                    subscribers_count, likes_count, publications_count
-                FROM users
-                WHERE 1=1
-            '''
-            
-            query_params = []
-            
-            if search:
-                query += ' AND (username ILIKE %s OR bio ILIKE %s)'
-                search_param = f'%{search}%'
-                query_params.extend([search_param, search_param])
-            
-            query += ' ORDER BY subscribers_count DESC LIMIT 50'
-            
-            cur.execute(query, query_params)
-            users = [dict(row) for row in cur.fetchall()]
-            
-            if current_user_id:
-                for user in users:
-                    cur.execute(
-                        'SELECT 1 FROM subscriptions WHERE subscriber_id = %s AND author_id = %s',
-                        (current_user_id, user['id'])
-                    )
-                    user['is_subscribed'] = cur.fetchone() is not None
-            else:
-                for user in users:
-                    user['is_subscribed'] = False
-            
-            return {
-                'statusCode': 200,
-                'headers': headers,
-                'body': json.dumps({'users': users}),
-                'isBase64Encoded': False
-            }
-        
-        elif method == 'POST':
-            body = json.loads(event.get('body', '{}'))
-            action = body.get('action')
-            
-            if action == 'subscribe':
-                subscriber_id = body.get('subscriber_id')
-                author_id = body.get('author_id')
-                
-                if not subscriber_id or not author_id:
-                    return {
-                        'statusCode': 400,
-                        'headers': headers,
-                        'body': json.dumps({'error': 'ID подписчика и автора обязательны'}),
-                        'isBase64Encoded': False
-                    }
-                
-                if subscriber_id == author_id:
-                    return {
-                        'statusCode': 400,
-                        'headers': headers,
-                        'body': json.dumps({'error': 'Нельзя подписаться на самого себя'}),
-                        'isBase64Encoded': False
-                    }
-                
-                cur.execute(
-                    'SELECT 1 FROM subscriptions WHERE subscriber_id = %s AND author_id = %s',
-                    (subscriber_id, author_id)
-                )
-                
-                if cur.fetchone():
-                    cur.execute(
-                        'DELETE FROM subscriptions WHERE subscriber_id = %s AND author_id = %s',
-                        (subscriber_id, author_id)
-                    )
-                    cur.execute(
-                        'UPDATE users SET subscribers_count = subscribers_count - 1 WHERE id = %s',
-                        (author_id,)
-                    )
-                    is_subscribed = False
-                else:
-                    cur.execute(
-                        'INSERT INTO subscriptions (subscriber_id, author_id) VALUES (%s, %s)',
-                        (subscriber_id, author_id)
-                    )
-                    cur.execute(
-                        'UPDATE users SET subscribers_count = subscribers_count + 1 WHERE id = %s',
-                        (author_id,)
-                    )
-                    is_subscribed = True
-                
-                conn.commit()
-                
-                cur.execute('SELECT subscribers_count FROM users WHERE id = %s', (author_id,))
-                result = cur.fetchone()
-                subscribers_count = result['subscribers_count'] if result else 0
-                
-                return {
-                    'statusCode': 200,
-                    'headers': headers,
-                    'body': json.dumps({'is_subscribed': is_subscribed, 'subscribers_count': subscribers_count}),
-                    'isBase64Encoded': False
-                }
-        
-        return {
-            'statusCode': 405,
-            'headers': headers,
-            'body': json.dumps({'error': 'Метод не поддерживается'}),
-            'isBase64Encoded': False
-        }
-        
-    except Exception as e:
-        return {
-            'statusCode': 500,
-            'headers': headers,
-            'body': json.dumps({'error': str(e)}),
-            'isBase64Encoded': False
-        }
-    finally:
-        if 'cur' in locals():
-            cur.close()
-        if 'conn' in locals():
-            conn.close()
+    subscribed_column, subscriptions_join = subscription_column(current_user_id)
+    
+    if search:
+        # Usernames match by trigram (typos, partial names), bios by
+        # full-text search; the better of the two scores ranks the row.
+        tsquery = f"websearch_to_tsquery('{SEARCH_CONFIG}', %(search)s)"
+        query = f'''
+            SELECT
+                u.id, u.username, u.avatar_url, u.bio,
+                {STATS_COLUMNS},
+                {subscribed_column},
+                GREATEST(ts_rank_cd(u.search_vector, {tsquery}), similarity(u.username, %(search)s))::float8 as rank,
+                ts_headline('{SEARCH_CONFIG}', html_escape(COALESCE(u.bio, '')), {tsquery}, '{HEADLINE_OPTIONS}') as bio_highlight
+            FROM users u
+            JOIN author_stats st ON st.author_id = u.id
+            {subscriptions_join}
+            WHERE u.search_vector @@ {tsquery} OR u.username ILIKE %(username_pattern)s
+            ORDER BY rank DESC, st.subscribers_count DESC
+            LIMIT 50
+        '''
+    else:
+        query = f'''
+            SELECT
+                u.id, u.username, u.avatar_url, u.bio,
+                {STATS_COLUMNS},
+                {subscribed_column}
+            FROM author_stats st
+            JOIN users u ON u.id = st.author_id
+            {subscriptions_join}
+            ORDER BY st.subscribers_count DESC
+            LIMIT 50
+        '''
+    
+    cur = request.cur
+    execute(cur, query, query_params)
+    users = [dict(row) for row in cur.fetchall()]
+    
+    return response(200, {'users': users}, validator.headers)
+
+@router.route('GET', 'profile')
+def get_profile(request: Request) -> Dict[str, Any]:
+    current_user_id = request.user_id
+    author_id = request.params.get('author_id') or ''
+    
+    if not author_id.isdigit():
+        return error(400, 'ID автора обязателен')
+    
+    # Everything on the page depends on this author's row, stats and
+    # articles, so the validator is scoped to the author alone.
+    scopes = [f'author:{author_id}']
+    if current_user_id:
+        scopes.append(f'subscriber:{current_user_id}')
+    not_modified, validator = conditional(request, scopes)
+    if not_modified:
+        return not_modified
+    
+    subscribed_column, subscriptions_join = subscription_column(current_user_id)
+    cur = request.cur
+    cur.execute(
+        f'''SELECT
+               u.id, u.username, u.avatar_url, u.bio, u.created_at,
+               {STATS_COLUMNS},
+               {subscribed_column},
+               COALESCE(
+                   (SELECT json_agg(json_build_object(
+                       'id', a.id,
+                       'title', a.title,
+                       'excerpt', a.excerpt,
+                       'category', a.category,
+                       'likes_count', a.likes_count,
+                       'comments_count', a.comments_count,
+                       'created_at', to_char(a.created_at AT TIME ZONE 'UTC', 'YYYY-MM-DD"T"HH24:MI:SS.US"+00:00"')
+                   ) ORDER BY a.created_at DESC, a.id DESC)
+                   FROM (
+                       SELECT n.id, n.title, n.excerpt, n.category, n.likes_count, n.comments_count, n.created_at
+                       FROM news_articles n
+                       WHERE n.author_id = u.id
+                       ORDER BY n.created_at DESC, n.id DESC
+                       LIMIT %(articles)s
+                   ) a), '[]'::json
+               ) AS articles
+           FROM users u
+           JOIN author_stats st ON st.author_id = u.id
+           {subscriptions_join}
+           WHERE u.id = %(author_id)s''',
+        {'author_id': int(author_id), 'current_user_id': current_user_id, 'articles': PROFILE_ARTICLES}
+    )
+    row = cur.fetchone()
+    
+    if row is None:
+        return error(404, 'Пользователь не найден')
+    
+    profile = dict(row)
+    articles = profile.pop('articles')
+    return response(200, {'profile': profile, 'articles': articles}, validator.headers)
+
+@router.route('GET', 'authors')
+def get_author_cards(request: Request) -> Dict[str, Any]:
+    raw_ids = (request.params.get('ids') or '').split(',')
+    ids = sorted({int(value) for value in raw_ids if value.strip().isdigit()})
+    
+    if not ids:
+        return error(400, 'Список авторов обязателен')
+    
+    if len(ids) > MAX_CARDS:
+        return error(400, f'Не больше {MAX_CARDS} авторов за запрос')
+    
+    # Cards carry no per-viewer state, so any client holding the same
+    # set of ids revalidates against the same ETag.
+    not_modified, validator = conditional(request, [f'author:{author_id}' for author_id in ids])
+    if not_modified:
+        return not_modified
+    
+    cur = request.cur
+    cur.execute(
+        f'''SELECT u.id, u.username, u.avatar_url, {STATS_COLUMNS}
+            FROM author_stats st
+            JOIN users u ON u.id = st.author_id
+            WHERE st.author_id = ANY(%(ids)s)''',
+        {'ids': ids}
+    )
+    authors = [dict(row) for row in cur.fetchall()]
+    
+    return response(200, {'authors': authors}, validator.headers)
+
+@router.route('POST', 'subscribe', limit='subscribe')
+def toggle_subscription(request: Request) -> Dict[str, Any]:
+    subscriber_id = request.require_user()
+    author_id = request.body.get('author_id')
+    
+    if not author_id:
+        return error(400, 'ID автора обязателен')
+    
+    if str(subscriber_id) == str(author_id):
+        return error(400, 'Нельзя подписаться на самого себя')
+    
+    # Same single-statement toggle as likes: the subscription row, the
+    # queued subscribers_count delta and the subscriber's following-feed
+    # timeline (seeded with the author's latest articles, or pruned of
+    # them) commit together.
+    cur = request.cur
+    execute(
+        cur,
+        '''WITH removed AS (
+               DELETE FROM subscriptions
+               WHERE subscriber_id = %(subscriber_id)s AND author_id = %(author_id)s
+               RETURNING 1
+           ), added AS (
+               INSERT INTO subscriptions (subscriber_id, author_id)
+               SELECT %(subscriber_id)s::int, %(author_id)s::int
+               WHERE NOT EXISTS (SELECT 1 FROM removed)
+               ON CONFLICT (subscriber_id, author_id) DO NOTHING
+               RETURNING 1
+           ), delta AS (
+               SELECT (SELECT COUNT(*) FROM added) - (SELECT COUNT(*) FROM removed) AS value
+           ), queued AS (
+               INSERT INTO counter_deltas (entity, entity_id, field, delta)
+               SELECT 'user', %(author_id)s::int, 'subscribers_count', value
+               FROM delta
+               WHERE value <> 0
+           ), backfilled AS (
+               INSERT INTO timelines (user_id, article_id, author_id, created_at)
+               SELECT %(subscriber_id)s::int, n.id, n.author_id, n.created_at
+               FROM news_articles n
+               WHERE n.author_id = %(author_id)s AND EXISTS (SELECT 1 FROM added)
+               ORDER BY n.created_at DESC, n.id DESC
+               LIMIT %(backfill)s
+               ON CONFLICT DO NOTHING
+           ), pruned AS (
+               DELETE FROM timelines
+               WHERE user_id = %(subscriber_id)s AND author_id = %(author_id)s
+                 AND EXISTS (SELECT 1 FROM removed)
+           ), versioned AS (
+               INSERT INTO content_versions (scope)
+               SELECT 'subscriber:' || %(subscriber_id)s::text FROM delta WHERE value <> 0
+               ON CONFLICT (scope) DO UPDATE
+               SET version = content_versions.version + 1, updated_at = CURRENT_TIMESTAMP
+           )
+           SELECT EXISTS (SELECT 1 FROM added) AS is_subscribed,
+                  ((SELECT subscribers_count FROM author_stats WHERE author_id = %(author_id)s)
+                  + (SELECT COALESCE(SUM(delta), 0) FROM counter_deltas
+                     WHERE entity = 'user' AND entity_id = %(author_id)s AND field = 'subscribers_count')
+                  + (SELECT value FROM delta))::int AS subscribers_count''',
+        {'subscriber_id': subscriber_id, 'author_id': author_id, 'backfill': TIMELINE_BACKFILL}
+    )
+    result = cur.fetchone()
+    request.conn.commit()
+    maybe_fold_deltas(request.conn)
+    
+    return response(200, {
+        'is_subscribed': result['is_subscribed'],
+        'subscribers_count': result['subscribers_count'] or 0
+    })
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    return router.dispatch(event, context)
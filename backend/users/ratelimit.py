@@ -0,0 +1,202 @@
+'''
+Token-bucket rate limiting for write actions.
+
+Each (action, scope, key) has a bucket of `capacity` requests refilled
+evenly over `period` seconds; scopes are "user" (the session's user id),
+"ip" (client address) and "account" (the username a login targets, per
+client address). Buckets are kept as a single "theoretical arrival time"
+per key (GCRA, equivalent to a token bucket). A check reads every bucket
+of the action and takes from them only if all of them allow it, in one
+atomic step, so a request rejected by one scope does not drain the
+others. Two backends:
+
+* MemoryBuckets - per-instance dict with LRU eviction (the default).
+* SharedBuckets - a shared store that runs BUCKET_SCRIPT atomically
+  (redis-py `eval` interface); LocalScriptStore is an in-process stand-in
+  that runs the same algorithm for development and tests.
+
+Router.dispatch checks the budget of a route before the handler runs, so a
+throttled request never touches the database.
+Identical copies live in every function directory.
+'''
+
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')
+RATE_LIMIT_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', '10000'))
+
+# action -> scope -> (capacity, period in seconds)
+DEFAULT_BUDGETS: Dict[str, Dict[str, Tuple[int, float]]] = {
+    'create': {'user': (5, 600), 'ip': (20, 600)},
+    'like': {'user': (60, 60), 'ip': (200, 60)},
+    'comment': {'user': (10, 60), 'ip': (40, 60)},
+    'subscribe': {'user': (30, 60), 'ip': (100, 60)},
+    'login': {'ip': (20, 300), 'account': (5, 300)},
+    'register': {'ip': (5, 3600)},
+    'change_password': {'user': (5, 600)},
+}
+
+
+def parse_budgets(spec: str, defaults: Dict[str, Dict[str, Tuple[int, float]]]) -> Dict[str, Dict[str, Tuple[int, float]]]:
+    '''Overrides like `like.user=30/60;login.ip=10/60` on top of `defaults`.'''
+    budgets = {action: dict(scopes) for action, scopes in defaults.items()}
+    for item in filter(None, (part.strip() for part in spec.split(';'))):
+        name, _, value = item.partition('=')
+        action, _, scope = name.strip().partition('.')
+        capacity, _, period = value.partition('/')
+        if not action or not scope or not period:
+            raise ValueError(f'Invalid RATE_LIMITS entry {item!r}')
+        budgets.setdefault(action, {})[scope] = (int(capacity), float(period))
+    return budgets
+
+
+BUDGETS = parse_budgets(os.environ.get('RATE_LIMITS', ''), DEFAULT_BUDGETS)
+
+
+def gcra(tat: Optional[float], now: float, capacity: int, period: float, cost: int = 1) -> Tuple[float, float]:
+    '''
+    One bucket step. Returns (new arrival time, retry_after); retry_after is
+    0 when the request is allowed, in which case the new time must be stored.
+    '''
+    interval = period / capacity
+    new_tat = max(tat or now, now) + cost * interval
+    allow_at = new_tat - period
+    if allow_at > now:
+        return tat or now, allow_at - now
+    return new_tat, 0.0
+
+
+# (key, capacity, period) of every bucket one request draws from.
+Buckets = List[Tuple[str, int, float]]
+
+
+class MemoryBuckets:
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._tats: 'OrderedDict[str, float]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, buckets: Buckets, now: float) -> float:
+        with self._lock:
+            steps = [gcra(self._tats.get(key), now, capacity, period) for key, capacity, period in buckets]
+            retry_after = max((step[1] for step in steps), default=0.0)
+            if not retry_after:
+                for (key, _, _), (tat, _) in zip(buckets, steps):
+                    self._tats[key] = tat
+                    self._tats.move_to_end(key)
+                while len(self._tats) > self.max_keys:
+                    self._tats.popitem(last=False)
+            return retry_after
+
+
+# KEYS are the buckets; ARGV is now followed by capacity, period per key.
+BUCKET_SCRIPT = '''
+local now = tonumber(ARGV[1])
+local retry_after = 0
+local new_tats = {}
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[2 * i])
+    local period = tonumber(ARGV[2 * i + 1])
+    local tat = tonumber(redis.call('GET', key) or ARGV[1])
+    local new_tat = math.max(tat, now) + period / capacity
+    local allow_at = new_tat - period
+    if allow_at > now then
+        retry_after = math.max(retry_after, allow_at - now)
+    end
+    new_tats[i] = new_tat
+end
+if retry_after > 0 then
+    return tostring(retry_after)
+end
+for i, key in ipairs(KEYS) do
+    redis.call('SET', key, tostring(new_tats[i]), 'PX', math.ceil((new_tats[i] - now) * 1000))
+end
+return '0'
+'''
+
+
+class LocalScriptStore:
+    '''
+    In-process stand-in for a shared store: `eval` of BUCKET_SCRIPT runs the
+    same GCRA step under a lock instead of interpreting Lua.
+    '''
+
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.buckets = MemoryBuckets(max_keys)
+
+    def eval(self, script: str, numkeys: int, *keys_and_args: Any) -> bytes:
+        keys, (now, *limits) = keys_and_args[:numkeys], keys_and_args[numkeys:]
+        buckets = [(key, int(limits[2 * i]), float(limits[2 * i + 1])) for i, key in enumerate(keys)]
+        return repr(self.buckets.take(buckets, float(now))).encode()
+
+
+class SharedBuckets:
+    def __init__(self, store: Any, prefix: str = 'ratelimit:'):
+        self.store = store
+        self.prefix = prefix
+
+    def take(self, buckets: Buckets, now: float) -> float:
+        keys = [self.prefix + key for key, _, _ in buckets]
+        limits = [value for _, capacity, period in buckets for value in (capacity, repr(period))]
+        return float(self.store.eval(BUCKET_SCRIPT, len(keys), *keys, repr(now), *limits))
+
+
+class RateLimiter:
+    def __init__(self, backend: Any, budgets: Dict[str, Dict[str, Tuple[int, float]]] = BUDGETS):
+        self.backend = backend
+        self.budgets = budgets
+        self.throttled = 0
+
+    def check(self, action: str, keys: Dict[str, Optional[str]]) -> float:
+        '''
+        Take one token from every bucket of `action` whose scope has a key,
+        or from none of them. Returns 0 when allowed, otherwise the seconds
+        until a retry can pass.
+        '''
+        buckets = [
+            (f'{action}:{scope}:{keys[scope]}', capacity, period)
+            for scope, (capacity, period) in self.budgets.get(action, {}).items()
+            if keys.get(scope) is not None
+        ]
+        if not buckets:
+            return 0.0
+        retry_after = self.backend.take(buckets, time.time())
+        if retry_after:
+            self.throttled += 1
+        return retry_after
+
+
+class NullLimiter:
+    throttled = 0
+
+    def check(self, action: str, keys: Dict[str, Optional[str]]) -> float:
+        return 0.0
+
+
+def retry_after_header(seconds: float) -> Dict[str, str]:
+    return {'Retry-After': str(max(1, math.ceil(seconds))), 'Access-Control-Expose-Headers': 'Retry-After'}
+
+
+_rate_limiter: Optional[Any] = None
+
+
+def configure_rate_limiter(backend: Optional[Any], budgets: Dict[str, Dict[str, Tuple[int, float]]] = BUDGETS) -> None:
+    '''Install a bucket backend explicitly (None disables limiting).'''
+    global _rate_limiter
+    _rate_limiter = RateLimiter(backend, budgets) if backend is not None else NullLimiter()
+
+
+def get_rate_limiter() -> Any:
+    if _rate_limiter is None:
+        if RATE_LIMIT_BACKEND == 'off':
+            configure_rate_limiter(None)
+        elif RATE_LIMIT_BACKEND == 'shared':
+            configure_rate_limiter(SharedBuckets(LocalScriptStore()))
+        else:
+            configure_rate_limiter(MemoryBuckets())
+    return _rate_limiter
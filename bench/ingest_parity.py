@@ -0,0 +1,223 @@
+'''
+Check: asynchronous ingestion (INGEST_MODE=async, backend/news/ingest.py)
+ends in exactly the state the synchronous write path produces.
+
+Replays one seeded random sequence of like toggles (including repeated
+toggles of the same pair) and comments through the news handler three
+times on fresh rows:
+
+* sync             - every write applied inside the request;
+* async            - every write queued, then drained once at the end;
+* async-interleaved - every write queued and drained right away.
+
+After each run the queue is drained and the counter deltas folded, then the
+likes, the comments (per article, in order), the article counters and the
+authors' author_stats rows are compared with the sync run. Exits with
+status 1 on any difference.
+
+Usage:
+    DATABASE_URL=postgres://... python bench/ingest_parity.py [--operations 300] [--seed 1]
+
+The schema from db_migrations must already be applied. Seeded rows are
+removed when the check finishes.
+'''
+
+import argparse
+import json
+import os
+import random
+import sys
+from typing import Any, Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'backend', 'news'))
+os.environ.setdefault('REQUEST_LOG', '0')
+os.environ.setdefault('SESSION_KEYS', 'bench:bench-only-secret')
+os.environ['FEED_CACHE_BACKEND'] = 'off'
+os.environ['RATE_LIMIT_BACKEND'] = 'off'
+
+import psycopg2  # noqa: E402
+import counters  # noqa: E402
+import db  # noqa: E402
+import index  # noqa: E402
+import ingest  # noqa: E402
+import sessions  # noqa: E402
+
+PREFIX = 'bench_ingest_'
+USERS = 5
+ARTICLES = 3
+MODES = ('sync', 'async', 'async-interleaved')
+
+Operation = Tuple[str, int, int, str]
+
+
+def operations(count: int, seed: int) -> List[Operation]:
+    '''(kind, user index, article index, comment text); likes dominate, as in production.'''
+    rnd = random.Random(seed)
+    ops: List[Operation] = []
+    for i in range(count):
+        user, article = rnd.randrange(USERS), rnd.randrange(ARTICLES)
+        if rnd.random() < 0.7:
+            ops.append(('like', user, article, ''))
+        else:
+            ops.append(('comment', user, article, f'Комментарий {i}'))
+    return ops
+
+
+def cleanup(conn) -> None:
+    pattern = PREFIX + '%'
+    bench_users = 'SELECT id FROM users WHERE username LIKE %(pattern)s'
+    bench_articles = f'SELECT id FROM news_articles WHERE author_id IN ({bench_users})'
+    with conn.cursor() as cur:
+        for statement in (
+            f'DELETE FROM write_events WHERE user_id IN ({bench_users}) OR article_id IN ({bench_articles})',
+            f'DELETE FROM likes WHERE user_id IN ({bench_users}) OR article_id IN ({bench_articles})',
+            f'DELETE FROM comments WHERE author_id IN ({bench_users}) OR article_id IN ({bench_articles})',
+            f'''DELETE FROM counter_deltas
+                WHERE (entity = 'user' AND entity_id IN ({bench_users}))
+                   OR (entity = 'article' AND entity_id IN ({bench_articles}))''',
+            f'DELETE FROM news_articles WHERE author_id IN ({bench_users})',
+            'DELETE FROM users WHERE username LIKE %(pattern)s'
+        ):
+            cur.execute(statement, {'pattern': pattern})
+    conn.commit()
+
+
+def seed(conn) -> Tuple[List[int], List[int]]:
+    with conn.cursor() as cur:
+        cur.execute(
+            '''WITH u AS (
+                   INSERT INTO users (username, password_hash)
+                   SELECT %s || g, 'x' FROM generate_series(1, %s) g
+                   RETURNING id
+               ), st AS (
+                   INSERT INTO author_stats (author_id) SELECT id FROM u
+               )
+               SELECT array_agg(id ORDER BY id) FROM u''',
+            (PREFIX, USERS)
+        )
+        user_ids = cur.fetchone()[0]
+        cur.execute(
+            '''INSERT INTO news_articles (title, content, excerpt, category, author_id)
+               SELECT %s || g, 'Текст', 'Текст', 'Наука', (%s::int[])[1 + mod(g, 2)]
+               FROM generate_series(1, %s) g
+               RETURNING id''',
+            (PREFIX, user_ids, ARTICLES)
+        )
+        article_ids = sorted(row[0] for row in cur.fetchall())
+    conn.commit()
+    return user_ids, article_ids
+
+
+def post(token: str, body: Dict[str, Any]) -> None:
+    response = index.handler({
+        'httpMethod': 'POST',
+        'headers': {'Authorization': f'Bearer {token}'},
+        'body': json.dumps(body)
+    }, None)
+    assert response['statusCode'] in (200, 201, 202), response['body']
+
+
+def settle(conn) -> None:
+    '''Drain every queued event and fold every pending counter delta.'''
+    while ingest.drain_events(conn)['drained']:
+        pass
+    while counters.fold_deltas(conn):
+        pass
+
+
+def snapshot(conn) -> Dict[str, Any]:
+    '''The observable state, keyed by usernames and titles so runs on fresh ids compare.'''
+    params = {'pattern': PREFIX + '%'}
+    with conn.cursor() as cur:
+        cur.execute(
+            '''SELECT n.title, u.username
+               FROM likes l
+               JOIN users u ON u.id = l.user_id
+               JOIN news_articles n ON n.id = l.article_id
+               WHERE n.title LIKE %(pattern)s
+               ORDER BY 1, 2''',
+            params
+        )
+        likes = cur.fetchall()
+        cur.execute(
+            '''SELECT n.title, u.username, c.content
+               FROM comments c
+               JOIN users u ON u.id = c.author_id
+               JOIN news_articles n ON n.id = c.article_id
+               WHERE n.title LIKE %(pattern)s
+               ORDER BY n.title, c.created_at, c.id''',
+            params
+        )
+        comments = cur.fetchall()
+        cur.execute(
+            '''SELECT title, likes_count, comments_count FROM news_articles
+               WHERE title LIKE %(pattern)s ORDER BY title''',
+            params
+        )
+        articles = cur.fetchall()
+        cur.execute(
+            '''SELECT u.username, st.likes_count, st.subscribers_count, st.publications_count
+               FROM author_stats st JOIN users u ON u.id = st.author_id
+               WHERE u.username LIKE %(pattern)s ORDER BY 1''',
+            params
+        )
+        authors = cur.fetchall()
+        cur.execute(
+            '''SELECT COUNT(*) FROM write_events e JOIN users u ON u.id = e.user_id
+               WHERE u.username LIKE %(pattern)s''',
+            params
+        )
+        queued = cur.fetchone()[0]
+    conn.rollback()
+    return {'likes': likes, 'comments': comments, 'articles': articles, 'authors': authors, 'queued': queued}
+
+
+def run(conn, mode: str, ops: List[Operation]) -> Dict[str, Any]:
+    cleanup(conn)
+    user_ids, article_ids = seed(conn)
+    tokens = [sessions.issue_token(user_id)[0] for user_id in user_ids]
+    ingest.INGEST_MODE = 'sync' if mode == 'sync' else 'async'
+    # Opportunistic drains: after every write, or never until settle().
+    ingest.INGEST_DRAIN_INTERVAL = 0.0 if mode == 'async-interleaved' else float('inf')
+    for kind, user, article, content in ops:
+        body: Dict[str, Any] = {'action': kind, 'article_id': article_ids[article]}
+        if kind == 'comment':
+            body['content'] = content
+        post(tokens[user], body)
+    settle(conn)
+    return snapshot(conn)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--operations', type=int, default=300)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    ops = operations(args.operations, args.seed)
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    failed = False
+    try:
+        expected = run(conn, 'sync', ops)
+        print(f"sync: {len(expected['likes'])} likes, {len(expected['comments'])} comments")
+        for mode in MODES[1:]:
+            actual = run(conn, mode, ops)
+            differences = [key for key in expected if actual[key] != expected[key]]
+            if differences:
+                failed = True
+                print(f'{mode}: MISMATCH in {", ".join(differences)}')
+                for key in differences:
+                    print(f'  expected {key}: {expected[key]}')
+                    print(f'  actual   {key}: {actual[key]}')
+            else:
+                print(f'{mode}: identical')
+    finally:
+        cleanup(conn)
+        conn.close()
+        db.get_pool().close()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,381 @@
+'''
+Load test: drives the news, users and auth handlers in-process against a
+seeded Postgres and reports throughput, latency percentiles and database
+round trips per request for each scenario.
+
+Usage:
+    DATABASE_URL=postgres://... python bench/load.py [--users 1000] [--articles 5000]
+        [--comments-per-article 5] [--max-likes 500] [--likes-skew 1.0] [--follows 50]
+        [--concurrency 4] [--duration 10] [--scenarios feed,search,...]
+        [--save-baseline bench/baselines/local.json | --baseline bench/baselines/local.json]
+
+The schema from db_migrations must already be applied. Seeded rows (users
+prefixed with `bench_load_` and everything they own) are removed before
+seeding and when the run finishes, unless --keep is given. Seeding ends
+with tools/bulk_content.py's recount, which recomputes the aggregates of
+the whole database.
+
+--save-baseline stores the results as JSON. --baseline compares a run with
+a stored one and exits with status 1 when any scenario regresses by more
+than --tolerance (p95 latency or throughput) or needs more round trips.
+'''
+
+import argparse
+import importlib
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from types import ModuleType
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import psycopg2
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FUNCTIONS = ('news', 'users', 'auth')
+PREFIX = 'bench_load_'
+PASSWORD = 'bench-password'
+CATEGORIES = ['Технологии', 'Наука', 'Спорт', 'Культура', 'Политика']
+
+_stats = threading.local()
+
+
+def round_trips() -> int:
+    return getattr(_stats, 'round_trips', 0)
+
+
+class Context:
+    def __init__(self, function_name: str):
+        self.function_name = function_name
+        self.request_id = str(uuid.uuid4())
+
+
+def load_function(name: str) -> Dict[str, ModuleType]:
+    '''
+    Import backend/<name>/index.py with its own copies of the shared modules
+    (db, runtime, ...), exactly as the function sees them when deployed, and
+    take them out of sys.modules so the next function gets fresh copies.
+    '''
+    path = os.path.join(ROOT, 'backend', name)
+    sys.path.insert(0, path)
+    try:
+        importlib.import_module('index')
+    finally:
+        sys.path.remove(path)
+    modules = {}
+    for key, module in list(sys.modules.items()):
+        if os.path.dirname(getattr(module, '__file__', None) or '') == path:
+            modules[key] = sys.modules.pop(key)
+    return modules
+
+
+def install_counting_pool(db: ModuleType, dsn: str) -> None:
+    '''Replace the function's pool with one whose cursors count round trips per thread.'''
+    counting_classes = {}
+
+    def counting(base):
+        if base not in counting_classes:
+            class Counting(base):
+                def execute(self, query, vars=None):
+                    _stats.round_trips = round_trips() + 1
+                    return super().execute(query, vars)
+            counting_classes[base] = Counting
+        return counting_classes[base]
+
+    class CountingConnection(db.PooledConnection):
+        def cursor(self, *args, **kwargs):
+            base = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+            kwargs['cursor_factory'] = counting(base)
+            return super().cursor(*args, **kwargs)
+
+    class CountingPool(db.ConnectionPool):
+        def _connect(self):
+            return psycopg2.connect(self.dsn, connection_factory=CountingConnection)
+
+    db._pool = CountingPool(dsn)
+
+
+def cleanup(conn) -> None:
+    pattern = PREFIX + '%'
+    bench_users = 'SELECT id FROM users WHERE username LIKE %(pattern)s'
+    bench_articles = f'SELECT id FROM news_articles WHERE author_id IN ({bench_users})'
+    with conn.cursor() as cur:
+        for statement in (
+            f'DELETE FROM timelines WHERE user_id IN ({bench_users}) OR article_id IN ({bench_articles})',
+            f'DELETE FROM likes WHERE user_id IN ({bench_users}) OR article_id IN ({bench_articles})',
+            f'DELETE FROM comments WHERE author_id IN ({bench_users}) OR article_id IN ({bench_articles})',
+            f'DELETE FROM subscriptions WHERE subscriber_id IN ({bench_users}) OR author_id IN ({bench_users})',
+            f'''DELETE FROM counter_deltas
+                WHERE (entity = 'user' AND entity_id IN ({bench_users}))
+                   OR (entity = 'article' AND entity_id IN ({bench_articles}))''',
+            f'DELETE FROM news_articles WHERE author_id IN ({bench_users})',
+            'DELETE FROM users WHERE username LIKE %(pattern)s'
+        ):
+            cur.execute(statement, {'pattern': pattern})
+    conn.commit()
+
+
+def seed(conn, args, password_hash: str) -> Dict[str, List[int]]:
+    '''Set-based seeding; returns the ids the scenarios pick from.'''
+    with conn.cursor() as cur:
+        cur.execute(
+            '''WITH inserted AS (
+                   INSERT INTO users (username, password_hash, bio)
+                   SELECT %(prefix)s || g, %(hash)s, 'Пишу о технологиях и науке, автор ' || g
+                   FROM generate_series(1, %(users)s) g
+                   RETURNING id
+               )
+               SELECT array_agg(id ORDER BY id) FROM inserted''',
+            {'prefix': PREFIX, 'hash': password_hash, 'users': args.users}
+        )
+        user_ids = cur.fetchone()[0]
+
+        # Authors are spread with a multiplicative hash so that some write a
+        # lot more than others; articles are one minute apart.
+        cur.execute(
+            '''WITH inserted AS (
+                   INSERT INTO news_articles (title, content, excerpt, category, author_id, created_at)
+                   SELECT 'Новость о технологиях номер ' || g,
+                          repeat('Исследователи представили новую технологию обработки данных. ', 20),
+                          'Исследователи представили новую технологию обработки данных.',
+                          (%(categories)s::text[])[(1 + mod(g, cardinality(%(categories)s::text[])))::int],
+                          (%(user_ids)s::int[])[(1 + mod(g::bigint * g, cardinality(%(user_ids)s::int[])))::int],
+                          CURRENT_TIMESTAMP - g * interval '1 minute'
+                   FROM generate_series(1, %(articles)s) g
+                   RETURNING id
+               )
+               SELECT array_agg(id ORDER BY id) FROM inserted''',
+            {'categories': CATEGORIES, 'user_ids': user_ids, 'articles': args.articles}
+        )
+        article_ids = cur.fetchone()[0]
+
+        # Comments follow their article by a few seconds, as real ones do
+        # (comment lookups only consider comments newer than the article).
+        cur.execute(
+            '''INSERT INTO comments (article_id, author_id, content, created_at)
+               SELECT n.id, (%(user_ids)s::int[])[(1 + mod(a.ord * 31 + c, cardinality(%(user_ids)s::int[])))::int],
+                      'Интересная статья, спасибо ' || c, n.created_at + c * interval '1 second'
+               FROM unnest(%(article_ids)s::int[]) WITH ORDINALITY a(id, ord)
+               JOIN news_articles n ON n.id = a.id
+               CROSS JOIN generate_series(1, %(per_article)s) c''',
+            {'user_ids': user_ids, 'article_ids': article_ids, 'per_article': args.comments_per_article}
+        )
+
+        # Likes follow a power law: the article at popularity rank r gets
+        # max_likes / r^skew likes from distinct users.
+        cur.execute(
+            '''INSERT INTO likes (article_id, user_id)
+               SELECT a.id, (%(user_ids)s::int[])[(1 + mod(a.ord * 31 + k, cardinality(%(user_ids)s::int[])))::int]
+               FROM unnest(%(article_ids)s::int[]) WITH ORDINALITY a(id, ord)
+               CROSS JOIN LATERAL generate_series(
+                   1, LEAST(cardinality(%(user_ids)s::int[]), floor(%(max_likes)s / power(a.ord, %(skew)s))::int)) k
+               ON CONFLICT DO NOTHING''',
+            {'user_ids': user_ids, 'article_ids': article_ids, 'max_likes': args.max_likes, 'skew': args.likes_skew}
+        )
+
+        cur.execute(
+            '''INSERT INTO subscriptions (subscriber_id, author_id)
+               SELECT u.id, (%(user_ids)s::int[])[(1 + mod(u.ord - 1 + f, cardinality(%(user_ids)s::int[])))::int]
+               FROM unnest(%(user_ids)s::int[]) WITH ORDINALITY u(id, ord)
+               CROSS JOIN generate_series(1, LEAST(%(follows)s, cardinality(%(user_ids)s::int[]) - 1)) f
+               ON CONFLICT DO NOTHING''',
+            {'user_ids': user_ids, 'follows': args.follows}
+        )
+    conn.commit()
+
+    sys.path.insert(0, os.path.join(ROOT, 'tools'))
+    try:
+        import bulk_content
+        bulk_content.recount(conn)
+    finally:
+        sys.path.remove(os.path.join(ROOT, 'tools'))
+    return {'users': user_ids, 'articles': article_ids}
+
+
+def scenarios(ids: Dict[str, List[int]],
+              issue_token: Callable[[int], Tuple[str, int]]) -> Dict[str, Tuple[str, Callable[[random.Random], Dict[str, Any]]]]:
+    '''Scenario name -> (function, event factory).'''
+    users, articles = ids['users'], ids['articles']
+    tokens: Dict[int, str] = {}
+
+    def headers(user_id: Optional[int]) -> Dict[str, str]:
+        if user_id is None:
+            return {}
+        if user_id not in tokens:
+            tokens[user_id] = issue_token(user_id)[0]
+        return {'Authorization': f'Bearer {tokens[user_id]}'}
+
+    def get(params: Dict[str, Any], user_id: Optional[int] = None) -> Dict[str, Any]:
+        return {
+            'httpMethod': 'GET',
+            'headers': headers(user_id),
+            'queryStringParameters': {k: str(v) for k, v in params.items()}
+        }
+
+    def post(body: Dict[str, Any], user_id: Optional[int] = None) -> Dict[str, Any]:
+        return {'httpMethod': 'POST', 'headers': headers(user_id), 'body': json.dumps(body)}
+
+    return {
+        'feed': ('news', lambda rnd: get({}, rnd.choice(users))),
+        'feed_anonymous': ('news', lambda rnd: get({})),
+        'feed_hot': ('news', lambda rnd: get({'sort': 'hot'}, rnd.choice(users))),
+        'feed_category': ('news', lambda rnd: get({'category': rnd.choice(CATEGORIES)}, rnd.choice(users))),
+        'feed_author': ('news', lambda rnd: get({'author_id': rnd.choice(users)})),
+        'search': ('news', lambda rnd: get({'search': rnd.choice(['технологии', 'данных', 'новость'])},
+                                           rnd.choice(users))),
+        'following': ('news', lambda rnd: get({'action': 'following'}, rnd.choice(users))),
+        'comments': ('news', lambda rnd: get({'action': 'comments', 'article_id': rnd.choice(articles)})),
+        'like': ('news', lambda rnd: post({'action': 'like', 'article_id': rnd.choice(articles)}, rnd.choice(users))),
+        'comment': ('news', lambda rnd: post({'action': 'comment', 'article_id': rnd.choice(articles),
+                                              'content': 'Нагрузочный комментарий'}, rnd.choice(users))),
+        'directory': ('users', lambda rnd: get({}, rnd.choice(users))),
+        'directory_search': ('users', lambda rnd: get({'search': 'автор'}, rnd.choice(users))),
+        'login': ('auth', lambda rnd: post({'action': 'login', 'username': f'{PREFIX}{rnd.randint(1, len(users))}',
+                                            'password': PASSWORD})),
+    }
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def run_scenario(handler: Callable, function_name: str, make_event: Callable, concurrency: int,
+                 duration: float, seed_value: int) -> Dict[str, Any]:
+    # One untimed request per worker warms the pool and the module caches.
+    warm = random.Random(seed_value)
+    for _ in range(concurrency):
+        handler(make_event(warm), Context(function_name))
+
+    deadline = time.perf_counter() + duration
+
+    def worker(worker_id: int) -> Dict[str, Any]:
+        rnd = random.Random(seed_value + worker_id)
+        latencies, trips, errors = [], 0, 0
+        while time.perf_counter() < deadline:
+            event = make_event(rnd)
+            before = round_trips()
+            started = time.perf_counter()
+            result = handler(event, Context(function_name))
+            latencies.append((time.perf_counter() - started) * 1000)
+            trips += round_trips() - before
+            if result['statusCode'] >= 500:
+                errors += 1
+        return {'latencies': latencies, 'round_trips': trips, 'errors': errors}
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(worker, range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for result in results for latency in result['latencies'])
+    requests = len(latencies)
+    return {
+        'requests': requests,
+        'errors': sum(result['errors'] for result in results),
+        'throughput': requests / elapsed,
+        'p50': percentile(latencies, 0.50),
+        'p95': percentile(latencies, 0.95),
+        'p99': percentile(latencies, 0.99),
+        'round_trips': sum(result['round_trips'] for result in results) / max(requests, 1)
+    }
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]], tolerance: float) -> List[str]:
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result['p95'] > base['p95'] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {base['p95']:.2f} -> {result['p95']:.2f} ms")
+        if result['throughput'] < base['throughput'] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {base['throughput']:.1f} -> {result['throughput']:.1f} req/s")
+        if result['round_trips'] > base['round_trips'] + 0.05:
+            regressions.append(f"{name}: round trips {base['round_trips']:.2f} -> {result['round_trips']:.2f}")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--articles', type=int, default=5000)
+    parser.add_argument('--comments-per-article', type=int, default=5)
+    parser.add_argument('--max-likes', type=int, default=500)
+    parser.add_argument('--likes-skew', type=float, default=1.0)
+    parser.add_argument('--follows', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per scenario')
+    parser.add_argument('--scenarios', help='comma-separated subset (default: all)')
+    parser.add_argument('--feed-cache', default='off', help='FEED_CACHE_BACKEND for the run (default: off)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--save-baseline', metavar='PATH')
+    parser.add_argument('--baseline', metavar='PATH')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--keep', action='store_true', help='keep the seeded rows')
+    args = parser.parse_args()
+
+    dsn = os.environ['DATABASE_URL']
+    os.environ['FEED_CACHE_BACKEND'] = args.feed_cache
+    os.environ.setdefault('REQUEST_LOG', '0')
+    os.environ.setdefault('SESSION_KEYS', 'bench:bench-only-secret')
+    os.environ.setdefault('RATE_LIMIT_BACKEND', 'off')
+    functions = {name: load_function(name) for name in FUNCTIONS}
+    for modules in functions.values():
+        install_counting_pool(modules['db'], dsn)
+
+    issue_token = functions['auth']['sessions'].issue_token
+    available = scenarios({'users': [], 'articles': []}, issue_token)
+    selected = args.scenarios.split(',') if args.scenarios else list(available)
+    unknown = [name for name in selected if name not in available]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)} (choose from {', '.join(available)})")
+
+    setup = psycopg2.connect(dsn)
+    try:
+        cleanup(setup)
+        started = time.perf_counter()
+        ids = seed(setup, args, functions['auth']['passwords'].hash_password(PASSWORD))
+        print(f'seeded {args.users} users / {args.articles} articles in {time.perf_counter() - started:.1f}s')
+
+        results = {}
+        print(f"{'scenario':<18} {'requests':>8} {'errors':>6} {'req/s':>8} {'p50 ms':>8} "
+              f"{'p95 ms':>8} {'p99 ms':>8} {'trips':>6}")
+        for name in selected:
+            function_name, make_event = scenarios(ids, issue_token)[name]
+            result = run_scenario(functions[function_name]['index'].handler, function_name, make_event,
+                                  args.concurrency, args.duration, args.seed)
+            results[name] = result
+            print(f"{name:<18} {result['requests']:>8} {result['errors']:>6} {result['throughput']:>8.1f} "
+                  f"{result['p50']:>8.2f} {result['p95']:>8.2f} {result['p99']:>8.2f} {result['round_trips']:>6.2f}")
+    finally:
+        if not args.keep:
+            cleanup(setup)
+        setup.close()
+        for modules in functions.values():
+            modules['db'].get_pool().close()
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save_baseline)), exist_ok=True)
+        with open(args.save_baseline, 'w', encoding='utf-8') as output:
+            json.dump({'params': vars(args), 'results': results}, output, indent=2, ensure_ascii=False)
+        print(f'baseline saved to {args.save_baseline}')
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as source:
+            regressions = compare(results, json.load(source)['results'], args.tolerance)
+        if regressions:
+            print('REGRESSIONS:')
+            for line in regressions:
+                print(f'  {line}')
+            sys.exit(1)
+        print(f'no regressions against {args.baseline}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+'''
+Micro-benchmark: password hashes per second for each KDF cost setting.
+
+Usage:
+    python bench/password_hashing.py [--seconds 2] [--threads 1 2 4]
+
+For every cost setting the benchmark hashes for --seconds using each of the
+given thread counts and reports hashes/sec and per-hash latency. Use it to
+pick SCRYPT_N / PBKDF2_ITERATIONS and KDF_WORKERS for an instance size.
+'''
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'backend', 'auth'))
+
+import passwords  # noqa: E402
+
+COST_SETTINGS = [
+    {'scheme': 'scrypt', 'n': 2 ** 13, 'r': 8, 'p': 1},
+    {'scheme': 'scrypt', 'n': 2 ** 14, 'r': 8, 'p': 1},
+    {'scheme': 'scrypt', 'n': 2 ** 15, 'r': 8, 'p': 1},
+    {'scheme': 'pbkdf2_sha256', 'iterations': 210000},
+    {'scheme': 'pbkdf2_sha256', 'iterations': 600000},
+]
+
+
+def label(params) -> str:
+    options = ', '.join(f'{name}={value}' for name, value in params.items() if name != 'scheme')
+    return f"{params['scheme']} ({options})"
+
+
+def run(params, threads: int, seconds: float):
+    deadline = time.perf_counter() + seconds
+
+    def worker() -> int:
+        count = 0
+        while time.perf_counter() < deadline:
+            passwords.hash_password('benchmark-password', params)
+            count += 1
+        return count
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        total = sum(pool.map(lambda _: worker(), range(threads)))
+    elapsed = time.perf_counter() - started
+    return total / elapsed, elapsed * threads / total * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='KDF throughput per cost setting')
+    parser.add_argument('--seconds', type=float, default=2.0)
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4])
+    args = parser.parse_args()
+
+    print(f"{'setting':<40} {'threads':>7} {'hashes/s':>10} {'ms/hash':>9}")
+    for params in COST_SETTINGS:
+        for threads in args.threads:
+            rate, latency = run(params, threads, args.seconds)
+            print(f'{label(params):<40} {threads:>7} {rate:>10.1f} {latency:>9.1f}')
+
+
+if __name__ == '__main__':
+    main()
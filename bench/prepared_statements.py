@@ -0,0 +1,179 @@
+'''
+Benchmark: planning time and latency of the feed with and without the
+prepared-statement registry (backend/news/statements.py).
+
+For each feed variant (first page, category page, cursor page, hot, search)
+it captures the exact statement the handler sends, then reports the mean
+planning time of ad-hoc execution against EXECUTE of the prepared statement
+(from EXPLAIN ANALYZE), and the handler's p50/p95 latency in both modes.
+
+Usage:
+    DATABASE_URL=postgres://... python bench/prepared_statements.py [--articles 2000] [--runs 200]
+
+The schema from db_migrations must already be applied. Seeded rows are
+removed when the benchmark finishes.
+'''
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from typing import Any, Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'backend', 'news'))
+os.environ.setdefault('REQUEST_LOG', '0')
+os.environ['FEED_CACHE_BACKEND'] = 'off'
+
+import psycopg2  # noqa: E402
+import db  # noqa: E402
+import index  # noqa: E402
+import statements  # noqa: E402
+
+PREFIX = 'bench_prep_'
+CATEGORIES = ['Технологии', 'Наука', 'Спорт']
+# Postgres switches a prepared statement to its generic plan after five
+# custom-planned executions; warm up past that before measuring.
+WARMUP = 6
+
+
+def seed(conn, n_articles: int) -> None:
+    with conn.cursor() as cur:
+        cur.execute(
+            '''WITH u AS (
+                   INSERT INTO users (username, password_hash) VALUES (%s, 'x') RETURNING id
+               ), st AS (
+                   INSERT INTO author_stats (author_id) SELECT id FROM u
+               )
+               INSERT INTO news_articles (title, content, excerpt, category, author_id, created_at)
+               SELECT 'Новость о технологиях номер ' || g,
+                      repeat('Исследователи представили новую технологию обработки данных. ', 20),
+                      'Исследователи представили новую технологию обработки данных.',
+                      (%s::text[])[1 + mod(g, %s)], u.id, CURRENT_TIMESTAMP - g * interval '1 minute'
+               FROM u CROSS JOIN generate_series(1, %s) g''',
+            (PREFIX + 'author', CATEGORIES, len(CATEGORIES), n_articles)
+        )
+        cur.execute(
+            '''INSERT INTO comments (article_id, author_id, content, created_at)
+               SELECT n.id, n.author_id, 'Интересная статья, спасибо ' || c, n.created_at + c * interval '1 second'
+               FROM news_articles n
+               JOIN users u ON u.id = n.author_id AND u.username = %s
+               CROSS JOIN generate_series(1, 3) c''',
+            (PREFIX + 'author',)
+        )
+    conn.commit()
+
+
+def cleanup(conn) -> None:
+    bench_users = 'SELECT id FROM users WHERE username LIKE %(pattern)s'
+    with conn.cursor() as cur:
+        for statement in (
+            f'DELETE FROM comments WHERE author_id IN ({bench_users})',
+            f'DELETE FROM news_articles WHERE author_id IN ({bench_users})',
+            'DELETE FROM users WHERE username LIKE %(pattern)s'
+        ):
+            cur.execute(statement, {'pattern': PREFIX + '%'})
+    conn.commit()
+
+
+def feed(params: Dict[str, str]) -> Dict[str, Any]:
+    response = index.handler({'httpMethod': 'GET', 'queryStringParameters': params, 'headers': {}}, None)
+    assert response['statusCode'] == 200, response['body']
+    return json.loads(response['body'])
+
+
+def variants() -> Dict[str, Dict[str, str]]:
+    first = feed({})
+    return {
+        'first page': {},
+        'category': {'category': CATEGORIES[0]},
+        'cursor page': {'cursor': first['next_cursor']},
+        'hot': {'sort': 'hot'},
+        'search': {'search': 'технологии'}
+    }
+
+
+def capture(params: Dict[str, str]) -> Tuple[str, Dict[str, Any]]:
+    '''The feed statement (SQL and parameters) the handler sends for `params`.'''
+    captured: List[Tuple[str, Dict[str, Any]]] = []
+    original = index.execute
+
+    def recording(cur, sql, query_params=None):
+        captured.append((sql, query_params))
+        return original(cur, sql, query_params)
+
+    index.execute = recording
+    try:
+        feed(params)
+    finally:
+        index.execute = original
+    return captured[0]
+
+
+def planning_ms(cur, sql: str, params: Any) -> float:
+    cur.execute('EXPLAIN (ANALYZE, FORMAT JSON) ' + sql, params)
+    plan = cur.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Planning Time']
+
+
+def compare_planning(conn, sql: str, params: Dict[str, Any], runs: int) -> Tuple[float, float]:
+    name, text, keys, _ = statements.compile_statement(sql)
+    with conn.cursor() as cur:
+        adhoc = [planning_ms(cur, sql, params) for _ in range(runs)]
+        cur.execute(f'PREPARE {name} AS {text}')
+        execute_sql = f"EXECUTE {name} ({', '.join(f'%({key})s' for key in keys)})"
+        for _ in range(WARMUP):
+            cur.execute(execute_sql, params)
+        prepared = [planning_ms(cur, execute_sql, params) for _ in range(runs)]
+        cur.execute(f'DEALLOCATE {name}')
+    conn.rollback()
+    return statistics.mean(adhoc), statistics.mean(prepared)
+
+
+def latency(params: Dict[str, str], runs: int) -> Tuple[float, float]:
+    for _ in range(WARMUP):
+        feed(params)
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        feed(params)
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return statistics.median(timings), timings[int(len(timings) * 0.95) - 1]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--articles', type=int, default=2000)
+    parser.add_argument('--runs', type=int, default=200)
+    parser.add_argument('--plan-runs', type=int, default=50)
+    args = parser.parse_args()
+
+    setup = psycopg2.connect(os.environ['DATABASE_URL'])
+    try:
+        cleanup(setup)
+        seed(setup, args.articles)
+        print(f"{'variant':<12} {'plan ad-hoc':>12} {'plan prepared':>14} "
+              f"{'p50 ad-hoc':>11} {'p50 prepared':>13} {'p95 ad-hoc':>11} {'p95 prepared':>13}")
+        for name, params in variants().items():
+            sql, query_params = capture(params)
+            adhoc_plan, prepared_plan = compare_planning(setup, sql, query_params, args.plan_runs)
+            statements.PREPARED_STATEMENTS = False
+            adhoc_p50, adhoc_p95 = latency(params, args.runs)
+            statements.PREPARED_STATEMENTS = True
+            prepared_p50, prepared_p95 = latency(params, args.runs)
+            print(f'{name:<12} {adhoc_plan:9.3f} ms {prepared_plan:11.3f} ms '
+                  f'{adhoc_p50:8.2f} ms {prepared_p50:10.2f} ms {adhoc_p95:8.2f} ms {prepared_p95:10.2f} ms')
+        print('registry:', statements.statement_stats())
+    finally:
+        cleanup(setup)
+        setup.close()
+        db.get_pool().close()
+
+
+if __name__ == '__main__':
+    main()
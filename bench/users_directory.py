@@ -0,0 +1,163 @@
+'''
+Benchmark: database round trips and latency of the users directory GET.
+
+Compares the legacy per-user `is_subscribed` lookup (N+1 queries) with the
+current handler, which resolves subscriptions in the directory query itself.
+
+Usage:
+    DATABASE_URL=postgres://... python bench/users_directory.py [--users 50] [--runs 200]
+
+The schema from db_migrations must already be applied. Seeded rows are
+removed when the benchmark finishes.
+'''
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'backend', 'users'))
+os.environ.setdefault('REQUEST_LOG', '0')
+os.environ.setdefault('SESSION_KEYS', 'bench:bench-only-secret')
+
+import psycopg2  # noqa: E402
+from psycopg2.extras import RealDictCursor  # noqa: E402
+import db  # noqa: E402
+import index  # noqa: E402
+import sessions  # noqa: E402
+
+PREFIX = 'bench_dir_'
+
+
+class CountingConnection(db.PooledConnection):
+    '''Pooled connection whose cursors count every execute() as a round trip.'''
+
+    round_trips = 0
+
+    def cursor(self, *args, **kwargs):
+        base = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+        kwargs['cursor_factory'] = _counting(base)
+        return super().cursor(*args, **kwargs)
+
+
+_counting_classes = {}
+
+
+def _counting(base):
+    if base not in _counting_classes:
+        class Counting(base):
+            def execute(self, query, vars=None):
+                CountingConnection.round_trips += 1
+                return super().execute(query, vars)
+        _counting_classes[base] = Counting
+    return _counting_classes[base]
+
+
+class CountingPool(db.ConnectionPool):
+    def _connect(self):
+        return psycopg2.connect(self.dsn, connection_factory=CountingConnection)
+
+
+def seed(conn, n_users: int) -> int:
+    with conn.cursor() as cur:
+        cur.execute(
+            '''WITH u AS (
+                   INSERT INTO users (username, password_hash)
+                   SELECT %s || g, 'x' FROM generate_series(1, %s) g
+                   RETURNING id
+               ), st AS (
+                   INSERT INTO author_stats (author_id, subscribers_count)
+                   SELECT id, %s + 1 - row_number() OVER (ORDER BY id) FROM u
+               )
+               SELECT id FROM u ORDER BY id''',
+            (PREFIX, n_users, n_users)
+        )
+        ids = [row[0] for row in cur.fetchall()]
+        subscriber_id = ids[0]
+        cur.execute(
+            '''INSERT INTO subscriptions (subscriber_id, author_id)
+               SELECT %s, a FROM unnest(%s::int[]) a WHERE a <> %s''',
+            (subscriber_id, ids, subscriber_id)
+        )
+    conn.commit()
+    return subscriber_id
+
+
+def cleanup(conn) -> None:
+    with conn.cursor() as cur:
+        cur.execute(
+            '''DELETE FROM subscriptions WHERE subscriber_id IN (SELECT id FROM users WHERE username LIKE %s)''',
+            (PREFIX + '%',)
+        )
+        cur.execute('DELETE FROM users WHERE username LIKE %s', (PREFIX + '%',))
+    conn.commit()
+
+
+def legacy_directory(current_user_id: int) -> None:
+    '''The pre-batching implementation: one subscription lookup per listed user.'''
+    conn = db.get_db_connection()
+    try:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute(
+            '''SELECT u.id, u.username, u.avatar_url, u.bio,
+                      st.subscribers_count, st.likes_count, st.publications_count, st.last_published_at
+               FROM author_stats st JOIN users u ON u.id = st.author_id
+               ORDER BY st.subscribers_count DESC LIMIT 50'''
+        )
+        users = [dict(row) for row in cur.fetchall()]
+        for user in users:
+            cur.execute(
+                'SELECT 1 FROM subscriptions WHERE subscriber_id = %s AND author_id = %s',
+                (current_user_id, user['id'])
+            )
+            user['is_subscribed'] = cur.fetchone() is not None
+        cur.close()
+    finally:
+        db.release_db_connection(conn)
+
+
+def current_directory(current_user_id: int) -> None:
+    token, _ = sessions.issue_token(current_user_id)
+    response = index.handler({'httpMethod': 'GET', 'headers': {'Authorization': f'Bearer {token}'}}, None)
+    assert response['statusCode'] == 200, response['body']
+
+
+def measure(name: str, fn, current_user_id: int, runs: int) -> None:
+    fn(current_user_id)
+    CountingConnection.round_trips = 0
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn(current_user_id)
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    print(
+        f'{name:<10} round trips/request: {CountingConnection.round_trips / runs:6.1f}   '
+        f'p50: {statistics.median(timings):7.2f} ms   '
+        f'p95: {timings[int(len(timings) * 0.95) - 1]:7.2f} ms'
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--runs', type=int, default=200)
+    args = parser.parse_args()
+
+    db._pool = CountingPool(os.environ['DATABASE_URL'])
+    setup = psycopg2.connect(os.environ['DATABASE_URL'])
+    try:
+        cleanup(setup)
+        subscriber_id = seed(setup, args.users)
+        measure('legacy', legacy_directory, subscriber_id, args.runs)
+        measure('current', current_directory, subscriber_id, args.runs)
+    finally:
+        cleanup(setup)
+        setup.close()
+        db.get_pool().close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,10 @@
+-- Keyset pagination walks the feed by (created_at, id) descending.
+-- The composite indexes below serve the unfiltered, per-category and
+-- per-author feed pages and supersede the single-column indexes.
+CREATE INDEX idx_news_created_id ON news_articles(created_at DESC, id DESC);
+CREATE INDEX idx_news_category_created_id ON news_articles(category, created_at DESC, id DESC);
+CREATE INDEX idx_news_author_created_id ON news_articles(author_id, created_at DESC, id DESC);
+
+DROP INDEX idx_news_created;
+DROP INDEX idx_news_category;
+DROP INDEX idx_news_author;
@@ -0,0 +1,11 @@
+-- The feed ships comments_count and a short preview instead of every comment.
+ALTER TABLE news_articles ADD COLUMN comments_count INTEGER DEFAULT 0;
+
+UPDATE news_articles n
+SET comments_count = c.total
+FROM (SELECT article_id, COUNT(*) AS total FROM comments GROUP BY article_id) c
+WHERE c.article_id = n.id;
+
+-- Serves both the per-article preview and keyset paging of comments.
+CREATE INDEX idx_comments_article_created_id ON comments(article_id, created_at DESC, id DESC);
+DROP INDEX idx_comments_article;
@@ -0,0 +1,23 @@
+-- Full-text search for articles and the people directory.
+-- search_vector columns are generated, so Postgres keeps them current on
+-- every INSERT and UPDATE without triggers.
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+ALTER TABLE news_articles ADD COLUMN search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('russian', COALESCE(title, '')), 'A') ||
+        setweight(to_tsvector('russian', COALESCE(content, '')), 'B')
+    ) STORED;
+
+CREATE INDEX idx_news_search ON news_articles USING GIN (search_vector);
+
+ALTER TABLE users ADD COLUMN search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple', COALESCE(username, '')), 'A') ||
+        setweight(to_tsvector('russian', COALESCE(bio, '')), 'B')
+    ) STORED;
+
+CREATE INDEX idx_users_search ON users USING GIN (search_vector);
+
+-- Substring and fuzzy username matching (ILIKE '%term%', similarity()).
+CREATE INDEX idx_users_username_trgm ON users USING GIN (username gin_trgm_ops);
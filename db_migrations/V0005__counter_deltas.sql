@@ -0,0 +1,14 @@
+-- Write-behind counters: likes and subscriptions append a delta here instead
+-- of updating the hot news_articles / users row. Deltas are folded into the
+-- denormalised columns in batches (see backend/*/counters.py).
+CREATE TABLE counter_deltas (
+    id BIGSERIAL PRIMARY KEY,
+    entity VARCHAR(20) NOT NULL,
+    entity_id INTEGER NOT NULL,
+    field VARCHAR(30) NOT NULL,
+    delta INTEGER NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Pending-delta lookups when a write returns the up-to-date count.
+CREATE INDEX idx_counter_deltas_entity ON counter_deltas(entity, entity_id, field);
@@ -0,0 +1,10 @@
+-- Write counters per listing scope ('feed', 'category:<name>',
+-- 'author:<id>', 'likes:<user id>', 'users', 'subscriber:<id>'). Writers
+-- bump the scopes they affect in the same transaction; GET handlers derive
+-- ETag / Last-Modified from them with one primary-key lookup and answer 304
+-- without running the listing query (see backend/*/versions.py).
+CREATE TABLE content_versions (
+    scope VARCHAR(150) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 1,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
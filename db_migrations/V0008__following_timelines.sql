@@ -0,0 +1,30 @@
+-- Following feed, fan-out on write: every new article is copied into the
+-- timeline of each subscriber of its author (see backend/news/fanout.py).
+-- The primary key doubles as the keyset index for reading a timeline.
+CREATE TABLE timelines (
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    article_id INTEGER NOT NULL REFERENCES news_articles(id) ON DELETE CASCADE,
+    author_id INTEGER NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL,
+    PRIMARY KEY (user_id, created_at, article_id)
+);
+
+-- Pruning on unsubscribe and duplicate-free backfill on subscribe.
+CREATE UNIQUE INDEX idx_timelines_user_author_article ON timelines(user_id, author_id, article_id);
+
+-- Authors above the fan-out threshold are found by subscriber count and
+-- read at query time; also serves the users listing order.
+CREATE INDEX idx_users_subscribers_count ON users(subscribers_count DESC);
+
+-- Backfill existing subscriptions with each author's latest articles.
+INSERT INTO timelines (user_id, article_id, author_id, created_at)
+SELECT s.subscriber_id, n.id, n.author_id, n.created_at
+FROM subscriptions s
+CROSS JOIN LATERAL (
+    SELECT id, author_id, created_at
+    FROM news_articles
+    WHERE author_id = s.author_id
+    ORDER BY created_at DESC, id DESC
+    LIMIT 20
+) n
+ON CONFLICT DO NOTHING;
@@ -0,0 +1,50 @@
+-- Time-decayed "hot" ranking. Every engagement event adds
+-- weight * exp((t - epoch) / 45000) to an article's score, and every score
+-- decays at the same rate, so the order by the stored sum equals the order
+-- by the current decayed value. The sum is kept in log space (hot_score) so
+-- it never overflows and can be incremented in place:
+--   hot_score = ln(sum(weight_i * exp(epoch(t_i) / 45000)))
+-- 45000 s is a decay time of 12.5 h (the score halves in ~8.7 h).
+
+CREATE FUNCTION hot_contribution(weight DOUBLE PRECISION, at TIMESTAMPTZ)
+RETURNS DOUBLE PRECISION LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+    SELECT ln(weight) + extract(epoch FROM at)::float8 / 45000
+$$;
+
+-- Log-space addition of one event; weights <= 0 leave the score unchanged.
+-- The exponent is clamped because exp() raises on underflow.
+CREATE FUNCTION hot_add(score DOUBLE PRECISION, weight DOUBLE PRECISION, at TIMESTAMPTZ)
+RETURNS DOUBLE PRECISION LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+    SELECT CASE
+        WHEN weight <= 0 THEN score
+        WHEN score IS NULL THEN hot_contribution(weight, at)
+        ELSE GREATEST(score, hot_contribution(weight, at))
+             + ln(1 + exp(GREATEST(-abs(score - hot_contribution(weight, at)), -700)))
+    END
+$$;
+
+-- The default is the publication event (HOT_POST_WEIGHT = 3 in
+-- backend/*/counters.py); reconcile_counters() recomputes it exactly.
+ALTER TABLE news_articles
+    ADD COLUMN hot_score DOUBLE PRECISION NOT NULL DEFAULT hot_contribution(3, CURRENT_TIMESTAMP);
+
+UPDATE news_articles n SET hot_score = s.score
+FROM (
+    SELECT article_id, MAX(m) + ln(SUM(exp(GREATEST(c - m, -700)))) AS score
+    FROM (
+        SELECT article_id, c, MAX(c) OVER (PARTITION BY article_id) AS m
+        FROM (
+            SELECT id AS article_id, hot_contribution(3, created_at) AS c FROM news_articles
+            UNION ALL
+            SELECT article_id, hot_contribution(1, created_at) FROM likes
+            UNION ALL
+            SELECT article_id, hot_contribution(2, created_at) FROM comments
+        ) events
+    ) contributions
+    GROUP BY article_id
+) s
+WHERE n.id = s.article_id;
+
+-- sort=hot pages walk (hot_score, id) descending, overall and per category.
+CREATE INDEX idx_news_hot_id ON news_articles(hot_score DESC, id DESC);
+CREATE INDEX idx_news_category_hot_id ON news_articles(category, hot_score DESC, id DESC);
@@ -0,0 +1,15 @@
+-- Revoked session tokens (see backend/*/sessions.py). A row either names one
+-- token by its nonce, or revokes every token of user_id issued before
+-- not_before. Rows are only needed until the tokens they cover expire, so
+-- the table stays small and every instance keeps it in memory.
+CREATE TABLE session_revocations (
+    id BIGSERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    nonce VARCHAR(32),
+    not_before TIMESTAMPTZ,
+    expires_at TIMESTAMPTZ NOT NULL,
+    created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+    CHECK (nonce IS NOT NULL OR not_before IS NOT NULL)
+);
+
+CREATE INDEX idx_session_revocations_expires ON session_revocations(expires_at);
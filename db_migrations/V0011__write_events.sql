@@ -0,0 +1,16 @@
+-- Queue of accepted-but-unapplied likes and comments for the asynchronous
+-- ingestion mode (INGEST_MODE=async, see backend/news/ingest.py). A like
+-- event is one toggle; the consumer applies the parity of each user's
+-- toggles per article, so the result matches applying them one by one.
+CREATE TABLE write_events (
+    id BIGSERIAL PRIMARY KEY,
+    kind VARCHAR(16) NOT NULL CHECK (kind IN ('like', 'comment')),
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    article_id INTEGER NOT NULL,
+    content TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    CHECK (kind <> 'comment' OR content IS NOT NULL)
+);
+
+-- Pending toggles of one user on one article (optimistic like state).
+CREATE INDEX idx_write_events_likes ON write_events(article_id, user_id) WHERE kind = 'like';
@@ -0,0 +1,147 @@
+-- Range partitioning of the history tables (maintained by
+-- tools/partitions.py, which creates upcoming partitions and moves cold
+-- ones to an archive tablespace).
+--
+-- * news_articles and comments: one partition per calendar month (UTC) of
+--   created_at. Their primary keys become (id, created_at), because a
+--   partitioned table's unique keys must contain the partition key.
+-- * likes: ranges of LIKES_PARTITION_ARTICLES (100000) article ids. The like
+--   toggle relies on UNIQUE (article_id, user_id), which a created_at key
+--   could not enforce; article ids grow with publication time, so old
+--   articles' likes still end up in old partitions.
+--
+-- news_articles.id alone is no longer unique at the schema level, so the
+-- foreign keys that referenced it (comments, likes, timelines) are dropped;
+-- ids still come from one sequence. Each table gets a default partition so
+-- an insert outside the created ranges (e.g. a bulk import of old rows)
+-- never fails; `tools/partitions.py ensure` moves such rows out.
+
+ALTER TABLE timelines DROP CONSTRAINT timelines_article_id_fkey;
+
+ALTER TABLE news_articles RENAME TO news_articles_unpartitioned;
+ALTER TABLE comments RENAME TO comments_unpartitioned;
+ALTER TABLE likes RENAME TO likes_unpartitioned;
+ALTER SEQUENCE news_articles_id_seq OWNED BY NONE;
+ALTER SEQUENCE comments_id_seq OWNED BY NONE;
+ALTER SEQUENCE likes_id_seq OWNED BY NONE;
+
+CREATE TABLE news_articles (
+    id INTEGER NOT NULL DEFAULT nextval('news_articles_id_seq'),
+    title VARCHAR(255) NOT NULL,
+    content TEXT NOT NULL,
+    excerpt VARCHAR(500),
+    category VARCHAR(50) NOT NULL,
+    author_id INTEGER REFERENCES users(id),
+    likes_count INTEGER DEFAULT 0,
+    comments_count INTEGER DEFAULT 0,
+    hot_score DOUBLE PRECISION NOT NULL DEFAULT hot_contribution(3, CURRENT_TIMESTAMP),
+    created_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+    search_vector tsvector
+        GENERATED ALWAYS AS (
+            setweight(to_tsvector('russian', COALESCE(title, '')), 'A') ||
+            setweight(to_tsvector('russian', COALESCE(content, '')), 'B')
+        ) STORED
+) PARTITION BY RANGE (created_at);
+
+CREATE TABLE comments (
+    id INTEGER NOT NULL DEFAULT nextval('comments_id_seq'),
+    article_id INTEGER,
+    author_id INTEGER REFERENCES users(id),
+    content TEXT NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
+) PARTITION BY RANGE (created_at);
+
+CREATE TABLE likes (
+    id INTEGER NOT NULL DEFAULT nextval('likes_id_seq'),
+    article_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+) PARTITION BY RANGE (article_id);
+
+ALTER SEQUENCE news_articles_id_seq OWNED BY news_articles.id;
+ALTER SEQUENCE comments_id_seq OWNED BY comments.id;
+ALTER SEQUENCE likes_id_seq OWNED BY likes.id;
+
+-- Partitions from the oldest row's month to three months ahead, and id
+-- ranges up to two ranges past the newest article.
+DO $$
+DECLARE
+    first_month DATE;
+    month DATE;
+    table_name TEXT;
+    ranges INTEGER;
+BEGIN
+    SELECT date_trunc('month', LEAST(
+               (SELECT MIN(created_at) FROM news_articles_unpartitioned),
+               (SELECT MIN(created_at) FROM comments_unpartitioned),
+               CURRENT_TIMESTAMP) AT TIME ZONE 'UTC')::date
+    INTO first_month;
+
+    FOR month IN
+        SELECT generate_series(first_month,
+                               (date_trunc('month', CURRENT_TIMESTAMP AT TIME ZONE 'UTC') + interval '3 months')::date,
+                               interval '1 month')::date
+    LOOP
+        FOREACH table_name IN ARRAY ARRAY['news_articles', 'comments'] LOOP
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+                table_name || '_p' || to_char(month, 'YYYY_MM'), table_name,
+                month::text || ' 00:00:00+00', (month + interval '1 month')::date::text || ' 00:00:00+00'
+            );
+        END LOOP;
+    END LOOP;
+
+    SELECT COALESCE(MAX(id), 0) / 100000 + 2 INTO ranges FROM news_articles_unpartitioned;
+    FOR i IN 0..ranges LOOP
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF likes FOR VALUES FROM (%s) TO (%s)',
+            'likes_p' || lpad(i::text, 4, '0'), i * 100000, (i + 1) * 100000
+        );
+    END LOOP;
+END
+$$;
+
+CREATE TABLE news_articles_default PARTITION OF news_articles DEFAULT;
+CREATE TABLE comments_default PARTITION OF comments DEFAULT;
+CREATE TABLE likes_default PARTITION OF likes DEFAULT;
+
+INSERT INTO news_articles (id, title, content, excerpt, category, author_id, likes_count, comments_count,
+                           hot_score, created_at, updated_at)
+SELECT id, title, content, excerpt, category, author_id, likes_count, comments_count,
+       hot_score, COALESCE(created_at, updated_at, CURRENT_TIMESTAMP), updated_at
+FROM news_articles_unpartitioned;
+
+INSERT INTO comments (id, article_id, author_id, content, created_at)
+SELECT id, article_id, author_id, content, COALESCE(created_at, CURRENT_TIMESTAMP)
+FROM comments_unpartitioned;
+
+INSERT INTO likes (id, article_id, user_id, created_at)
+SELECT id, article_id, user_id, created_at
+FROM likes_unpartitioned
+WHERE article_id IS NOT NULL AND user_id IS NOT NULL;
+
+DROP TABLE likes_unpartitioned;
+DROP TABLE comments_unpartitioned;
+DROP TABLE news_articles_unpartitioned;
+
+-- Keys and indexes are declared on the parents and cascade to every
+-- partition, including the ones tools/partitions.py creates later.
+ALTER TABLE news_articles ADD PRIMARY KEY (id, created_at);
+CREATE INDEX idx_news_created_id ON news_articles(created_at DESC, id DESC);
+CREATE INDEX idx_news_category_created_id ON news_articles(category, created_at DESC, id DESC);
+CREATE INDEX idx_news_author_created_id ON news_articles(author_id, created_at DESC, id DESC);
+CREATE INDEX idx_news_hot_id ON news_articles(hot_score DESC, id DESC);
+CREATE INDEX idx_news_category_hot_id ON news_articles(category, hot_score DESC, id DESC);
+CREATE INDEX idx_news_search ON news_articles USING GIN (search_vector);
+
+ALTER TABLE comments ADD PRIMARY KEY (id, created_at);
+CREATE INDEX idx_comments_article_created_id ON comments(article_id, created_at DESC, id DESC);
+
+-- The primary key also serves lookups by article.
+ALTER TABLE likes ADD PRIMARY KEY (article_id, user_id);
+CREATE INDEX idx_likes_user ON likes(user_id);
+
+ANALYZE news_articles;
+ANALYZE comments;
+ANALYZE likes;
@@ -0,0 +1,28 @@
+-- Per-author statistics move out of the users row into a narrow table.
+-- Counter folds (backend/*/counters.py) update it incrementally from
+-- counter_deltas, so a like, subscription or publication no longer rewrites
+-- the wide users row (and its generated search vector). Author cards and
+-- the profile endpoint read it by primary key. Every user has a row:
+-- registration creates it and reconcile_counters() fills any gap.
+CREATE TABLE author_stats (
+    author_id INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+    subscribers_count INTEGER NOT NULL DEFAULT 0,
+    likes_count INTEGER NOT NULL DEFAULT 0,
+    publications_count INTEGER NOT NULL DEFAULT 0,
+    last_published_at TIMESTAMPTZ,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO author_stats (author_id, subscribers_count, likes_count, publications_count, last_published_at)
+SELECT u.id, COALESCE(u.subscribers_count, 0), COALESCE(u.likes_count, 0), COALESCE(u.publications_count, 0),
+       (SELECT MAX(n.created_at) FROM news_articles n WHERE n.author_id = u.id)
+FROM users u;
+
+-- Users directory order and the fan-out threshold lookup.
+CREATE INDEX idx_author_stats_subscribers ON author_stats(subscribers_count DESC);
+DROP INDEX idx_users_subscribers_count;
+
+ALTER TABLE users
+    DROP COLUMN subscribers_count,
+    DROP COLUMN likes_count,
+    DROP COLUMN publications_count;
@@ -0,0 +1,9 @@
+-- Search highlights are HTML: ts_headline wraps matches in <mark>, but
+-- copies the rest of the text verbatim. The handlers pass titles, bodies
+-- and bios through html_escape() first, so the only markup in a highlight
+-- is the <mark> pair ts_headline adds.
+CREATE FUNCTION html_escape(value TEXT)
+RETURNS TEXT LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+    SELECT replace(replace(replace(replace(replace(value,
+        '&', '&amp;'), '<', '&lt;'), '>', '&gt;'), '"', '&quot;'), '''', '&#39;')
+$$;
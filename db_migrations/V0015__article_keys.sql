@@ -0,0 +1,31 @@
+-- id -> created_at for every article. news_articles is partitioned by
+-- created_at, so a lookup by id alone probes the id index of every monthly
+-- partition. The request paths that start from an article id (like,
+-- comment, comment list) read created_at here first, with one primary-key
+-- probe, and then constrain news_articles on (id, created_at); the executor
+-- prunes to the one partition holding the article. A trigger on the
+-- partitioned parent keeps the table in step with inserts (including COPY
+-- imports) and deletes.
+CREATE TABLE article_keys (
+    id INTEGER PRIMARY KEY,
+    created_at TIMESTAMPTZ NOT NULL
+);
+
+INSERT INTO article_keys (id, created_at)
+SELECT id, created_at FROM news_articles;
+
+CREATE FUNCTION sync_article_keys() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        DELETE FROM article_keys WHERE id = OLD.id;
+        RETURN OLD;
+    END IF;
+    INSERT INTO article_keys (id, created_at) VALUES (NEW.id, NEW.created_at)
+    ON CONFLICT (id) DO UPDATE SET created_at = EXCLUDED.created_at;
+    RETURN NEW;
+END
+$$;
+
+CREATE TRIGGER news_articles_keys
+AFTER INSERT OR DELETE ON news_articles
+FOR EACH ROW EXECUTE FUNCTION sync_article_keys();
@@ -19,6 +19,28 @@ const API_BASE = {
   users: 'https://functions.poehali.dev/8adf62f7-3ea3-4c9a-a922-42649ef9aeef',
 };
 
+const SESSION_TOKEN_KEY = 'speltation_token';
+
+const WRITE_TOKEN_HEADER = 'X-Write-Token';
+// Time of this tab's last successful write; sent back on reads so the API
+// serves them from the primary until replicas have caught up.
+let lastWriteToken: string | null = null;
+
+const authHeaders = (json = false): Record<string, string> => {
+  const headers: Record<string, string> = json ? { 'Content-Type': 'application/json' } : {};
+  const token = localStorage.getItem(SESSION_TOKEN_KEY);
+  if (token) headers.Authorization = `Bearer ${token}`;
+  if (lastWriteToken) headers[WRITE_TOKEN_HEADER] = lastWriteToken;
+  return headers;
+};
+
+const apiFetch = async (input: string, init?: RequestInit) => {
+  const response = await fetch(input, init);
+  const writeToken = response.headers.get(WRITE_TOKEN_HEADER);
+  if (writeToken) lastWriteToken = writeToken;
+  return response;
+};
+
 type User = {
   id: number;
   username: string;
@@ -33,13 +55,26 @@ type User = {
 };
 
 type Comment = {
-  id: number;
+  id: number | null;
+  event_id?: number;
+  pending?: boolean;
   content: string;
   author_name: string;
   author_avatar: string | null;
   timestamp: string;
 };
 
+// Served by the users function (action=authors); the feed only carries author_id.
+type AuthorCard = {
+  id: number;
+  username: string;
+  avatar_url: string | null;
+  subscribers_count: number;
+  likes_count: number;
+  publications_count: number;
+  last_published_at: string | null;
+};
+
 type NewsArticle = {
   id: number;
   title: string;
@@ -47,14 +82,10 @@ type NewsArticle = {
   excerpt: string;
   category: string;
   author_id: number;
-  author_name: string;
-  author_avatar: string | null;
-  subscribers_count: number;
-  author_total_likes: number;
-  publications_count: number;
   date: string;
   likes_count: number;
   comments: Comment[];
+  comments_count: number;
   is_liked: boolean;
 };
 
@@ -79,6 +110,7 @@ const Index = () => {
   const [categoryFilter, setCategoryFilter] = useState<string>('all');
   const [news, setNews] = useState<NewsArticle[]>([]);
   const [authors, setAuthors] = useState<User[]>([]);
+  const [authorCards, setAuthorCards] = useState<Record<number, AuthorCard>>({});
   const [currentUser, setCurrentUser] = useState<User | null>(null);
   const [selectedArticle, setSelectedArticle] = useState<number | null>(null);
   const [newComment, setNewComment] = useState('');
@@ -104,7 +136,7 @@ const Index = () => {
 
   useEffect(() => {
     const savedUser = localStorage.getItem('speltation_user');
-    if (savedUser) {
+    if (savedUser && localStorage.getItem(SESSION_TOKEN_KEY)) {
       setCurrentUser(JSON.parse(savedUser));
     }
     loadNews();
@@ -116,21 +148,73 @@ const Index = () => {
     loadAuthors();
   }, [currentUser]);
 
+  const dropExpiredSession = (response: Response) => {
+    if (response.status !== 401 || !localStorage.getItem(SESSION_TOKEN_KEY)) return false;
+    localStorage.removeItem(SESSION_TOKEN_KEY);
+    localStorage.removeItem('speltation_user');
+    setCurrentUser(null);
+    return true;
+  };
+
   const loadNews = async () => {
     try {
-      const userId = currentUser?.id || '';
-      const response = await fetch(`${API_BASE.news}?user_id=${userId}`);
+      const response = await apiFetch(`${API_BASE.news}?humanize=1`, { headers: authHeaders() });
+      if (dropExpiredSession(response)) return;
       const data = await response.json();
-      setNews(data.articles || []);
+      const articles: NewsArticle[] = data.articles || [];
+      setNews(articles);
+      loadAuthorCards(articles.map(article => article.author_id));
     } catch (error) {
       console.error('Error loading news:', error);
     }
   };
 
+  const loadAuthorCards = async (authorIds: number[]) => {
+    const ids = [...new Set(authorIds)];
+    if (ids.length === 0) return;
+    try {
+      // Revalidated with the browser cache (ETag per author set), so
+      // unchanged cards cost a 304.
+      const response = await apiFetch(`${API_BASE.users}?action=authors&ids=${ids.join(',')}`, { headers: authHeaders() });
+      if (!response.ok) return;
+      const data = await response.json();
+      setAuthorCards(prev => {
+        const next = { ...prev };
+        for (const card of data.authors as AuthorCard[]) next[card.id] = card;
+        return next;
+      });
+    } catch (error) {
+      console.error('Error loading author cards:', error);
+    }
+  };
+
+  const loadComments = async (articleId: number) => {
+    try {
+      const response = await apiFetch(`${API_BASE.news}?action=comments&article_id=${articleId}&humanize=1`, { headers: authHeaders() });
+      const data = await response.json();
+      if (response.ok) {
+        setNews(prev => prev.map(article =>
+          article.id === articleId ? { ...article, comments: data.comments } : article
+        ));
+      }
+    } catch (error) {
+      console.error('Error loading comments:', error);
+    }
+  };
+
+  const toggleComments = (articleId: number) => {
+    if (selectedArticle === articleId) {
+      setSelectedArticle(null);
+      return;
+    }
+    setSelectedArticle(articleId);
+    loadComments(articleId);
+  };
+
   const loadAuthors = async () => {
     try {
-      const userId = currentUser?.id || '';
-      const response = await fetch(`${API_BASE.users}?current_user_id=${userId}`);
+      const response = await apiFetch(API_BASE.users, { headers: authHeaders() });
+      if (dropExpiredSession(response)) return;
       const data = await response.json();
       setAuthors(data.users || []);
     } catch (error) {
@@ -146,7 +230,7 @@ const Index = () => {
 
     setLoading(true);
     try {
-      const response = await fetch(API_BASE.auth, {
+      const response = await apiFetch(API_BASE.auth, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({
@@ -163,6 +247,7 @@ const Index = () => {
         return;
       }
 
+      localStorage.setItem(SESSION_TOKEN_KEY, data.token);
       setCurrentUser(data.user);
       localStorage.setItem('speltation_user', JSON.stringify(data.user));
       setShowAuth(false);
@@ -182,8 +267,14 @@ const Index = () => {
   };
 
   const handleLogout = () => {
+    fetch(API_BASE.auth, {
+      method: 'POST',
+      headers: authHeaders(true),
+      body: JSON.stringify({ action: 'logout' }),
+    }).catch(() => {});
     setCurrentUser(null);
     localStorage.removeItem('speltation_user');
+    localStorage.removeItem(SESSION_TOKEN_KEY);
     toast({ title: 'Вы вышли из системы' });
     loadNews();
     loadAuthors();
@@ -202,15 +293,14 @@ const Index = () => {
 
     setLoading(true);
     try {
-      const response = await fetch(API_BASE.news, {
+      const response = await apiFetch(API_BASE.news, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: authHeaders(true),
         body: JSON.stringify({
           action: 'create',
           title: newTitle,
           content: newContent,
           category: newCategory,
-          author_id: currentUser.id,
         }),
       });
 
@@ -244,13 +334,12 @@ const Index = () => {
     }
 
     try {
-      const response = await fetch(API_BASE.news, {
+      const response = await apiFetch(API_BASE.news, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: authHeaders(true),
         body: JSON.stringify({
           action: 'like',
           article_id: articleId,
-          user_id: currentUser.id,
         }),
       });
 
@@ -277,12 +366,11 @@ const Index = () => {
     }
 
     try {
-      const response = await fetch(API_BASE.users, {
+      const response = await apiFetch(API_BASE.users, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: authHeaders(true),
         body: JSON.stringify({
           action: 'subscribe',
-          subscriber_id: currentUser.id,
           author_id: authorId,
         }),
       });
@@ -312,14 +400,14 @@ const Index = () => {
     if (!newComment.trim()) return;
 
     try {
-      const response = await fetch(API_BASE.news, {
+      const response = await apiFetch(API_BASE.news, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: authHeaders(true),
         body: JSON.stringify({
           action: 'comment',
           article_id: articleId,
-          author_id: currentUser.id,
           content: newComment,
+          humanize: true,
         }),
       });
 
@@ -328,7 +416,7 @@ const Index = () => {
       if (response.ok) {
         setNews(news.map(article =>
           article.id === articleId
-            ? { ...article, comments: [...article.comments, data.comment] }
+            ? { ...article, comments: [...article.comments, data.comment], comments_count: article.comments_count + 1 }
             : article
         ));
         setNewComment('');
@@ -344,13 +432,10 @@ const Index = () => {
     if (!currentUser) return;
 
     try {
-      const response = await fetch(API_BASE.auth, {
+      const response = await apiFetch(API_BASE.auth, {
         method: 'PUT',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({
-          user_id: currentUser.id,
-          ...updates,
-        }),
+        headers: authHeaders(true),
+        body: JSON.stringify(updates),
       });
 
       const data = await response.json();
@@ -372,12 +457,11 @@ const Index = () => {
     }
 
     try {
-      const response = await fetch(API_BASE.auth, {
+      const response = await apiFetch(API_BASE.auth, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: authHeaders(true),
         body: JSON.stringify({
           action: 'change_password',
-          user_id: currentUser.id,
           old_password: oldPassword,
           new_password: newPassword,
         }),
@@ -386,6 +470,7 @@ const Index = () => {
       const data = await response.json();
 
       if (response.ok) {
+        localStorage.setItem(SESSION_TOKEN_KEY, data.token);
         setShowChangePassword(false);
         setOldPassword('');
         setNewPassword('');
@@ -441,20 +526,14 @@ const Index = () => {
     }
   };
 
-  const getUserBadges = (user: User | { subscribers_count: number; author_total_likes: number; publications_count: number }) => {
-    return BADGES.filter(badge => {
-      const u = { 
-        subscribers_count: user.subscribers_count, 
-        likes_count: 'author_total_likes' in user ? user.author_total_likes : (user as User).likes_count,
-        publications_count: user.publications_count 
-      } as User;
-      return badge.check(u);
-    });
+  const getUserBadges = (user: User | AuthorCard | undefined) => {
+    if (!user) return [];
+    return BADGES.filter(badge => badge.check(user as User));
   };
 
   const filteredNews = news.filter(article => {
     const matchesSearch = article.title.toLowerCase().includes(searchQuery.toLowerCase()) ||
-      article.author_name.toLowerCase().includes(searchQuery.toLowerCase());
+      (authorCards[article.author_id]?.username ?? '').toLowerCase().includes(searchQuery.toLowerCase());
     const matchesCategory = categoryFilter === 'all' || article.category === categoryFilter;
     return matchesSearch && matchesCategory;
   });
@@ -723,14 +802,14 @@ const Index = () => {
                   <div className="flex items-start justify-between mb-4">
                     <div className="flex items-center gap-3">
                       <Avatar>
-                        <AvatarImage src={article.author_avatar || '/placeholder.svg'} />
-                        <AvatarFallback>{article.author_name[0]}</AvatarFallback>
+                        <AvatarImage src={authorCards[article.author_id]?.avatar_url || '/placeholder.svg'} />
+                        <AvatarFallback>{authorCards[article.author_id]?.username[0] ?? '?'}</AvatarFallback>
                       </Avatar>
                       <div>
                         <div className="flex items-center gap-2">
-                          <p className="font-semibold text-foreground">{article.author_name}</p>
+                          <p className="font-semibold text-foreground">{authorCards[article.author_id]?.username ?? '…'}</p>
                           <div className="flex gap-1">
-                            {getUserBadges(article).map(badge => (
+                            {getUserBadges(authorCards[article.author_id]).map(badge => (
                               <span key={badge.id} className="text-sm" title={badge.name}>{badge.icon}</span>
                             ))}
                           </div>
@@ -759,10 +838,10 @@ const Index = () => {
                     <Button
                       variant="ghost"
                       size="sm"
-                      onClick={() => setSelectedArticle(selectedArticle === article.id ? null : article.id)}
+                      onClick={() => toggleComments(article.id)}
                     >
                       <Icon name="MessageCircle" size={18} className="mr-2" />
-                      {article.comments.length}
+                      {article.comments_count}
                     </Button>
                   </div>
 
@@ -795,7 +874,7 @@ const Index = () => {
 
                       <div className="space-y-3">
                         {article.comments.map(comment => (
-                          <div key={comment.id} className="flex gap-3 animate-scale-in">
+                          <div key={comment.id ?? `pending-${comment.event_id}`} className="flex gap-3 animate-scale-in">
                             <Avatar className="w-8 h-8">
                               <AvatarImage src={comment.author_avatar || '/placeholder.svg'} />
                               <AvatarFallback>{comment.author_name[0]}</AvatarFallback>
@@ -0,0 +1,248 @@
+'''
+Bulk NDJSON import / export through Postgres COPY.
+
+    DATABASE_URL=postgres://... python tools/bulk_content.py export users -o users.ndjson
+    DATABASE_URL=postgres://... python tools/bulk_content.py import users -i users.ndjson
+    DATABASE_URL=postgres://... python tools/bulk_content.py recount
+
+Rows are streamed in both directions (one JSON object per line), so memory
+stays bounded by the COPY buffer regardless of table size. Import tables in
+dependency order (users, articles, comments, likes, subscriptions); each
+table loads in a single COPY and transaction, keeps the ids from the file and
+moves the id sequence past them.
+
+Comments dated before their article are moved up to the article's
+created_at on import: the feed and the comments endpoint only show comments
+created after their article, and the partitions are pruned on that bound.
+
+The denormalised columns (comments_count, likes_count and the author_stats
+table) are never imported. They are recomputed in one set-based
+pass after each import, or once with `recount` when importing with
+--no-recount.
+'''
+
+import argparse
+import json
+import os
+import sys
+from typing import IO, Any, Dict, Iterator, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'backend', 'news'))
+
+import psycopg2  # noqa: E402
+import counters  # noqa: E402
+
+COPY_BUFFER = 1 << 16
+
+# Exported columns per table; IMPORT_COLUMNS drops the aggregates.
+TABLES: Dict[str, str] = {
+    'users': 'users',
+    'articles': 'news_articles',
+    'comments': 'comments',
+    'likes': 'likes',
+    'subscriptions': 'subscriptions'
+}
+EXPORT_COLUMNS: Dict[str, List[str]] = {
+    'users': ['id', 'username', 'password_hash', 'avatar_url', 'bio', 'dark_theme', 'sound_enabled', 'created_at'],
+    'articles': ['id', 'title', 'content', 'excerpt', 'category', 'author_id', 'likes_count', 'comments_count',
+                 'created_at', 'updated_at'],
+    'comments': ['id', 'article_id', 'author_id', 'content', 'created_at'],
+    'likes': ['id', 'article_id', 'user_id', 'created_at'],
+    'subscriptions': ['id', 'subscriber_id', 'author_id', 'created_at']
+}
+AGGREGATE_COLUMNS = {'subscribers_count', 'likes_count', 'publications_count', 'comments_count'}
+IMPORT_COLUMNS: Dict[str, List[str]] = {
+    name: [column for column in columns if column not in AGGREGATE_COLUMNS]
+    for name, columns in EXPORT_COLUMNS.items()
+}
+
+# Counts that are not write-behind counters; likes and author_stats are
+# handled by counters.reconcile_counters(). Only the comments the API shows
+# (created no earlier than their article) are counted.
+RECOUNT_SQL = '''
+    WITH comment_totals AS (
+        SELECT c.article_id, COUNT(*) AS total
+        FROM comments c
+        JOIN article_keys k ON k.id = c.article_id
+        WHERE c.created_at >= k.created_at
+        GROUP BY c.article_id
+    ), articles AS (
+        UPDATE news_articles n SET comments_count = COALESCE(c.total, 0)
+        FROM news_articles x
+        LEFT JOIN comment_totals c ON c.article_id = x.id
+        WHERE n.id = x.id AND n.comments_count IS DISTINCT FROM COALESCE(c.total, 0)
+        RETURNING 1
+    )
+    SELECT COUNT(*) AS articles_fixed FROM articles
+'''
+
+CLAMP_COMMENTS_SQL = '''
+    UPDATE comments c SET created_at = k.created_at
+    FROM article_keys k
+    WHERE k.id = c.article_id AND c.created_at < k.created_at
+'''
+
+# Seeds following-feed timelines for imported subscriptions and articles,
+# like db_migrations/V0008__following_timelines.sql.
+TIMELINES_SQL = '''
+    INSERT INTO timelines (user_id, article_id, author_id, created_at)
+    SELECT s.subscriber_id, n.id, n.author_id, n.created_at
+    FROM subscriptions s
+    CROSS JOIN LATERAL (
+        SELECT id, author_id, created_at
+        FROM news_articles
+        WHERE author_id = s.author_id
+        ORDER BY created_at DESC, id DESC
+        LIMIT 20
+    ) n
+    ON CONFLICT DO NOTHING
+'''
+
+
+def copy_text_value(value: Any) -> str:
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value, ensure_ascii=False)
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+class NdjsonCopySource:
+    '''File-like reader that turns NDJSON lines into COPY text rows on demand.'''
+
+    def __init__(self, lines: Iterator[str], columns: List[str]):
+        self.lines = lines
+        self.columns = columns
+        self.rows = 0
+        self._buffer = ''
+
+    def _next_row(self) -> Optional[str]:
+        for line in self.lines:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            self.rows += 1
+            return '\t'.join(copy_text_value(record.get(column)) for column in self.columns) + '\n'
+        return None
+
+    def read(self, size: int = -1) -> str:
+        while size < 0 or len(self._buffer) < size:
+            row = self._next_row()
+            if row is None:
+                break
+            self._buffer += row
+        if size < 0:
+            size = len(self._buffer)
+        chunk, self._buffer = self._buffer[:size], self._buffer[size:]
+        return chunk
+
+
+def export_table(conn: Any, name: str, output: IO[str]) -> None:
+    columns = ', '.join(EXPORT_COLUMNS[name])
+    # row_to_json escapes every control character, so with CSV quoting and
+    # delimiter set to \x01 / \x02 COPY writes each JSON document verbatim.
+    with conn.cursor() as cur:
+        cur.copy_expert(
+            f"COPY (SELECT row_to_json(t) FROM (SELECT {columns} FROM {TABLES[name]} ORDER BY id) t) "
+            "TO STDOUT WITH (FORMAT csv, QUOTE E'\\x01', DELIMITER E'\\x02')",
+            output,
+            COPY_BUFFER
+        )
+    conn.rollback()
+
+
+def import_table(conn: Any, name: str, source: IO[str]) -> int:
+    table = TABLES[name]
+    lines = iter(source)
+    first = next(lines, None)
+    if first is None:
+        return 0
+    # The first record decides which columns the file carries; anything the
+    # file omits gets the column default.
+    present = json.loads(first)
+    columns = [column for column in IMPORT_COLUMNS[name] if column in present]
+    reader = NdjsonCopySource(_chain(first, lines), columns)
+
+    with conn.cursor() as cur:
+        cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", reader, COPY_BUFFER)
+        if name == 'comments':
+            cur.execute(CLAMP_COMMENTS_SQL)
+            if cur.rowcount:
+                print(f'moved {cur.rowcount} comments dated before their article to its created_at',
+                      file=sys.stderr)
+        if 'id' in columns:
+            cur.execute(
+                f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), COALESCE(MAX(id), 0) + 1, false) "
+                f"FROM {table}"
+            )
+    conn.commit()
+    return reader.rows
+
+
+def _chain(first: str, rest: Iterator[str]) -> Iterator[str]:
+    yield first
+    yield from rest
+
+
+def recount(conn: Any) -> Dict[str, int]:
+    with conn.cursor() as cur:
+        cur.execute(RECOUNT_SQL)
+        articles_fixed = cur.fetchone()[0]
+        cur.execute(TIMELINES_SQL)
+        timelines = cur.rowcount
+        # Imported rows can land in any listing: invalidate every scope.
+        cur.execute('UPDATE content_versions SET version = version + 1, updated_at = CURRENT_TIMESTAMP')
+    conn.commit()
+    result = counters.reconcile_counters(conn)
+    return {
+        'comments_fixed': articles_fixed,
+        'likes_fixed': result['articles_fixed'],
+        'author_stats_fixed': result['users_fixed'],
+        'hot_fixed': result['hot_fixed'],
+        'timelines_added': timelines
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Stream NDJSON in and out of the content tables')
+    commands = parser.add_subparsers(dest='command', required=True)
+    export_parser = commands.add_parser('export')
+    export_parser.add_argument('table', choices=list(TABLES))
+    export_parser.add_argument('-o', '--output', help='file to write (default: stdout)')
+    import_parser = commands.add_parser('import')
+    import_parser.add_argument('table', choices=list(TABLES))
+    import_parser.add_argument('-i', '--input', help='file to read (default: stdin)')
+    import_parser.add_argument('--no-recount', action='store_true', help='skip recomputing aggregates')
+    commands.add_parser('recount')
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    try:
+        if args.command == 'export':
+            if args.output:
+                with open(args.output, 'w', encoding='utf-8') as output:
+                    export_table(conn, args.table, output)
+            else:
+                export_table(conn, args.table, sys.stdout)
+        elif args.command == 'import':
+            if args.input:
+                with open(args.input, encoding='utf-8') as source:
+                    rows = import_table(conn, args.table, source)
+            else:
+                rows = import_table(conn, args.table, sys.stdin)
+            print(f'imported {rows} rows into {TABLES[args.table]}', file=sys.stderr)
+            if not args.no_recount:
+                args.command = 'recount'
+        if args.command == 'recount':
+            result = recount(conn)
+            print(', '.join(f'{key} {value}' for key, value in result.items()), file=sys.stderr)
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+'''
+Consumer job for asynchronously ingested likes and comments.
+
+    DATABASE_URL=postgres://... python tools/drain_events.py [--batch-size 5000]
+
+Applies every queued write_events row (see backend/news/ingest.py) in
+batches, then folds the resulting counter deltas. Schedule it (e.g. every
+few seconds) when INGEST_MODE=async, so events are applied even while no
+writes arrive to trigger an opportunistic drain.
+'''
+
+import argparse
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'backend', 'news'))
+
+import psycopg2  # noqa: E402
+import counters  # noqa: E402
+import ingest  # noqa: E402
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Apply queued likes and comments')
+    parser.add_argument('--batch-size', type=int, default=ingest.INGEST_BATCH)
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    try:
+        totals = {'drained': 0, 'likes_added': 0, 'likes_removed': 0, 'comments_added': 0}
+        while True:
+            result = ingest.drain_events(conn, args.batch_size)
+            for key, value in result.items():
+                totals[key] += value
+            if result['drained'] < args.batch_size:
+                break
+        folded = counters.fold_deltas(conn)
+        print(
+            f"applied {totals['drained']} events: {totals['likes_added']} likes added, "
+            f"{totals['likes_removed']} removed, {totals['comments_added']} comments; folded {folded} deltas"
+        )
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,295 @@
+'''
+Partition maintenance for news_articles, comments and likes (see
+db_migrations/V0012__partitioning.sql).
+
+    DATABASE_URL=postgres://... python tools/partitions.py ensure [--months-ahead 3]
+    DATABASE_URL=postgres://... python tools/partitions.py archive --tablespace archive [--keep-months 12]
+    DATABASE_URL=postgres://... python tools/partitions.py check
+    DATABASE_URL=postgres://... python tools/partitions.py list
+
+`ensure` creates the monthly partitions up to --months-ahead months from now
+and the likes id ranges past the newest article, and moves any rows that
+landed in a default partition into the partition created for them (run it
+daily, and after bulk imports). `archive` moves partitions older than
+--keep-months, with their indexes, to a slower tablespace; the rows stay
+queryable. `check` runs EXPLAIN ANALYZE on the feed, comment and like
+queries of backend/news/index.py and reports how many partitions each one
+actually scanned.
+'''
+
+import argparse
+import json
+import os
+from datetime import date, datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import psycopg2
+
+MONTHLY_TABLES = ('news_articles', 'comments')
+# Must match the range size used by V0012__partitioning.sql.
+LIKES_PARTITION_ARTICLES = 100_000
+LIKES_RANGES_AHEAD = 2
+
+
+def add_months(month: date, count: int) -> date:
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def current_month() -> date:
+    return datetime.now(timezone.utc).date().replace(day=1)
+
+
+def month_bound(month: date) -> str:
+    return f'{month.isoformat()} 00:00:00+00'
+
+
+def insertable_columns(cur: Any, table: str) -> List[str]:
+    cur.execute(
+        '''SELECT column_name FROM information_schema.columns
+           WHERE table_schema = current_schema() AND table_name = %s AND is_generated = 'NEVER'
+           ORDER BY ordinal_position''',
+        (table,)
+    )
+    return [row[0] for row in cur.fetchall()]
+
+
+def create_partition(conn: Any, parent: str, name: str, key: str, lower: Any, upper: Any) -> int:
+    '''
+    Create `name` for [lower, upper) unless it exists. Rows of that range
+    already sitting in the default partition are moved into it before it is
+    attached, because attaching would otherwise fail. Returns rows moved.
+    '''
+    with conn.cursor() as cur:
+        cur.execute('SELECT to_regclass(%s) IS NOT NULL', (name,))
+        if cur.fetchone()[0]:
+            conn.rollback()
+            return 0
+        columns = ', '.join(insertable_columns(cur, parent))
+        cur.execute(f'CREATE TABLE {name} (LIKE {parent} INCLUDING DEFAULTS INCLUDING GENERATED INCLUDING CONSTRAINTS)')
+        cur.execute(
+            f'''WITH moved AS (
+                    DELETE FROM {parent}_default WHERE {key} >= %(lower)s AND {key} < %(upper)s
+                    RETURNING {columns}
+                )
+                INSERT INTO {name} ({columns}) SELECT {columns} FROM moved''',
+            {'lower': lower, 'upper': upper}
+        )
+        moved = cur.rowcount
+        if parent == 'news_articles' and moved:
+            # The delete from the default partition fired the article_keys
+            # trigger; the rows still exist, in the new partition.
+            cur.execute(
+                f'INSERT INTO article_keys (id, created_at) SELECT id, created_at FROM {name} '
+                'ON CONFLICT (id) DO NOTHING'
+            )
+        cur.execute(f'ALTER TABLE {parent} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)', (lower, upper))
+    conn.commit()
+    return moved
+
+
+def default_months(cur: Any, table: str) -> List[date]:
+    cur.execute(
+        f'''SELECT DISTINCT date_trunc('month', created_at AT TIME ZONE 'UTC')::date
+            FROM {table}_default WHERE created_at IS NOT NULL'''
+    )
+    return [row[0] for row in cur.fetchall()]
+
+
+def ensure(conn: Any, months_ahead: int) -> None:
+    current = current_month()
+    for table in MONTHLY_TABLES:
+        with conn.cursor() as cur:
+            months = set(default_months(cur, table))
+        conn.rollback()
+        months.update(add_months(current, offset) for offset in range(months_ahead + 1))
+        for month in sorted(months):
+            name = f"{table}_p{month.strftime('%Y_%m')}"
+            moved = create_partition(conn, table, name, 'created_at', month_bound(month), month_bound(add_months(month, 1)))
+            if moved:
+                print(f'{name}: moved {moved} rows out of {table}_default')
+
+    with conn.cursor() as cur:
+        cur.execute('SELECT last_value FROM news_articles_id_seq')
+        newest = cur.fetchone()[0]
+        cur.execute('SELECT DISTINCT article_id / %s FROM likes_default', (LIKES_PARTITION_ARTICLES,))
+        ranges = {row[0] for row in cur.fetchall()}
+    conn.rollback()
+    ranges.update(range(newest // LIKES_PARTITION_ARTICLES + LIKES_RANGES_AHEAD + 1))
+    for index in sorted(ranges):
+        name = f'likes_p{index:04d}'
+        lower = index * LIKES_PARTITION_ARTICLES
+        moved = create_partition(conn, 'likes', name, 'article_id', lower, lower + LIKES_PARTITION_ARTICLES)
+        if moved:
+            print(f'{name}: moved {moved} rows out of likes_default')
+
+
+def partitions(cur: Any, parent: str) -> List[Tuple[str, str, Optional[str]]]:
+    '''(name, bound expression, tablespace) of every partition of `parent`.'''
+    cur.execute(
+        '''SELECT c.relname, pg_get_expr(c.relpartbound, c.oid), t.spcname
+           FROM pg_inherits i
+           JOIN pg_class c ON c.oid = i.inhrelid
+           LEFT JOIN pg_tablespace t ON t.oid = c.reltablespace
+           WHERE i.inhparent = %s::regclass
+           ORDER BY c.relname''',
+        (parent,)
+    )
+    return cur.fetchall()
+
+
+def move_to_tablespace(conn: Any, name: str, tablespace: str) -> None:
+    with conn.cursor() as cur:
+        cur.execute(f'ALTER TABLE {name} SET TABLESPACE {tablespace}')
+        cur.execute('SELECT indexrelid::regclass::text FROM pg_index WHERE indrelid = %s::regclass', (name,))
+        for (index,) in cur.fetchall():
+            cur.execute(f'ALTER INDEX {index} SET TABLESPACE {tablespace}')
+    conn.commit()
+
+
+def archive(conn: Any, tablespace: str, keep_months: int) -> None:
+    cutoff = add_months(current_month(), -keep_months)
+    cold: List[str] = []
+    with conn.cursor() as cur:
+        for table in MONTHLY_TABLES:
+            for name, _, current in partitions(cur, table):
+                month = name.rpartition('_p')[2]
+                if current != tablespace and name != f'{table}_default' and month < cutoff.strftime('%Y_%m'):
+                    cold.append(name)
+        # A likes range is cold once every article in it predates the cutoff.
+        cur.execute(
+            'SELECT COALESCE(MIN(id), (SELECT last_value FROM news_articles_id_seq) + 1) FROM news_articles '
+            'WHERE created_at >= %s',
+            (month_bound(cutoff),)
+        )
+        first_recent = cur.fetchone()[0]
+        for name, _, current in partitions(cur, 'likes'):
+            if current == tablespace or name == 'likes_default':
+                continue
+            if (int(name.rpartition('_p')[2]) + 1) * LIKES_PARTITION_ARTICLES <= first_recent:
+                cold.append(name)
+    conn.rollback()
+    for name in cold:
+        move_to_tablespace(conn, name, tablespace)
+        print(f'{name} -> {tablespace}')
+
+
+# Representative statements with the predicates index.py uses; the cursor
+# values are the newest row's, so a page scans the newest partitions.
+CHECKS: Dict[str, str] = {
+    'feed first page': '''
+        SELECT n.id FROM news_articles n
+        ORDER BY n.created_at DESC, n.id DESC LIMIT 51''',
+    'feed cursor page': '''
+        SELECT n.id FROM news_articles n
+        WHERE (n.created_at, n.id) < (%(cursor_at)s, %(cursor_id)s) AND n.created_at <= %(cursor_at)s
+        ORDER BY n.created_at DESC, n.id DESC LIMIT 51''',
+    'category cursor page': '''
+        SELECT n.id FROM news_articles n
+        WHERE n.category = %(category)s
+          AND (n.created_at, n.id) < (%(cursor_at)s, %(cursor_id)s) AND n.created_at <= %(cursor_at)s
+        ORDER BY n.created_at DESC, n.id DESC LIMIT 51''',
+    'comment previews': '''
+        SELECT n.id, (SELECT COUNT(*) FROM (
+            SELECT c.id FROM comments c
+            WHERE c.article_id = n.id AND c.created_at >= n.created_at
+            ORDER BY c.created_at DESC, c.id DESC LIMIT 3) c)
+        FROM news_articles n
+        ORDER BY n.created_at DESC, n.id DESC LIMIT 51''',
+    'comments of an article': '''
+        SELECT c.id FROM comments c
+        WHERE c.article_id = %(cursor_id)s
+          AND c.created_at >= (SELECT created_at FROM article_keys WHERE id = %(cursor_id)s)
+        ORDER BY c.created_at DESC, c.id DESC LIMIT 51''',
+    'article by id': '''
+        SELECT n.likes_count FROM news_articles n
+        WHERE n.id = %(cursor_id)s
+          AND n.created_at = (SELECT created_at FROM article_keys WHERE id = %(cursor_id)s)''',
+    'likes of a page': '''
+        SELECT article_id FROM likes WHERE user_id = %(user_id)s AND article_id = ANY(%(article_ids)s)''',
+    'search': '''
+        SELECT n.id FROM news_articles n
+        WHERE n.search_vector @@ websearch_to_tsquery('russian', %(category)s)
+        ORDER BY ts_rank_cd(n.search_vector, websearch_to_tsquery('russian', %(category)s)) DESC, n.id DESC
+        LIMIT 51''',
+}
+
+
+def plan_nodes(node: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    yield node
+    for child in node.get('Plans', []):
+        yield from plan_nodes(child)
+
+
+def check(conn: Any) -> None:
+    with conn.cursor() as cur:
+        cur.execute(
+            '''SELECT n.id, n.created_at, n.category, COALESCE(n.author_id, 0)
+               FROM news_articles n ORDER BY n.created_at DESC, n.id DESC LIMIT 1'''
+        )
+        newest = cur.fetchone()
+        if newest is None:
+            print('no articles to check against')
+            return
+        article_id, created_at, category, user_id = newest
+        params = {
+            'cursor_at': created_at,
+            'cursor_id': article_id,
+            'category': category,
+            'user_id': user_id,
+            'article_ids': list(range(max(article_id - 50, 0), article_id + 1))
+        }
+        totals = {parent: len(partitions(cur, parent)) for parent in MONTHLY_TABLES + ('likes',)}
+        for name, sql in CHECKS.items():
+            cur.execute('EXPLAIN (ANALYZE, FORMAT JSON) ' + sql, params)
+            plan = cur.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            scanned: Dict[str, set] = {parent: set() for parent in totals}
+            for node in plan_nodes(plan[0]['Plan']):
+                relation = node.get('Relation Name') or ''
+                for parent in totals:
+                    if relation.startswith(parent + '_') and node.get('Actual Loops', 0) > 0:
+                        scanned[parent].add(relation)
+            report = ', '.join(
+                f'{len(found)}/{totals[parent]} {parent}' for parent, found in scanned.items() if found
+            )
+            print(f'{name:<24} scanned {report or "no partitions"}')
+    conn.rollback()
+
+
+def list_partitions(conn: Any) -> None:
+    with conn.cursor() as cur:
+        for parent in MONTHLY_TABLES + ('likes',):
+            for name, bound, tablespace in partitions(cur, parent):
+                cur.execute('SELECT pg_total_relation_size(%s::regclass)', (name,))
+                size = cur.fetchone()[0]
+                print(f'{name:<28} {size / 1048576:10.1f} MB  {tablespace or "default":<12} {bound}')
+    conn.rollback()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Maintain partitions of the history tables')
+    parser.add_argument('command', choices=['ensure', 'archive', 'check', 'list'])
+    parser.add_argument('--months-ahead', type=int, default=3)
+    parser.add_argument('--tablespace')
+    parser.add_argument('--keep-months', type=int, default=12)
+    args = parser.parse_args()
+    if args.command == 'archive' and not args.tablespace:
+        parser.error('archive requires --tablespace')
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    try:
+        if args.command == 'ensure':
+            ensure(conn, args.months_ahead)
+        elif args.command == 'archive':
+            archive(conn, args.tablespace, args.keep_months)
+        elif args.command == 'check':
+            check(conn)
+        else:
+            list_partitions(conn)
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
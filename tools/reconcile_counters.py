@@ -0,0 +1,51 @@
+'''
+Maintenance job for the write-behind counters.
+
+    DATABASE_URL=postgres://... python tools/reconcile_counters.py fold
+    DATABASE_URL=postgres://... python tools/reconcile_counters.py reconcile
+
+`fold` drains every pending counter delta into news_articles/author_stats.
+`reconcile` recomputes likes_count and the author_stats row of every user
+exactly from the likes, subscriptions and news_articles tables, and
+hot_score from likes and comments (run it periodically, e.g. nightly).
+'''
+
+import argparse
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'backend', 'news'))
+
+import psycopg2  # noqa: E402
+import counters  # noqa: E402
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Fold or reconcile denormalised counters')
+    parser.add_argument('command', choices=['fold', 'reconcile'])
+    parser.add_argument('--batch-size', type=int, default=counters.COUNTER_FOLD_BATCH)
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    try:
+        if args.command == 'fold':
+            total = 0
+            while True:
+                folded = counters.fold_deltas(conn, args.batch_size)
+                total += folded
+                if folded < args.batch_size:
+                    break
+            print(f'folded {total} deltas')
+        else:
+            result = counters.reconcile_counters(conn)
+            print(
+                f"drained {result['drained']} deltas, fixed {result['articles_fixed']} articles, "
+                f"{result['users_fixed']} users and {result['hot_fixed']} hot scores"
+            )
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()